@@ -1,18 +1,16 @@
 """An AWS Python Pulumi program"""
+import time
+_start = time.perf_counter()
+
 import os
 import pulumi
-import modules.vpc as vpc
-import modules.efs as efs
-import modules.eks as eks
-import modules.ec2 as ec2
-import modules.eks_lb_controller as ekslb
-import modules.load_balancing as lb
-import modules.route53 as route53
+import modules.loader as loader
 from modules.autotag import register_auto_tags
 from config import AWSPulumiConfig
-from pulumi import StackReference
 from constants import Constants as CONST
-# NOTE CONDITIONAL IMPORTS BELOW FOR RDS
+# NOTE: modules are imported through the loader, only when the stack config enables them
+
+loader.record('core', _start)
 
 project = pulumi.get_project()
 org     = pulumi.get_organization()
@@ -35,33 +33,40 @@ def get_readme(stack):
     return 'No documentation found'
 
 if stack == 'foundation':
+    vpc = loader.load('vpc')
     vpc_data = vpc.define_vpc(config)
 else:
-    stack_ref = StackReference(f'{org}/{project}/foundation')
+    foundation = loader.load('foundation')
+    stack_ref = foundation.reference(config, org, project)
     vpc_data = stack_ref.get_output('vpc_data')
 
 if stack == 'jenkins-ec2':
     if config.ec2_enabled():
+        ec2 = loader.load('ec2')
         instances = ec2.define_ec2(config, vpc_data)
         if config.lb_enabled():
+            lb = loader.load('load_balancing')
+            route53 = loader.load('route53')
             load_balancer = lb.define_lb(config, vpc_data, instances)
             route53.define_dns(config, load_balancer.dns_name)
 
 if config.rds_enabled():
     if config.instance_requested():
-        import modules.rds_instance as rds
-    elif config.cluster_requested():
-        import modules.rds_cluster as rds
+        rds = loader.load('rds_instance')
+    elif config.cluster_requested() or config.aurora_requested():
+        rds = loader.load('rds_cluster')
     else:
         raise ValueError('Unable to load an RDS module. Check your rds.aws_rds_type value')
 
     rds_install = rds.define_rds(config, vpc_data)
 
 if config.efs_enabled():
+    efs = loader.load('efs')
     efs_data = efs.define_efs(config, vpc_data)
 
 if stack.endswith('-eks'):
     if config.eks_enabled():
+        eks = loader.load('eks')
         _data = eks.define_cluster(config, vpc_data)
         cluster_obj = _data['cluster']
         node_role = _data['node_role']
@@ -70,11 +75,21 @@ if stack.endswith('-eks'):
         k8s_provider = eks.k8sProvider(config, cluster_obj)
 
         if config.lb_controller_enabled():
+            ekslb = loader.load('eks_lb_controller')
             lb_resources = ekslb.define_lb_controller(config, k8s_provider, node_groups, vpc_data['vpc_id'])
 
+        if config.autoscaler_enabled():
+            autoscaler = loader.load('eks_autoscaler')
+            autoscaler_resources = autoscaler.define_autoscaler(config, k8s_provider, node_groups, _data, vpc_data)
+
         if config.efs_csi_driver_enabled():
-            efs_controller = efs.define_efs_controller(config, k8s_provider, node_groups)
+            efs = loader.load('efs')
+            efs_controller = efs.define_efs_controller(config, k8s_provider, node_groups, efs_data)
 
         addons = eks.define_addons(config, k8s_provider, node_groups)
+        if config.eks.storage_classes:
+            storage_classes = eks.define_storage_classes(config, k8s_provider, addons)
 
 pulumi.export('readme', get_readme(stack))
+
+loader.report()
@@ -0,0 +1,75 @@
+"""Micro-benchmark for the auto-tag stack transformation.
+
+Replays mocked resource registrations through modules.autotag._auto_tag and compares the
+indexed lookup against a linear scan of the static taggable_resource_types list.
+
+    python benchmarks/bench_autotag.py [--registrations 10000]
+"""
+import argparse
+import os
+import sys
+import time
+from itertools import cycle, islice
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import taggable
+from modules.autotag import _auto_tag
+
+## Roughly the mix of types a std-eks preview registers
+TYPE_MIX = [
+    'aws:ec2/subnet:Subnet',
+    'aws:ec2/routeTableAssociation:RouteTableAssociation',
+    'aws:iam/rolePolicyAttachment:RolePolicyAttachment',
+    'aws:iam/role:Role',
+    'aws:iam/policy:Policy',
+    'aws:ec2/securityGroup:SecurityGroup',
+    'aws:eks/nodeGroup:NodeGroup',
+    'aws:eks/addon:Addon',
+    'aws:efs/mountTarget:MountTarget',
+    'aws:ec2/launchTemplate:LaunchTemplate',
+    'kubernetes:helm.sh/v3:Release',
+    'kubernetes:core/v1:ServiceAccount',
+    'pulumi:providers:kubernetes',
+    'eks:index:Cluster',
+]
+
+AUTO_TAGS = {'user': 'bench', 'environment': 'bench', 'purpose': 'bench'}
+
+def _registrations(count: int) -> list:
+    return [
+        SimpleNamespace(type_=t, props={'tags': {'Name': 'bench'}}, opts=None)
+        for t in islice(cycle(TYPE_MIX), count)
+    ]
+
+def _linear_auto_tag(args, auto_tags):
+    ## The original implementation: a linear `in` over the static list
+    if args.type_ in taggable.taggable_resource_types:
+        args.props['tags'] = {**(args.props.get('tags') or {}), **auto_tags}
+        return args.props
+
+def _run(fn, regs: list) -> float:
+    start = time.perf_counter()
+    for args in regs:
+        fn(args, AUTO_TAGS)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--registrations', type=int, default=10000)
+    opts = parser.parse_args()
+
+    start = time.perf_counter()
+    types = taggable.get_taggable_types()
+    load = time.perf_counter() - start
+
+    linear = _run(_linear_auto_tag, _registrations(opts.registrations))
+    indexed = _run(_auto_tag, _registrations(opts.registrations))
+
+    print(f'taggable types: {len(types)} (static list: {len(taggable.taggable_resource_types)}), index load: {load * 1000:.2f}ms')
+    print(f'{opts.registrations} registrations')
+    print(f'  linear scan: {linear * 1000:8.2f}ms ({linear / opts.registrations * 1e6:.3f}us/registration)')
+    print(f'  indexed:     {indexed * 1000:8.2f}ms ({indexed / opts.registrations * 1e6:.3f}us/registration)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Program-evaluation benchmarks: run __main__.py for every stack under Pulumi mocks.
+
+Every scenario runs in a fresh interpreter, so import cost, module level caches and peak memory are
+measured per scenario. Reported per scenario: wall time (including interpreter start and imports),
+program evaluation time, import time, resource registrations, invokes and peak RSS.
+
+    python benchmarks/bench_program.py [--subnets 2 4 8] [--ec2-count 1 5 10] [--addons 1 4 8]
+                                       [--node-groups 2 4 8] [--repeat 3] [--output results.json]
+                                       [--baseline baseline.json] [--threshold 0.2]
+
+With --baseline, the results are compared against a previous --output file and the exit code is 1
+when wall time, evaluation time or peak memory regressed by more than --threshold.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'tests'))
+
+## The stacks, and the scale knobs that apply to them
+STACKS = {
+    'foundation': ('subnets',),
+    'jenkins-ec2': ('ec2_count',),
+    'std-eks': ('addons', 'node_groups'),
+}
+DEFAULTS = {'subnets': 2, 'ec2_count': 1, 'addons': 1, 'node_groups': 2}
+
+## Metrics compared against the baseline, and the counts that are reported when they change
+TIMED_METRICS = ('wall_s', 'eval_s', 'peak_rss_mb')
+COUNTED_METRICS = ('registrations', 'invokes')
+
+
+def _stack_config(stack: str, knobs: dict) -> dict:
+    import yaml
+    from constants import Constants as CONST
+
+    with open(os.path.join(CONST.PATH_STACK_CONFIGS, f'sc-{stack}.example.yaml'), 'r') as f:
+        config = yaml.safe_load(f)
+
+    aws = config['aws']
+    if stack == 'foundation':
+        aws['vpc']['num_private_subnets'] = knobs['subnets']
+        aws['vpc']['num_public_subnets'] = knobs['subnets']
+    if stack == 'jenkins-ec2':
+        aws['ec2']['count'] = knobs['ec2_count']
+    if stack == 'std-eks':
+        _version = aws['eks']['addons'][0]['version'] if aws['eks'].get('addons') else 'v1.0.0-eksbuild.1'
+        aws['eks']['addons'] = [
+            {'name': 'aws-ebs-csi-driver' if i == 0 else f'addon-{i}', 'version': _version}
+            for i in range(knobs['addons'])
+        ]
+    return config
+
+
+def run_scenario(stack: str, knobs: dict) -> dict:
+    ## Runs one stack under mocks in this process; meant to be called in a fresh interpreter
+    from mocks import ProgramMocks, FOUNDATION_VPC_DATA, run_program
+
+    config = _stack_config(stack, knobs)
+    vpc_data = dict(FOUNDATION_VPC_DATA)
+    vpc_data['private_subnets'] = [f'subnet-prv{i:05d}' for i in range(knobs['node_groups'])]
+    mocks = ProgramMocks(vpc_data=vpc_data, azs=max(4, knobs['subnets']))
+
+    eval_s = run_program(stack, config, mocks)
+
+    import modules.loader as loader
+    return {
+        'eval_s': eval_s,
+        'import_ms': sum(v['ms'] for v in loader.import_report().values()),
+        'registrations': sum(mocks.registrations.values()),
+        'registrations_by_type': dict(sorted(mocks.registrations.items())),
+        'invokes': sum(mocks.invokes.values()),
+        'invokes_by_token': dict(sorted(mocks.invokes.items())),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _run_in_subprocess(stack: str, knobs: dict) -> dict:
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, __file__, '--run-scenario', json.dumps({'stack': stack, 'knobs': knobs})],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    wall_s = time.perf_counter() - start
+    if out.returncode != 0:
+        raise RuntimeError(f'{stack} {knobs} failed:\n{out.stderr}')
+
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result['wall_s'] = wall_s
+    return result
+
+
+def scenarios(opts) -> list:
+    ## Each knob is varied on its own, the others stay at their defaults
+    values = {
+        'subnets': opts.subnets,
+        'ec2_count': opts.ec2_count,
+        'addons': opts.addons,
+        'node_groups': opts.node_groups,
+    }
+    _scenarios = []
+    for stack, knobs in STACKS.items():
+        if opts.stacks and stack not in opts.stacks:
+            continue
+        _scenarios.append((stack, dict(DEFAULTS)))
+        for knob in knobs:
+            for value in values[knob]:
+                if value != DEFAULTS[knob]:
+                    _scenarios.append((stack, DEFAULTS | {knob: value}))
+    return _scenarios
+
+
+def scenario_name(stack: str, knobs: dict) -> str:
+    return stack + ''.join(f' {k}={v}' for k, v in knobs.items() if k in STACKS[stack])
+
+
+def run(opts) -> dict:
+    results = {}
+    for stack, knobs in scenarios(opts):
+        runs = [_run_in_subprocess(stack, knobs) for _ in range(opts.repeat)]
+        result = runs[-1]
+        for metric in ('wall_s', 'eval_s', 'import_ms', 'peak_rss_mb'):
+            result[metric] = round(statistics.median(r[metric] for r in runs), 4)
+
+        name = scenario_name(stack, knobs)
+        results[name] = {'stack': stack, 'knobs': knobs, **result}
+        print(f'{name:40} wall {result["wall_s"]:7.3f}s  eval {result["eval_s"]:7.3f}s  '
+              f'imports {result["import_ms"]:8.1f}ms  resources {result["registrations"]:4}  '
+              f'invokes {result["invokes"]:3}  peak {result["peak_rss_mb"]:7.1f}MB')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f'{name:40} not in baseline')
+            continue
+
+        changes = []
+        for metric in TIMED_METRICS:
+            if not base.get(metric):
+                continue
+            ratio = result[metric] / base[metric]
+            changes.append(f'{metric} {(ratio - 1) * 100:+.1f}%')
+            if ratio > 1 + threshold:
+                regressions.append(f'{name}: {metric} {base[metric]} -> {result[metric]}')
+        for metric in COUNTED_METRICS:
+            if result[metric] != base.get(metric):
+                changes.append(f'{metric} {base.get(metric)} -> {result[metric]}')
+        print(f'{name:40} ' + ', '.join(changes))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stacks', nargs='+', choices=list(STACKS.keys()))
+    parser.add_argument('--subnets', nargs='+', type=int, default=[2, 4, 8])
+    parser.add_argument('--ec2-count', nargs='+', type=int, default=[1, 5, 10])
+    parser.add_argument('--addons', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--node-groups', nargs='+', type=int, default=[2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this json file')
+    parser.add_argument('--baseline', help='compare the results with this json file (a previous --output)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before it is a regression')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.run_scenario:
+        scenario = json.loads(opts.run_scenario)
+        print(json.dumps(run_scenario(scenario['stack'], scenario['knobs'])))
+        return
+
+    results = run(opts)
+
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if opts.baseline:
+        with open(opts.baseline, 'r') as f:
+            baseline = json.load(f)
+        print(f'\nCompared with {opts.baseline}:')
+        regressions = compare(results, baseline, opts.threshold)
+        if regressions:
+            print('\nRegressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,97 +1,808 @@
+import copy
+import dataclasses
+import hashlib
+import os
+import pickle
+import re
+import typing
+from dataclasses import dataclass, field
+from typing import Optional
+
 import yaml
 
 from constants import Constants as CONST
+import modules.subnets as subnets
+
+## Use the libyaml backed loader when it's available, it's several times faster than the pure python one
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def merge_values(base: dict, override: dict) -> dict:
+    ## A deep copy of base with override merged in, nested mappings are merged key by key
+    merged = copy.deepcopy(base)
+    for k, v in override.items():
+        if isinstance(v, dict) and isinstance(merged.get(k), dict):
+            merged[k] = merge_values(merged[k], v)
+        else:
+            merged[k] = copy.deepcopy(v)
+    return merged
+
+## Typed sections of the stack config (stack-configs/sc-<stack>.yaml). Fields without a default are
+## required, unless the section is disabled. Unknown keys are rejected so typos don't go unnoticed.
+
+@dataclass(slots=True, kw_only=True)
+class MinMax:
+    min: int
+    max: int
+
+@dataclass(slots=True, kw_only=True)
+class VpcEndpointsConfig:
+    ## Gateway endpoints (s3, dynamodb) go on the private route tables, interface endpoints in the
+    ## private subnets, one per AZ
+    gateway: list[str] = field(default_factory=list)
+    interface: list[str] = field(default_factory=list)
+    private_dns: bool = True
+
+@dataclass(slots=True, kw_only=True)
+class VpcConfig:
+    cidr: str
+    subnet_size: Optional[int] = None
+    num_private_subnets: Optional[int] = None
+    num_public_subnets: Optional[int] = None
+    az_placement: str = 'name'
+    az_cache_ttl: Optional[int] = None
+    nat_mode: str = 'single'
+    endpoints: VpcEndpointsConfig = field(default_factory=VpcEndpointsConfig)
+    ## Per tier subnet sizes, subnet_size when not set. Pod subnets are carved out of secondary_cidrs.
+    private_subnet_size: Optional[int] = None
+    public_subnet_size: Optional[int] = None
+    secondary_cidrs: list[str] = field(default_factory=list)
+    num_pod_subnets: int = 0
+    pod_subnet_size: Optional[int] = None
+    ## Dual-stack: an Amazon-provided IPv6 block for the VPC, and a /64 of it for every subnet
+    ipv6: bool = False
+
+@dataclass(slots=True, kw_only=True)
+class Ec2Config:
+    enabled: bool = False
+    count: int = 1
+    instance_type: str
+    iam_instance_profile: Optional[str] = None
+    ## Without an ami, the latest Amazon Linux 2023 for the architecture (x86_64 or arm64, by default
+    ## the instance type's)
+    ami: Optional[str] = None
+    architecture: Optional[str] = None
+    key_name: Optional[str] = None
+    security_group: dict = field(default_factory=dict)
+    tags: dict = field(default_factory=dict)
+
+@dataclass(slots=True, kw_only=True)
+class LbConfig:
+    enabled: bool = False
+    type: str = 'application'
+    certificate_arn: str
+    security_group: dict = field(default_factory=dict)
+
+@dataclass(slots=True, kw_only=True)
+class CsiDriverConfig:
+    enabled: bool = False
+    version: Optional[str] = None
+
+@dataclass(slots=True, kw_only=True)
+class EfsStorageClassConfig:
+    ## A StorageClass for the file system with the CSI driver: every PVC gets an access point of its own,
+    ## a directory under base_path owned by uid/gid (a gid from the driver's range when not set)
+    enabled: bool = True
+    name: str = 'efs-ap'
+    base_path: str = '/dynamic'
+    directory_perms: str = '700'
+    uid: Optional[int] = None
+    gid: Optional[int] = None
+    reclaim_policy: str = 'Delete'
+
+@dataclass(slots=True, kw_only=True)
+class EfsConfig:
+    enabled: bool = False
+    transition_to_ia: str = 'AFTER_30_DAYS'
+    ## elastic scales with the I/O and has no burst credits to run out of, provisioned is a fixed
+    ## provisioned_throughput in MiB/s. maxIO (bursting or provisioned only) replaces the file system.
+    throughput_mode: str = 'bursting'
+    provisioned_throughput: Optional[int] = None
+    performance_mode: str = 'generalPurpose'
+    csi_driver: CsiDriverConfig = field(default_factory=CsiDriverConfig)
+    storage_class: EfsStorageClassConfig = field(default_factory=EfsStorageClassConfig)
+
+@dataclass(slots=True, kw_only=True)
+class NodeVolumeConfig:
+    ## An EBS volume of the nodes. size in GiB, the AMI's when not set. iops (gp3, io1, io2) and
+    ## throughput in MiB/s (gp3) above the gp3 baseline of 3000 and 125 speed up image pulls and builds.
+    size: Optional[int] = None
+    type: str = 'gp3'
+    iops: Optional[int] = None
+    throughput: Optional[int] = None
+    encrypted: bool = True
+    ## data_volume only: a snapshot of a data volume with images pulled already, and the images
+    ## tools/image_snapshot.py pulls to build it
+    snapshot_id: Optional[str] = None
+    images: list[str] = field(default_factory=list)
+
+@dataclass(slots=True, kw_only=True)
+class NodeStorageConfig:
+    root_volume: Optional[NodeVolumeConfig] = None
+    ## A second volume for /var/lib/containerd (images and container layers)
+    data_volume: Optional[NodeVolumeConfig] = None
+    ebs_optimized: Optional[bool] = None
+    ## Put containerd, kubelet and pod logs on the NVMe instance store (RAID0 over all of its disks), for
+    ## instance types that have one (m6id, c6gd, ...)
+    instance_store: bool = False
+
+@dataclass(slots=True, kw_only=True)
+class NodeGroupsConfig:
+    instance_types: list[str]
+    memory_mib: MinMax
+    vcpu_count: MinMax
+    ## x86_64 or arm64 (Graviton) and AL2023 or BOTTLEROCKET pick the EKS-optimized AMI. EKS's default
+    ## (AL2023 x86_64) when neither is set.
+    architecture: Optional[str] = None
+    ami_family: Optional[str] = None
+    ## kubelet max-pods. Computed from instance_types when the vpc-cni addon has prefix delegation on.
+    max_pods: Optional[int] = None
+    storage: NodeStorageConfig = field(default_factory=NodeStorageConfig)
+
+@dataclass(slots=True, kw_only=True)
+class TaintConfig:
+    key: str
+    value: Optional[str] = None
+    effect: str = 'NO_SCHEDULE'
+
+@dataclass(slots=True, kw_only=True)
+class NodePoolConfig:
+    ## Managed node groups of their own: one per private subnet (placement: per_az) or a single one over
+    ## all of them (multi_az). The instance settings left out come from eks.node_groups, the sizes from
+    ## eks.desired_nodes_per_group and eks.max_nodes_per_group (min_size defaults to desired_size).
+    name: str
+    capacity_type: str = 'ON_DEMAND'
+    placement: str = 'per_az'
+    instance_types: Optional[list[str]] = None
+    architecture: Optional[str] = None
+    ami_family: Optional[str] = None
+    memory_mib: Optional[MinMax] = None
+    vcpu_count: Optional[MinMax] = None
+    max_pods: Optional[int] = None
+    storage: Optional[NodeStorageConfig] = None
+    labels: dict = field(default_factory=dict)
+    taints: list[TaintConfig] = field(default_factory=list)
+    min_size: Optional[int] = None
+    desired_size: Optional[int] = None
+    max_size: Optional[int] = None
+
+    def node_groups(self, defaults: NodeGroupsConfig) -> NodeGroupsConfig:
+        ## The pool's instance settings, eks.node_groups for what it doesn't set
+        overrides = {}
+        for name in ('instance_types', 'architecture', 'ami_family', 'memory_mib', 'vcpu_count', 'max_pods', 'storage'):
+            if getattr(self, name) is not None:
+                overrides[name] = getattr(self, name)
+        return dataclasses.replace(defaults, **overrides)
+
+@dataclass(slots=True, kw_only=True)
+class LbControllerConfig:
+    enabled: bool = False
+    role_name_prefix: str = 'aws-load-balancer-controller-iam-role'
+    service_role_name: str = 'aws-load-balancer-controller'
+
+@dataclass(slots=True, kw_only=True)
+class ClusterAutoscalerConfig:
+    ## See the cluster-autoscaler FAQ for these flags. image_tag defaults to the one matching eks.version.
+    image_tag: Optional[str] = None
+    expander: str = 'least-waste'
+    scan_interval: str = '10s'
+    new_pod_scale_up_delay: str = '0s'
+    max_node_provision_time: str = '15m'
+    scale_down_delay_after_add: str = '10m'
+    scale_down_unneeded_time: str = '10m'
+    scale_down_utilization_threshold: float = 0.5
+
+@dataclass(slots=True, kw_only=True)
+class KarpenterConfig:
+    ## The NodePool takes its instance requirements from eks.node_groups. cpu_limit defaults to what the
+    ## node groups could scale to (max_nodes_per_group * vcpu_count.max per group).
+    capacity_types: list[str] = field(default_factory=lambda: ['on-demand'])
+    ## al2023@latest, or bottlerocket@latest for Bottlerocket node groups, when not set
+    ami_alias: Optional[str] = None
+    consolidation_policy: str = 'WhenEmptyOrUnderutilized'
+    consolidate_after: str = '1m'
+    cpu_limit: Optional[int] = None
+
+@dataclass(slots=True, kw_only=True)
+class AutoscalerConfig:
+    enabled: bool = False
+    type: str = 'cluster-autoscaler'
+    ## Helm chart version, the one in the chart's data file when not set
+    version: Optional[str] = None
+    service_role_name: Optional[str] = None
+    cluster_autoscaler: ClusterAutoscalerConfig = field(default_factory=ClusterAutoscalerConfig)
+    karpenter: KarpenterConfig = field(default_factory=KarpenterConfig)
+
+@dataclass(slots=True, kw_only=True)
+class AddonConfig:
+    name: str
+    version: str
+    ## A named set of configuration values (CONST.ADDON_PROFILES), and values of our own on top of it.
+    ## aws eks describe-addon-configuration --addon-name the-addon-name --addon-version the-version
+    profile: Optional[str] = None
+    configuration_values: dict = field(default_factory=dict)
+
+    def configuration(self) -> dict:
+        profile = CONST.ADDON_PROFILES.get(self.name, {}).get(self.profile, {}) if self.profile else {}
+        return merge_values(profile, self.configuration_values or {})
+
+@dataclass(slots=True, kw_only=True)
+class StorageClassConfig:
+    ## An EBS StorageClass of the aws-ebs-csi-driver addon. iops for gp3, io1 and io2, throughput in MiB/s
+    ## for gp3, zones (allowed topologies) are AZ names, any when not set.
+    name: str
+    type: str = 'gp3'
+    iops: Optional[int] = None
+    throughput: Optional[int] = None
+    encrypted: bool = True
+    kms_key_id: Optional[str] = None
+    fs_type: str = 'ext4'
+    zones: list[str] = field(default_factory=list)
+    reclaim_policy: str = 'Delete'
+    allow_volume_expansion: bool = True
+    default: bool = False
+
+@dataclass(slots=True, kw_only=True)
+class EksConfig:
+    enabled: bool = False
+    version: str
+    desired_nodes_per_group: int
+    max_nodes_per_group: int
+    node_groups: NodeGroupsConfig
+    ## Without node_pools, eks.node_groups is a single on-demand pool named default
+    node_pools: list[NodePoolConfig] = field(default_factory=list)
+    ## ipv6 needs a dual-stack VPC (vpc.ipv6 in the foundation stack)
+    ip_family: str = 'ipv4'
+    loadbalancer_controller: LbControllerConfig = field(default_factory=LbControllerConfig)
+    autoscaler: AutoscalerConfig = field(default_factory=AutoscalerConfig)
+    addons: list[AddonConfig] = field(default_factory=list)
+    storage_classes: list[StorageClassConfig] = field(default_factory=list)
+
+@dataclass(slots=True, kw_only=True)
+class RdsReplicasConfig:
+    ## Read replicas of an rds instance, in availability_zones in turn (any AZ of the subnet group when
+    ## not set), with a reader name in the private zone: {subdomain}-ro.{resource_prefix}.{tld}
+    count: int = 0
+    instance_class: Optional[str] = None
+    availability_zones: list[str] = field(default_factory=list)
+
+@dataclass(slots=True, kw_only=True)
+class RdsProxyConfig:
+    ## An RDS Proxy in front of the rds instance, with the master user secret. Pools at most
+    ## max_connections_percent of the database's max_connections.
+    enabled: bool = False
+    max_connections_percent: int = 90
+    max_idle_connections_percent: int = 50
+    ## Seconds a client waits for a pooled connection, and a client connection may stay idle
+    connection_borrow_timeout: int = 120
+    idle_client_timeout: int = 1800
+    require_tls: bool = True
+    iam_auth: bool = False
+
+@dataclass(slots=True, kw_only=True)
+class RdsTuningConfig:
+    ## Parameter group values sized for instance_class (and read replica classes) and the storage's IOPS,
+    ## rds.parameters override them. The values are exported as rds_tuning.
+    enabled: bool = False
+    profile: str = 'oltp'
+
+@dataclass(slots=True, kw_only=True)
+class AuroraAutoscalingConfig:
+    ## Application Auto Scaling adds readers (up to max_readers) while the readers' average metric (cpu:
+    ## CPU utilization in %, connections: database connections) is above target, and removes them again
+    enabled: bool = False
+    min_readers: int = 1
+    max_readers: int = 3
+    metric: str = 'cpu'
+    target: float = 70
+    ## Seconds after a scaling activity before the next one
+    scale_in_cooldown: int = 300
+    scale_out_cooldown: int = 300
+
+@dataclass(slots=True, kw_only=True)
+class AuroraConfig:
+    ## rds.aws_rds_type: aurora, a writer and readers ClusterInstances. db.serverless instances scale
+    ## between min_capacity and max_capacity ACUs (an ACU is ~2 GiB of memory), in steps of 0.5.
+    instance_class: str = 'db.serverless'
+    min_capacity: float = 0.5
+    max_capacity: float = 8
+    readers: int = 1
+    autoscaling: AuroraAutoscalingConfig = field(default_factory=AuroraAutoscalingConfig)
+
+@dataclass(slots=True, kw_only=True)
+class RdsConfig:
+    enabled: bool = False
+    aws_rds_type: str
+    storage: int
+    storage_type: str
+    engine: str
+    engine_version: str
+    family: str
+    instance_class: str
+    port: int
+    db_name: str
+    db_user: str
+    subdomain: str
+    tld: str
+    parameters: dict = field(default_factory=dict)
+    tuning: RdsTuningConfig = field(default_factory=RdsTuningConfig)
+    read_replicas: RdsReplicasConfig = field(default_factory=RdsReplicasConfig)
+    proxy: RdsProxyConfig = field(default_factory=RdsProxyConfig)
+    aurora: AuroraConfig = field(default_factory=AuroraConfig)
+    ## Computed: {subdomain}.{resource_prefix}.{tld}
+    fqdn_internal: Optional[str] = None
+
+@dataclass(slots=True, kw_only=True)
+class FoundationSnapshotConfig:
+    ## Read the foundation stack's outputs from a local snapshot instead of a StackReference
+    enabled: bool = False
+    ## Seconds a snapshot is good for, 0 for no limit
+    max_age: int = 86400
+    ## Also compare the snapshot with the foundation stack's last update (asks the backend)
+    verify: bool = False
+    file: Optional[str] = None
+
+## Typed top level sections
+TOP_SECTIONS = {
+    'foundation_snapshot': FoundationSnapshotConfig,
+}
+
+## The aws.* sections and the types they're parsed into
+SECTIONS = {
+    'vpc': VpcConfig,
+    'ec2': Ec2Config,
+    'lb': LbConfig,
+    'efs': EfsConfig,
+    'eks': EksConfig,
+    'rds': RdsConfig,
+}
+
+## Part of the compiled config cache key, so a change to the schema invalidates cached configs
+with open(__file__, 'rb') as _f:
+    _SCHEMA_DIGEST = hashlib.sha256(_f.read()).digest()
+
+## Scalar types a yaml value may have for a field of the given type
+_SCALARS = {
+    int: (int,),
+    float: (int, float),
+    str: (str,),
+    bool: (bool,),
+    list: (list,),
+    dict: (dict,),
+}
+
+def _parse(tp, value, path: str, errors: list, required: bool = True):
+    if typing.get_origin(tp) is typing.Union:
+        if value is None:
+            return None
+        tp = next(t for t in typing.get_args(tp) if t is not type(None))
+
+    if value is None:
+        return None
+
+    if dataclasses.is_dataclass(tp):
+        return _parse_section(tp, value, path, errors, required)
+
+    if typing.get_origin(tp) is list:
+        if not isinstance(value, list):
+            errors.append(f'{path}: expected a list, got {type(value).__name__}')
+            return None
+        (item_tp,) = typing.get_args(tp)
+        return [_parse(item_tp, v, f'{path}[{i}]', errors, required) for i, v in enumerate(value)]
+
+    tp = typing.get_origin(tp) or tp
+    allowed = _SCALARS.get(tp, (tp,))
+    ## yaml gives us a bool for !!bool, don't let that pass as a number (or the other way around)
+    if not isinstance(value, allowed) or (isinstance(value, bool) and bool not in allowed):
+        errors.append(f'{path}: expected {tp.__name__}, got {type(value).__name__} ({value!r})')
+        return None
+
+    return value
+
+def _parse_section(cls, data, path: str, errors: list, required: bool = True):
+    if not isinstance(data, dict):
+        errors.append(f'{path}: expected a mapping, got {type(data).__name__}')
+        return None
+
+    ## A disabled section doesn't need to be complete
+    if 'enabled' in data and data['enabled'] is False:
+        required = False
+
+    hints = typing.get_type_hints(cls)
+    fields = {f.name: f for f in dataclasses.fields(cls)}
+
+    for key in data:
+        if key not in fields:
+            errors.append(f'{path}.{key}: unknown setting')
+
+    values = {}
+    for name, f in fields.items():
+        if name in data:
+            values[name] = _parse(hints[name], data[name], f'{path}.{name}', errors, required)
+        elif f.default is dataclasses.MISSING and f.default_factory is dataclasses.MISSING:
+            if required:
+                errors.append(f'{path}.{name}: required setting is missing')
+            values[name] = None
+
+    return cls(**values)
+
+def _read_config(config_file: str) -> dict:
+    if not os.path.isfile(config_file):
+        raise OSError(f'File {config_file} does not exist')
+
+    with open(file=config_file, mode='rb') as f:
+        raw = f.read()
+
+    ## Parsed and validated configs are cached by content: in this process, and on disk (.cache/config)
+    ## for the next run
+    digest = hashlib.sha256(raw + _SCHEMA_DIGEST).hexdigest()
+    if digest in _compiled:
+        return pickle.loads(_compiled[digest])
+
+    cache_file = os.path.join(CONST.PATH_CACHE, 'config', f'{os.path.basename(config_file)}.{digest[:16]}.pickle')
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                _compiled[digest] = f.read()
+            return pickle.loads(_compiled[digest])
+        except (OSError, pickle.UnpicklingError, AttributeError, TypeError):
+            _compiled.pop(digest, None)
+
+    config = yaml.load(raw, Loader=YamlLoader)
+    if not config:
+        raise OSError(f'File {config_file} is empty')
+
+    aws = config.get('aws') or {}
+    errors = []
+    compiled = {
+        'top': {k: v for k, v in config.items() if k != 'aws' and k not in TOP_SECTIONS},
+        'tags': aws.get('tags') or {},
+        'sections': {
+            name: _parse_section(cls, aws[name], f'aws.{name}', errors) if aws.get(name) is not None else None
+            for name, cls in SECTIONS.items()
+        } | {
+            name: _parse_section(cls, config[name], name, errors) if config.get(name) is not None else cls()
+            for name, cls in TOP_SECTIONS.items()
+        },
+    }
+    for key in aws:
+        if key != 'tags' and key not in SECTIONS:
+            errors.append(f'aws.{key}: unknown section')
+
+    ## Schema errors are reported together with the cross-checks, a config with errors isn't cached
+    compiled['errors'] = errors
+    if errors:
+        return compiled
+
+    _compiled[digest] = pickle.dumps(compiled)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            f.write(_compiled[digest])
+        _prune_cache(cache_file)
+    except OSError:
+        pass
+
+    return compiled
+
+def _prune_cache(cache_file: str):
+    ## Only the current digest of a config file is kept, the older ones are of earlier edits
+    cache_dir, name = os.path.split(cache_file)
+    pattern = re.escape(name[:-len('.0123456789abcdef.pickle')]) + r'\.[0-9a-f]{16}\.pickle'
+    for other in os.listdir(cache_dir):
+        if other != name and re.fullmatch(pattern, other):
+            os.remove(os.path.join(cache_dir, other))
+
+_compiled = {}
 
 class AWSPulumiConfig(object):
 
     def __init__(self, stack_name: str) -> object:
         config_file = f'{CONST.PATH_STACK_CONFIGS}/sc-{stack_name}.yaml'
+        config = _read_config(config_file)
+        top = config['top']
+
+        self.stack_name         = stack_name
+        self.hosted_zone        = top.get('hosted_zone')
+        self.domain_name        = top.get('domain_name')
+        self.zone_alias_id      = top.get('zone_alias_id')
+        self.resource_prefix    = top.get('resource_prefix') if top.get('resource_prefix') else stack_name
+        self.dependency_mode    = top.get('dependency_mode') or 'full'
+        self.tags               = copy.copy(config['tags'])
+        self.vpc: Optional[VpcConfig]   = config['sections']['vpc']
+        self.rds: Optional[RdsConfig]   = config['sections']['rds']
+        self.efs: Optional[EfsConfig]   = config['sections']['efs']
+        self.eks: Optional[EksConfig]   = config['sections']['eks']
+        self.ec2: Optional[Ec2Config]   = config['sections']['ec2']
+        self.lb: Optional[LbConfig]     = config['sections']['lb']
+        self.foundation_snapshot: FoundationSnapshotConfig = config['sections']['foundation_snapshot']
 
-        with open(file=config_file, mode="r", encoding="utf-8") as f:
-            config = yaml.load(f, Loader=yaml.FullLoader)
-
-        if not config:
-            raise OSError(f'File {config_file} does not exist')
-        
-        self.stack_name         = stack_name 
-        self.hosted_zone        = config.get('hosted_zone')
-        self.domain_name        = config.get('domain_name')
-        self.zone_alias_id      = config.get('zone_alias_id')
-        self.resource_prefix    = config.get('resource_prefix') if config.get('resource_prefix') else stack_name
-        self.vpc                = config.get('aws').get('vpc')
-        self.rds                = config.get('aws').get('rds')
-        self.tags               = config.get('aws').get('tags')
-        self.efs                = config.get('aws').get('efs')
-        self.eks                = config.get('aws').get('eks')
-        self.ec2                = config.get('aws').get('ec2')
-        self.lb                 = config.get('aws').get('lb')
-
-        self.__validation(config)
+        self.__validation(config['errors'])
 
     def add_tags(self, tags: dict):
         if not isinstance(tags, dict):
             raise ValueError('tags must be a dictionary.')
-        
+
         self.tags.update(tags)
 
     def instance_requested(self) -> bool:
-        return self.rds.get('aws_rds_type') == 'instance'
+        return self.rds.aws_rds_type == 'instance'
 
     def cluster_requested(self) -> bool:
-        return self.rds.get('aws_rds_type') == 'cluster'
+        return self.rds.aws_rds_type == 'cluster'
+
+    def aurora_requested(self) -> bool:
+        return self.rds.aws_rds_type == 'aurora'
 
     def lb_enabled(self) -> bool:
-        return self.lb.get('enabled') if self.lb else False
+        return self.lb.enabled if self.lb else False
 
     def ec2_enabled(self) -> bool:
-        return self.ec2.get('enabled') if self.ec2 else False
+        return self.ec2.enabled if self.ec2 else False
 
     def rds_enabled(self) -> bool:
-        return self.rds.get('enabled') if self.rds else False
-    
+        return self.rds.enabled if self.rds else False
+
     def eks_enabled(self) -> bool:
-        return self.eks.get('enabled') if self.eks else False
-    
+        return self.eks.enabled if self.eks else False
+
     def efs_enabled(self) -> bool:
-        return self.efs.get('enabled') if self.efs else False
-    
+        return self.efs.enabled if self.efs else False
+
     def lb_controller_enabled(self) -> bool:
-        return self.eks.get('loadbalancer_controller').get('enabled') if self.eks else False
-    
+        return self.eks.loadbalancer_controller.enabled if self.eks_enabled() else False
+
+    def addon(self, name: str) -> Optional[AddonConfig]:
+        return next((a for a in self.eks.addons if a.name == name), None) if self.eks_enabled() else None
+
+    def vpc_cni_prefix_delegation(self) -> bool:
+        vpc_cni = self.addon('vpc-cni')
+        return bool(vpc_cni) and vpc_cni.configuration().get('env', {}).get('ENABLE_PREFIX_DELEGATION') == 'true'
+
+    def node_pools(self) -> list:
+        return self.eks.node_pools or [NodePoolConfig(name='default')]
+
+    def autoscaler_enabled(self) -> bool:
+        return self.eks.autoscaler.enabled if self.eks_enabled() else False
+
     def efs_csi_driver_enabled(self) -> bool:
-        return self.efs.get('csi_driver').get('enabled') if self.efs else False
+        return self.efs.csi_driver.enabled if self.efs_enabled() else False
+
+    ## With dependency_mode: minimal, resources only get the explicit dependencies they actually need,
+    ## e.g. the EKS addons and helm releases wait for the first node group instead of all of them
+    def minimal_dependencies(self) -> bool:
+        return self.dependency_mode == 'minimal'
 
-    def __validation(self, config) -> bool:
-        tags = config.get('aws')['tags']
+    def __node_pool_validation(self, pool: NodePoolConfig) -> list:
         e = []
+        _path = f'eks.node_pools.{pool.name}' if self.eks.node_pools else 'eks.node_groups'
+        if pool.capacity_type not in CONST.CAPACITY_TYPE_CHOICES:
+            e.append(f'Invalid {_path}.capacity_type: "{pool.capacity_type}". This must be one of {", ".join(CONST.CAPACITY_TYPE_CHOICES)}')
+        if pool.placement not in CONST.NODE_POOL_PLACEMENT_CHOICES:
+            e.append(f'Invalid {_path}.placement: "{pool.placement}". This must be one of {", ".join(CONST.NODE_POOL_PLACEMENT_CHOICES)}')
+        for taint in pool.taints:
+            if taint.effect not in CONST.TAINT_EFFECT_CHOICES:
+                e.append(f'Invalid {_path}.taints {taint.key} effect: "{taint.effect}". This must be one of {", ".join(CONST.TAINT_EFFECT_CHOICES)}')
+
+        _desired = pool.desired_size if pool.desired_size is not None else self.eks.desired_nodes_per_group
+        _min = pool.min_size if pool.min_size is not None else _desired
+        _max = pool.max_size if pool.max_size is not None else self.eks.max_nodes_per_group
+        if None not in (_min, _desired, _max) and not _min <= _desired <= _max:
+            e.append(f'{_path}: the sizes need min_size <= desired_size <= max_size, got {_min}, {_desired}, {_max}')
+
+        _settings = pool.node_groups(self.eks.node_groups)
+        if _settings.architecture and _settings.architecture not in CONST.ARCHITECTURE_CHOICES:
+            e.append(f'Invalid {_path}.architecture: "{_settings.architecture}". This must be one of {", ".join(CONST.ARCHITECTURE_CHOICES)}')
+        if _settings.ami_family and _settings.ami_family not in CONST.AMI_FAMILY_CHOICES:
+            e.append(f'Invalid {_path}.ami_family: "{_settings.ami_family}". This must be one of {", ".join(CONST.AMI_FAMILY_CHOICES)}')
+        _storage = _settings.storage
+        for _name in ('root_volume', 'data_volume'):
+            _volume = getattr(_storage, _name, None)
+            if not _volume:
+                continue
+            if _volume.type not in CONST.EBS_VOLUME_TYPES:
+                e.append(f'Invalid {_path}.storage.{_name}.type: "{_volume.type}". This must be one of {", ".join(CONST.EBS_VOLUME_TYPES)}')
+            if _volume.iops and _volume.type not in CONST.EBS_IOPS_VOLUME_TYPES:
+                e.append(f'{_path}.storage.{_name}.iops can only be set for {", ".join(CONST.EBS_IOPS_VOLUME_TYPES)} volumes')
+            if _volume.throughput and _volume.type != 'gp3':
+                e.append(f'{_path}.storage.{_name}.throughput can only be set for gp3 volumes')
+        if _storage and _storage.data_volume and _storage.instance_store:
+            e.append(f'{_path}.storage: data_volume and instance_store both hold containerd, only one can be used')
+        if _storage and _storage.instance_store and _settings.ami_family == 'BOTTLEROCKET':
+            e.append(f'{_path}.storage.instance_store is not supported with Bottlerocket, use a data_volume')
+        if _storage and _storage.root_volume and (_storage.root_volume.snapshot_id or _storage.root_volume.images):
+            e.append(f'{_path}.storage.root_volume: snapshot_id and images are for the data_volume')
+
+        if self.vpc_cni_prefix_delegation() and not _settings.max_pods and any('*' in t for t in _settings.instance_types or []):
+            e.append(f'{_path}.max_pods is needed with vpc-cni prefix delegation when instance_types has wildcards')
+        return e
+
+    ## Schema errors and the checks that span settings/sections; everything is reported at once
+    def __validation(self, schema_errors: list):
+        e = list(schema_errors)
+        for check in (self.__top_validation, self.__vpc_validation, self.__ec2_validation, self.__efs_validation,
+                      self.__eks_validation, self.__rds_validation):
+            try:
+                check(e)
+            except (TypeError, AttributeError):
+                ## The section has a setting the schema already reported (missing, or of the wrong type),
+                ## its errors up to there are in e
+                if not schema_errors:
+                    raise
+
+        if len(e) > 0:
+            raise ValueError('\n'.join(e))
+
+    def __top_validation(self, e: list):
         for t in CONST.REQUIRED_TAGS:
-            if not tags.get(t):
+            if not self.tags.get(t):
                 e.append(f'Tag: {t} is missing!')
 
+        if self.dependency_mode not in CONST.DEPENDENCY_MODE_CHOICES:
+            e.append(f'Invalid dependency_mode: "{self.dependency_mode}". This must be one of {", ".join(CONST.DEPENDENCY_MODE_CHOICES)}')
+
+    def __vpc_validation(self, e: list):
+        if (self.eks_enabled() or self.efs_enabled() or self.rds_enabled()) and not self.vpc:
+            e.append('The vpc section (vpc.cidr) is required when eks, efs or rds are enabled')
+
+        if self.stack_name == 'foundation':
+            _missing = [k for k in ('subnet_size', 'num_private_subnets', 'num_public_subnets') if not self.vpc or getattr(self.vpc, k) is None]
+            for k in _missing:
+                e.append(f'aws.vpc.{k}: required setting is missing')
+
+            if not _missing:
+                try:
+                    vpc_net_size = int(self.vpc.cidr.split('/')[1])
+                    for tier, (_, size) in subnets.tier_sizes(self.vpc).items():
+                        if tier != 'pod' and vpc_net_size >= size:
+                            e.append(f'The vpc network must be larger than the {tier} subnets!')
+                except IndexError:
+                    e.append('Is the vpc.cidr missing?')
+
+                if self.vpc.num_pod_subnets and not self.vpc.secondary_cidrs:
+                    e.append('vpc.num_pod_subnets needs vpc.secondary_cidrs to carve the pod subnets out of')
+
+                if not e:
+                    try:
+                        subnets.plan_cidrs(self.vpc)
+                    except ValueError as err:
+                        e.append(f'The vpc subnets don\'t fit: {err}')
+
+                _num_subnets = self.vpc.num_private_subnets + self.vpc.num_public_subnets + self.vpc.num_pod_subnets
+                if self.vpc.ipv6 and _num_subnets > CONST.VPC_IPV6_SUBNETS:
+                    e.append(f'A dual-stack vpc can have at most {CONST.VPC_IPV6_SUBNETS} subnets')
+
+                if self.vpc.num_public_subnets < CONST.MIN_PUBLIC_SUBNETS:
+                    e.append(f'There needs to be at least {CONST.MIN_PUBLIC_SUBNETS} public subnet(s)')
+                if self.vpc.num_private_subnets < CONST.MIN_PRIVATE_SUBNETS:
+                    e.append(f'There needs to be at least {CONST.MIN_PRIVATE_SUBNETS} private subnet(s)')
+
+        if self.vpc and self.vpc.nat_mode not in CONST.NAT_MODE_CHOICES:
+            e.append(f'Invalid vpc.nat_mode: "{self.vpc.nat_mode}". This must be one of {", ".join(CONST.NAT_MODE_CHOICES)}')
+
+        if self.vpc:
+            for kind, choices in (('gateway', CONST.VPC_GATEWAY_ENDPOINTS), ('interface', CONST.VPC_INTERFACE_ENDPOINTS)):
+                for service in getattr(self.vpc.endpoints, kind) or []:
+                    if service not in choices:
+                        e.append(f'Invalid vpc.endpoints.{kind} service: "{service}". This must be one of {", ".join(choices)}')
+
+        if self.vpc and self.vpc.az_placement not in CONST.AZ_PLACEMENT_CHOICES:
+            e.append(f'Invalid vpc.az_placement: "{self.vpc.az_placement}". This must be one of {", ".join(CONST.AZ_PLACEMENT_CHOICES)}')
+
+    def __ec2_validation(self, e: list):
         if self.ec2_enabled():
-            if self.ec2.get('count') > CONST.INSTANCE_COUNT_LIMIT:
+            if self.ec2.count > CONST.INSTANCE_COUNT_LIMIT:
                 e.append(f'Instance count cannot exceed {CONST.INSTANCE_COUNT_LIMIT}')
+            if self.ec2.architecture and self.ec2.architecture not in CONST.ARCHITECTURE_CHOICES:
+                e.append(f'Invalid ec2.architecture: "{self.ec2.architecture}". This must be one of {", ".join(CONST.ARCHITECTURE_CHOICES)}')
 
-        if self.stack_name == 'foundation':
-            try:
-                vpc_net_size = int(config.get('aws').get('vpc')['cidr'].split('/')[1])
-                if vpc_net_size >= int(config.get('aws').get('vpc')['subnet_size']):
-                    e.append('The vpc network must be larger than the subnets!')
-            except IndexError:
-                e.append('Is the vpc.cidr missing?')
+    def __efs_validation(self, e: list):
+        if self.efs_enabled():
+            if self.efs.throughput_mode not in CONST.EFS_THROUGHPUT_MODES:
+                e.append(f'Invalid efs.throughput_mode: "{self.efs.throughput_mode}". This must be one of {", ".join(CONST.EFS_THROUGHPUT_MODES)}')
+            if self.efs.performance_mode not in CONST.EFS_PERFORMANCE_MODES:
+                e.append(f'Invalid efs.performance_mode: "{self.efs.performance_mode}". This must be one of {", ".join(CONST.EFS_PERFORMANCE_MODES)}')
+            if (self.efs.throughput_mode == 'provisioned') != bool(self.efs.provisioned_throughput):
+                e.append('efs.provisioned_throughput is needed with, and only with, efs.throughput_mode: provisioned')
+            if self.efs.throughput_mode == 'elastic' and self.efs.performance_mode == 'maxIO':
+                e.append('efs.throughput_mode: elastic needs efs.performance_mode: generalPurpose')
+
+    def __eks_validation(self, e: list):
+        if self.eks_enabled() and self.eks.ip_family not in CONST.IP_FAMILY_CHOICES:
+            e.append(f'Invalid eks.ip_family: "{self.eks.ip_family}". This must be one of {", ".join(CONST.IP_FAMILY_CHOICES)}')
+
+        if self.eks_enabled():
+            for addon in self.eks.addons:
+                _profiles = CONST.ADDON_PROFILES.get(addon.name, {})
+                if addon.profile and addon.profile not in _profiles:
+                    e.append(f'Invalid eks.addons {addon.name} profile: "{addon.profile}". This must be one of {", ".join(_profiles) or "(none for this addon)"}')
+
+            if self.eks.storage_classes and not self.addon('aws-ebs-csi-driver'):
+                e.append('eks.storage_classes need the aws-ebs-csi-driver addon in eks.addons')
+            _classes = [c.name for c in self.eks.storage_classes]
+            for _name in sorted(set(n for n in _classes if _classes.count(n) > 1)):
+                e.append(f'eks.storage_classes: the name "{_name}" is used more than once')
+            if sum(c.default for c in self.eks.storage_classes) > 1:
+                e.append('eks.storage_classes: only one can be the default')
+            for _class in self.eks.storage_classes:
+                if _class.type not in CONST.EBS_VOLUME_TYPES:
+                    e.append(f'Invalid eks.storage_classes {_class.name} type: "{_class.type}". This must be one of {", ".join(CONST.EBS_VOLUME_TYPES)}')
+                if _class.iops and _class.type not in CONST.EBS_IOPS_VOLUME_TYPES:
+                    e.append(f'eks.storage_classes {_class.name}: iops can only be set for {", ".join(CONST.EBS_IOPS_VOLUME_TYPES)} volumes')
+                if _class.throughput and _class.type != 'gp3':
+                    e.append(f'eks.storage_classes {_class.name}: throughput can only be set for gp3 volumes')
 
-            if int(config.get('aws').get('vpc')['num_public_subnets']) < CONST.MIN_PUBLIC_SUBNETS:
-                e.append(f'There needs to be at least {CONST.MIN_PUBLIC_SUBNETS} public subnet(s)')
-            if int(config.get('aws').get('vpc')['num_private_subnets']) < CONST.MIN_PRIVATE_SUBNETS:
-                e.append(f'There needs to be at least {CONST.MIN_PRIVATE_SUBNETS} private subnet(s)')
+            _names = [p.name for p in self.eks.node_pools]
+            for _name in sorted(set(n for n in _names if _names.count(n) > 1)):
+                e.append(f'eks.node_pools: the name "{_name}" is used more than once')
 
+            for _pool in (self.node_pools() if self.eks.node_groups else []):
+                e.extend(self.__node_pool_validation(_pool))
+
+        if self.autoscaler_enabled():
+            _autoscaler = self.eks.autoscaler
+            if _autoscaler.type not in CONST.AUTOSCALER_CHOICES:
+                e.append(f'Invalid eks.autoscaler.type: "{_autoscaler.type}". This must be one of {", ".join(CONST.AUTOSCALER_CHOICES)}')
+            if _autoscaler.cluster_autoscaler.expander not in CONST.CA_EXPANDER_CHOICES:
+                e.append(f'Invalid eks.autoscaler.cluster_autoscaler.expander: "{_autoscaler.cluster_autoscaler.expander}". This must be one of {", ".join(CONST.CA_EXPANDER_CHOICES)}')
+            for capacity_type in _autoscaler.karpenter.capacity_types:
+                if capacity_type not in CONST.KARPENTER_CAPACITY_TYPES:
+                    e.append(f'Invalid eks.autoscaler.karpenter.capacity_types: "{capacity_type}". This must be one of {", ".join(CONST.KARPENTER_CAPACITY_TYPES)}')
+            if _autoscaler.type == 'karpenter' and self.eks.node_groups:
+                ## The NodePool matches instance types or families literally, see eks_autoscaler._instance_type_requirement
+                _types = self.eks.node_groups.instance_types
+                for _type in _types:
+                    if '*' in _type and not (_type.endswith('.*') and _type.count('*') == 1):
+                        e.append(f'eks.node_groups.instance_types: "{_type}" can\'t be used with karpenter, only whole families (like m6a.*) can')
+                if any('*' in t for t in _types) and any('*' not in t for t in _types):
+                    e.append('eks.node_groups.instance_types: with karpenter these are either instance types or families (like m6a.*), not both')
+
+    def __rds_validation(self, e: list):
         if self.rds_enabled():
-            self.rds['fqdn_internal'] = f"{self.rds['subdomain']}.{config.get('resource_prefix')}.{self.rds['tld']}"
+            self.rds.fqdn_internal = f'{self.rds.subdomain}.{self.resource_prefix}.{self.rds.tld}'
 
-            _rds_type = self.rds.get('aws_rds_type')
+            _rds_type = self.rds.aws_rds_type
             if _rds_type not in CONST.RDS_CHOICES:
                 e.append(f'Invalid RDS type: "{_rds_type}". This must be one of {", ".join(CONST.RDS_CHOICES)}')
 
-        if len(e) > 0:
-            raise ValueError('\n'.join(e))
-        
\ No newline at end of file
+            if _rds_type != 'instance' and (self.rds.read_replicas.count or self.rds.proxy.enabled):
+                e.append('rds.read_replicas and rds.proxy are for rds.aws_rds_type: instance')
+            if self.rds.proxy.enabled and self.rds.engine not in CONST.RDS_PROXY_ENGINE_FAMILIES:
+                e.append(f'rds.proxy does not support the {self.rds.engine} engine, only {", ".join(CONST.RDS_PROXY_ENGINE_FAMILIES)}')
+            if not 1 <= self.rds.proxy.max_connections_percent <= 100 or not 0 <= self.rds.proxy.max_idle_connections_percent <= self.rds.proxy.max_connections_percent:
+                e.append('rds.proxy needs 0 <= max_idle_connections_percent <= max_connections_percent <= 100')
+
+            if self.rds.tuning.enabled:
+                if self.rds.engine not in CONST.RDS_TUNING_ENGINES:
+                    e.append(f'rds.tuning supports the {", ".join(CONST.RDS_TUNING_ENGINES)} engines, not {self.rds.engine}')
+                if self.rds.tuning.profile not in CONST.RDS_TUNING_PROFILES:
+                    e.append(f'Invalid rds.tuning.profile: "{self.rds.tuning.profile}". This must be one of {", ".join(CONST.RDS_TUNING_PROFILES)}')
+
+            if _rds_type == 'aurora':
+                _aurora = self.rds.aurora
+                if self.rds.engine not in CONST.AURORA_ENGINES:
+                    e.append(f'rds.aws_rds_type: aurora needs an {" or ".join(CONST.AURORA_ENGINES)} engine, not {self.rds.engine}')
+                if self.rds.storage_type not in CONST.AURORA_STORAGE_TYPES:
+                    e.append(f'rds.storage_type must be one of {", ".join(CONST.AURORA_STORAGE_TYPES)} for aurora')
+                if not 0 <= _aurora.min_capacity <= _aurora.max_capacity <= 256 or _aurora.max_capacity < 1 \
+                        or (_aurora.min_capacity * 2) % 1 or (_aurora.max_capacity * 2) % 1:
+                    e.append('rds.aurora needs 0 <= min_capacity <= max_capacity <= 256 (and max_capacity >= 1), in steps of 0.5')
+                if not 0 <= _aurora.readers <= 15:
+                    e.append('rds.aurora.readers must be between 0 and 15')
+                _scaling = _aurora.autoscaling
+                if _scaling.enabled:
+                    if _scaling.metric not in CONST.AURORA_SCALING_METRICS:
+                        e.append(f'Invalid rds.aurora.autoscaling.metric: "{_scaling.metric}". This must be one of {", ".join(CONST.AURORA_SCALING_METRICS)}')
+                    if not 0 <= _scaling.min_readers <= _scaling.max_readers <= 15:
+                        e.append('rds.aurora.autoscaling needs 0 <= min_readers <= max_readers <= 15')
+                    if _scaling.target <= 0:
+                        e.append('rds.aurora.autoscaling.target must be positive')
@@ -5,9 +5,14 @@ class Constants:
     PATH_DATA           = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'data')
     PATH_STACK_CONFIGS  = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'stack-configs')
     PATH_README         = os.path.join(PATH_DATA, 'doc-readme')
+    PATH_CACHE          = os.path.join(os.path.abspath(os.path.dirname(__file__)), '.cache')
+    PATH_SNAPSHOTS      = os.path.join(PATH_CACHE, 'snapshots')
 
     INSTANCE_COUNT_LIMIT = 10
 
+    ## Seconds to keep data-source invoke results on disk, 0 disables persisting them across runs
+    INVOKE_CACHE_TTL = 0
+
     REQUIRED_TAGS = ('user', 'environment', 'purpose')
     MIN_PUBLIC_SUBNETS = 1
     MIN_PRIVATE_SUBNETS = 1
@@ -29,12 +34,98 @@ class Constants:
     EKS_MANAGED_ARNS['cluster'] = _EKS_CLUSTER_MANAGED_ARNS
     EKS_MANAGED_ARNS['nodegroups'] = _EKS_NODES_MANAGED_ARNS
 
-    RDS_CHOICES                 = ('instance', 'cluster')
+    RDS_CHOICES                 = ('instance', 'cluster', 'aurora')
+    AZ_PLACEMENT_CHOICES        = ('name', 'id')
+    DEPENDENCY_MODE_CHOICES     = ('full', 'minimal')
+    NAT_MODE_CHOICES            = ('single', 'per_az')
+    IP_FAMILY_CHOICES           = ('ipv4', 'ipv6')
+    AUTOSCALER_CHOICES          = ('cluster-autoscaler', 'karpenter')
+    CA_EXPANDER_CHOICES         = ('random', 'most-pods', 'least-waste', 'price', 'priority', 'least-nodes')
+    KARPENTER_CAPACITY_TYPES    = ('on-demand', 'spot', 'reserved')
+    CAPACITY_TYPE_CHOICES       = ('ON_DEMAND', 'SPOT')
+    NODE_POOL_PLACEMENT_CHOICES = ('per_az', 'multi_az')
+    TAINT_EFFECT_CHOICES        = ('NO_SCHEDULE', 'NO_EXECUTE', 'PREFER_NO_SCHEDULE')
+    ARCHITECTURE_CHOICES        = ('x86_64', 'arm64')
+    AMI_FAMILY_CHOICES          = ('AL2023', 'BOTTLEROCKET')
+    EFS_THROUGHPUT_MODES        = ('bursting', 'elastic', 'provisioned')
+    EFS_PERFORMANCE_MODES       = ('generalPurpose', 'maxIO')
+    ## RDS Proxy engine families, by engine
+    RDS_PROXY_ENGINE_FAMILIES   = {
+        'mysql': 'MYSQL', 'mariadb': 'MYSQL', 'aurora-mysql': 'MYSQL',
+        'postgres': 'POSTGRESQL', 'aurora-postgresql': 'POSTGRESQL',
+    }
+    ## rds.tuning: engines with tuning rules, and the profiles (oltp: many short connections, analytics:
+    ## fewer connections with more memory for sorts, joins and parallel queries)
+    RDS_TUNING_ENGINES          = ('mysql', 'mariadb', 'postgres')
+    RDS_TUNING_PROFILES         = ('oltp', 'analytics')
+    AURORA_ENGINES              = ('aurora-mysql', 'aurora-postgresql')
+    AURORA_STORAGE_TYPES        = ('aurora', 'aurora-iopt1')
+    ## Application Auto Scaling metrics for Aurora readers, by rds.aurora.autoscaling.metric
+    AURORA_SCALING_METRICS      = {
+        'cpu': 'RDSReaderAverageCPUUtilization',
+        'connections': 'RDSReaderAverageDatabaseConnections',
+    }
+
+    ## Configuration values for EKS addons, by addon and profile name (eks.addons[].profile).
+    ## prefix-delegation: the VPC CNI assigns /28 prefixes instead of single IPs to the ENIs, so a node fits
+    ## ~16 times the pods, and keeps a prefix (at least 16 IPs) warm so new pods don't wait on an ENI.
+    ADDON_PROFILES = {
+        'vpc-cni': {
+            'prefix-delegation': {
+                'env': {
+                    'ENABLE_PREFIX_DELEGATION': 'true',
+                    'WARM_PREFIX_TARGET': '1',
+                    'MINIMUM_IP_TARGET': '16',
+                }
+            }
+        }
+    }
+    EBS_VOLUME_TYPES            = ('gp2', 'gp3', 'io1', 'io2', 'st1', 'sc1', 'standard')
+    EBS_IOPS_VOLUME_TYPES       = ('gp3', 'io1', 'io2')
+    ## Block devices of the node AMIs: the root volume, and the data volume we add
+    NODE_ROOT_DEVICE            = '/dev/xvda'
+    NODE_DATA_DEVICE            = '/dev/xvdb'
+    ## Managed node group AMI types (EKS-optimized), by AMI family and architecture, and kubernetes.io/arch labels
+    EKS_AMI_TYPES               = {
+        'AL2023': {'x86_64': 'AL2023_x86_64_STANDARD', 'arm64': 'AL2023_ARM_64_STANDARD'},
+        'BOTTLEROCKET': {'x86_64': 'BOTTLEROCKET_x86_64', 'arm64': 'BOTTLEROCKET_ARM_64'},
+    }
+    K8S_ARCHITECTURES           = {'x86_64': 'amd64', 'arm64': 'arm64'}
+    ## The latest Amazon Linux 2023 AMI for an architecture
+    EC2_AMI_SSM_PARAMETER       = '/aws/service/ami-amazon-linux-latest/al2023-ami-kernel-default-{architecture}'
+    ## The EKS-optimized AMIs, for building data volume snapshots (tools/image_snapshot.py)
+    EKS_AMI_SSM_PARAMETERS      = {
+        'AL2023': '/aws/service/eks/optimized-ami/{version}/amazon-linux-2023/{architecture}/standard/recommended/image_id',
+        'BOTTLEROCKET': '/aws/service/bottlerocket/aws-k8s-{version}/{architecture}/latest/image_id',
+    }
+    ## kubelet max-pods caps for prefix delegation, below and from MAX_PODS_VCPU_THRESHOLD vCPUs
+    MAX_PODS_SMALL_INSTANCE     = 110
+    MAX_PODS_LARGE_INSTANCE     = 250
+    MAX_PODS_VCPU_THRESHOLD     = 30
+    ## /64 subnets in the /56 IPv6 block Amazon assigns to a VPC
+    VPC_IPV6_SUBNETS            = 256
+
+    ## VPC endpoint services that can be enabled (vpc.endpoints). ssmmessages and ec2messages are needed
+    ## along with ssm for Session Manager.
+    VPC_GATEWAY_ENDPOINTS       = ('s3', 'dynamodb')
+    VPC_INTERFACE_ENDPOINTS     = ('ecr.api', 'ecr.dkr', 'sts', 'logs', 'ssm', 'ssmmessages', 'ec2messages', 'ec2',
+                                   'elasticloadbalancing', 'autoscaling')
 
     FILE_AUTOSCALING_POLICY     = 'autoscaling.iam-policy.json'
+    FILE_CA_VALUES              = 'cluster-autoscaler.values.yaml'
+    FILE_KARPENTER_VALUES       = 'karpenter.values.yaml'
+    FILE_CNI_IPV6_POLICY        = 'cni-ipv6.iam-policy.json'
+    FILE_NODE_DATA_VOLUME       = 'node-data-volume.sh'
     FILE_LB_CONTROLLER_VALUES   = 'aws-load-balancer-controller.values.yaml'
     FILE_CLUSTER_ROLE_POLICY    = 'cluster.role-policy.json'
     FILE_EFS_CSI_DRIVER_POLICY  = 'efs-csi-driver.iam-policy.json'
     FILE_LB_CONTROLLER_POLICY   = 'lb-controller.iam-policy.json'
     FILE_NODEGROUP_ROLE_POLICY  = 'nodegroup.role-policy.json'
+    FILE_RDS_PROXY_ROLE_POLICY  = 'rds-proxy.role-policy.json'
+
+    ## The aws-efs-csi-driver chart's controller service account, assumes the IRSA role with FILE_EFS_CSI_DRIVER_POLICY
+    EFS_CONTROLLER_SA           = 'efs-csi-controller-sa'
+
+    ## Optional pre-parsed bundle of everything under data/, see common.build_datafile_pack()
+    FILE_DATAFILE_PACK          = os.path.join(PATH_CACHE, 'datafiles.pack')
     
\ No newline at end of file
@@ -0,0 +1,15 @@
+#!/bin/bash
+## Puts /var/lib/containerd (images and container layers) on the node's data volume (CONST.NODE_DATA_DEVICE).
+## Runs before containerd starts.
+set -euo pipefail
+
+device=/dev/xvdb
+for i in $(seq 1 60); do
+    [ -e "$device" ] && break
+    sleep 1
+done
+
+blkid "$device" || mkfs.xfs "$device"
+mkdir -p /var/lib/containerd
+grep -q "$device" /etc/fstab || echo "$device /var/lib/containerd xfs defaults,noatime 0 2" >> /etc/fstab
+mount -a
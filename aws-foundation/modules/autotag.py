@@ -9,6 +9,6 @@ def register_auto_tags(auto_tags):
 # auto_tag applies the given tags to the resource properties if applicable.
 def _auto_tag(args, auto_tags):
     if is_taggable(args.type_):
-        args.props['tags'] = {**(args.props['tags'] or {}), **auto_tags}
+        args.props['tags'] = {**(args.props.get('tags') or {}), **auto_tags}
         return pulumi.ResourceTransformationResult(args.props, args.opts)
     
\ No newline at end of file
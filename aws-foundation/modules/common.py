@@ -1,26 +1,200 @@
 import pulumi
 import pulumi_aws as paws
+import copy
+import hashlib
+import json
+import pickle
 import random
 import string
 import os
+import time
 import yaml
+from config import AWSPulumiConfig
 from constants import Constants as CONST
 
-def get_datafile(filename: str) -> str:
-    parent_dir  = os.path.abspath(os.getcwd())
-    data_dir    = os.path.join(parent_dir, CONST.PATH_DATA)
-    data_file   = os.path.join(data_dir, filename)
+## Results of data-source invokes (get_instance_type, get_zone, ...), keyed by the function and its args.
+## Identical invokes within a run are only issued once.
+_invoke_cache = {}
 
+class CachedInvokeResult(dict):
+    ## An invoke result read back from the on-disk cache. Supports attribute access like the SDK result
+    ## types, and item access like the nested output types.
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+def _to_plain(value):
+    if isinstance(value, dict):
+        return {k: _to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(v) for v in value]
+    if hasattr(value, '__dict__'):
+        return {k: _to_plain(v) for k, v in vars(value).items()}
+    return value
+
+def _from_plain(value):
+    if isinstance(value, dict):
+        return CachedInvokeResult({k: _from_plain(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [_from_plain(v) for v in value]
+    return value
+
+def aws_identity() -> str:
+    ## What an invoke's result depends on besides its args: the account (by way of the profile) and region
+    profile = paws.config.profile or os.environ.get('AWS_PROFILE') or 'default'
+    return f'{profile}-{paws.config.region}'
+
+def cached_invoke(fn, ttl: int = None, bypass: bool = False, **kwargs):
+    ## ttl:    seconds to persist the result on disk (.cache/invokes) across runs, 0 to only memoize in-process.
+    ##         Defaults to PULUMI_INVOKE_CACHE_TTL, or CONST.INVOKE_CACHE_TTL.
+    ## bypass: always invoke, and refresh the cached result. Also set by PULUMI_INVOKE_CACHE_BYPASS.
+    if ttl is None:
+        ttl = int(os.environ.get('PULUMI_INVOKE_CACHE_TTL', CONST.INVOKE_CACHE_TTL))
+    bypass = bypass or bool(os.environ.get('PULUMI_INVOKE_CACHE_BYPASS'))
+
+    key = json.dumps([fn.__module__, fn.__name__, aws_identity(), kwargs], sort_keys=True, default=str)
+    if not bypass and key in _invoke_cache:
+        return _invoke_cache[key]
+
+    ## Only persist when we know which region the result belongs to
+    cache_file = None
+    if ttl and paws.config.region:
+        cache_file = os.path.join(CONST.PATH_CACHE, 'invokes', f'{hashlib.sha256(key.encode()).hexdigest()}.json')
+
+    if not bypass and cache_file and os.path.isfile(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+        with open(cache_file, 'r') as f:
+            _invoke_cache[key] = _from_plain(json.load(f))
+        return _invoke_cache[key]
+
+    result = fn(**kwargs)
+
+    if cache_file:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(_to_plain(result), f)
+
+    _invoke_cache[key] = result
+    return result
+
+def _datafile_fingerprint() -> list:
+    ## What the pack was built from: every file under data/ with its size and mtime
+    fingerprint = []
+    for parent, _, files in os.walk(CONST.PATH_DATA):
+        for name in files:
+            st = os.stat(os.path.join(parent, name))
+            fingerprint.append((os.path.relpath(os.path.join(parent, name), CONST.PATH_DATA), st.st_size, st.st_mtime_ns))
+    return sorted(fingerprint)
+
+def _parse_datafile(data_file: str) -> object:
+    with open(data_file, 'r') as f:
+        content = f.read()
+
+    if data_file.endswith(('.yaml', '.yml')):
+        ## Multi-document files (e.g. kubernetes manifests) come back as a list of documents
+        documents = [d for d in yaml.load_all(content, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader)) if d is not None]
+        return documents[0] if len(documents) == 1 else documents
+    if data_file.endswith('.json'):
+        ## Policies are kept as parsed documents, and as canonical minified json so IAM diffs are stable
+        document = json.loads(content)
+        return DataFileJson(document, json.dumps(document, sort_keys=True, separators=(',', ':')))
+    return content
+
+class DataFileJson(object):
+    __slots__ = ('document', 'canonical')
+
+    def __init__(self, document, canonical: str):
+        self.document = document
+        self.canonical = canonical
+
+## Everything under data/ is parsed at most once per process; callers get copies
+_datafiles = {}
+
+def _load_datafile(filename: str) -> object:
+    if filename in _datafiles:
+        return _datafiles[filename]
+
+    if not _datafiles and os.path.isfile(CONST.FILE_DATAFILE_PACK):
+        load_datafile_pack()
+        if filename in _datafiles:
+            return _datafiles[filename]
+
+    data_file = os.path.join(CONST.PATH_DATA, filename)
     if not os.path.isfile(data_file):
         raise OSError(f'{data_file} not found')
-    
-    with open(data_file, 'r') as f:
-        if data_file.endswith('yaml'):
-            return yaml.safe_load(f)
-        else:
-            return f.read()
 
-def create_security_group(resource_prefix: str, vpc_id: str, ingress_data: list, egress_data=[], identifier=None) -> paws.ec2.SecurityGroup:
+    _datafiles[filename] = _parse_datafile(data_file)
+    return _datafiles[filename]
+
+def get_datafile(filename: str) -> object:
+    ## yaml files come back as a (copy of the) parsed document, json files as canonical minified json
+    ## and anything else as text
+    value = _load_datafile(filename)
+    if isinstance(value, DataFileJson):
+        return value.canonical
+    return copy.deepcopy(value)
+
+def get_json_datafile(filename: str) -> dict:
+    ## The parsed document of a json data file (e.g. a policy), safe to modify
+    value = _load_datafile(filename)
+    if not isinstance(value, DataFileJson):
+        raise ValueError(f'{filename} is not a json file')
+    return copy.deepcopy(value.document)
+
+def build_datafile_pack(pack_file: str = None) -> str:
+    ## Pre-parse everything under data/ into a single file, so a cold start (e.g. a CI container)
+    ## doesn't have to read and parse each file:
+    ##   python -c 'import modules.common as c; c.build_datafile_pack()'
+    pack_file = pack_file or CONST.FILE_DATAFILE_PACK
+    fingerprint = _datafile_fingerprint()
+    files = {
+        f[0]: _parse_datafile(os.path.join(CONST.PATH_DATA, f[0]))
+        for f in fingerprint
+    }
+
+    os.makedirs(os.path.dirname(pack_file), exist_ok=True)
+    with open(pack_file, 'wb') as f:
+        pickle.dump({'fingerprint': fingerprint, 'files': files}, f)
+    return pack_file
+
+def load_datafile_pack(pack_file: str = None) -> bool:
+    ## Only used while it matches what's in data/; a stale pack is ignored
+    pack_file = pack_file or CONST.FILE_DATAFILE_PACK
+    try:
+        with open(pack_file, 'rb') as f:
+            pack = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, AttributeError, EOFError):
+        return False
+
+    if pack.get('fingerprint') != _datafile_fingerprint():
+        return False
+
+    for filename, value in pack['files'].items():
+        _datafiles.setdefault(filename, value)
+    return True
+
+def node_group_dependencies(config: AWSPulumiConfig, node_groups: pulumi.Output) -> pulumi.Output:
+    ## Addons and helm releases need nodes to run on. With dependency_mode: minimal they wait for the
+    ## first node group only, instead of every node group.
+    if not config.minimal_dependencies():
+        return node_groups
+    if isinstance(node_groups, list):
+        return node_groups[:1]
+    return node_groups.apply(lambda groups: groups[:1])
+
+def check_architecture(instance_types: list, architecture: str, setting: str):
+    ## The instance types have to run the AMI's architecture. Wildcards are left to EC2.
+    for t in instance_types:
+        if '*' in t:
+            continue
+        supported = cached_invoke(paws.ec2.get_instance_type, instance_type=t).supported_architectures
+        if architecture not in supported:
+            raise ValueError(f'{setting}: {t} is not an {architecture} instance type (it supports {", ".join(supported)})')
+
+def create_security_group(resource_prefix: str, vpc_id: str, ingress_data: list, egress_data=[], identifier=None, ipv6=False) -> paws.ec2.SecurityGroup:
+    ## ingress/egress rules: {'protocol', 'from_port', 'to_port', 'cidr_ip' and/or 'ipv6_cidr_ip'}.
+    ## With ipv6 the default egress allows ::/0 as well.
     rand_str        = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
     default_egress  = [
         paws.ec2.SecurityGroupEgressArgs(
@@ -28,6 +202,7 @@ def create_security_group(resource_prefix: str, vpc_id: str, ingress_data: list,
             to_port=0,
             protocol="-1",
             cidr_blocks=["0.0.0.0/0"],
+            ipv6_cidr_blocks=["::/0"] if ipv6 else None,
         )
     ]
     ingress = [
@@ -35,7 +210,8 @@ def create_security_group(resource_prefix: str, vpc_id: str, ingress_data: list,
             from_port=i['from_port'],
             to_port=i['to_port'],
             protocol=i['protocol'],
-            cidr_blocks=[i['cidr_ip']]
+            cidr_blocks=[i['cidr_ip']] if i.get('cidr_ip') else None,
+            ipv6_cidr_blocks=[i['ipv6_cidr_ip']] if i.get('ipv6_cidr_ip') else None
         ) for i in ingress_data
     ]
     if len(egress_data) > 0:
@@ -44,7 +220,8 @@ def create_security_group(resource_prefix: str, vpc_id: str, ingress_data: list,
                 from_port=i['from_port'],
                 to_port=i['to_port'],
                 protocol=i['protocol'],
-                cidr_blocks=[i['cidr_ip']]
+                cidr_blocks=[i['cidr_ip']] if i.get('cidr_ip') else None,
+                ipv6_cidr_blocks=[i['ipv6_cidr_ip']] if i.get('ipv6_cidr_ip') else None
             ) for i in egress_data
         ]
     else:
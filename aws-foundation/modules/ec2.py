@@ -2,11 +2,12 @@ import pulumi
 import pulumi_aws as paws
 import modules.common as common
 from config import AWSPulumiConfig
+from constants import Constants as CONST
 
 def define_ec2_security_group(config: AWSPulumiConfig, vpc_data: dict) -> paws.ec2.SecurityGroup:
     ingresses = []
     
-    for i in config.ec2.get('security_group').get('rules')['ingress']:
+    for i in config.ec2.security_group['rules']['ingress']:
         ingresses.append({
             'from_port': i.get('from_port'),
             'to_port': i.get('to_port'),
@@ -20,28 +21,41 @@ def define_ec2_security_group(config: AWSPulumiConfig, vpc_data: dict) -> paws.e
         resource_prefix=config.resource_prefix,
         vpc_id=vpc_data['vpc_id'], 
         ingress_data=ingresses, 
-        identifier=config.ec2.get('tags')['Name']
+        identifier=config.ec2.tags['Name']
     )
 
 def define_ec2(config: AWSPulumiConfig, vpc_data: dict) -> list:
     instances = []
     sec_group = define_ec2_security_group(config, vpc_data)
+    instance_type_info = common.cached_invoke(paws.ec2.get_instance_type, instance_type=config.ec2.instance_type)
+    instance_type = instance_type_info.instance_type
 
-    for i in range(config.ec2.get('count')):
-        instance = paws.ec2.Instance(f"{config.resource_prefix}-{config.ec2.get('tags')['Name']}-{i}",
-            ami=config.ec2.get('ami'),
-            instance_type=paws.ec2.get_instance_type(instance_type=config.ec2.get('instance_type')).instance_type,
-            iam_instance_profile=config.ec2.get('iam_instance_profile'),
-            key_name=config.ec2.get('key_name'),
+    ## The latest Amazon Linux 2023 for the architecture when there's no ami in the config
+    ami = config.ec2.ami
+    architecture = config.ec2.architecture
+    if architecture:
+        common.check_architecture([config.ec2.instance_type], architecture, 'ec2.instance_type')
+    if not ami:
+        architecture = architecture or next(a for a in instance_type_info.supported_architectures if a in CONST.ARCHITECTURE_CHOICES)
+        ami = common.cached_invoke(paws.ssm.get_parameter, name=CONST.EC2_AMI_SSM_PARAMETER.format(architecture=architecture)).value
+
+    for i in range(config.ec2.count):
+        instance = paws.ec2.Instance(f"{config.resource_prefix}-{config.ec2.tags['Name']}-{i}",
+            ami=ami,
+            instance_type=instance_type,
+            iam_instance_profile=config.ec2.iam_instance_profile,
+            key_name=config.ec2.key_name,
             root_block_device={
                 "delete_on_termination": True,
                 "encrypted": False,
                 "volume_size": 25,
                 "volume_type": "gp3",
             },
-            tags=config.ec2.get('tags'),
+            tags=config.ec2.tags,
             subnet_id=vpc_data['private_subnets'][0].apply(lambda x: x),
             vpc_security_group_ids=[sec_group.id],
+            ## A newer AMI from SSM doesn't replace the instances, `pulumi up --replace` does when wanted
+            opts=pulumi.ResourceOptions(ignore_changes=['ami'] if not config.ec2.ami else None)
         )
         instances.append(instance)
 
@@ -1,16 +1,22 @@
 import pulumi
 import pulumi_aws as paws
 import modules.common as common
-from pulumi_kubernetes.helm.v3 import Release, ReleaseArgs, RepositoryOptsArgs
+from typing import TYPE_CHECKING
 from config import AWSPulumiConfig
-from modules.eks import k8sProvider
+from constants import Constants as CONST
+
+## The kubernetes bits are only needed for the CSI driver; don't make non-EKS stacks pay for importing them
+if TYPE_CHECKING:
+    from pulumi_kubernetes.helm.v3 import Release
+    from pulumi_kubernetes.storage.v1 import StorageClass
+    from modules.eks import k8sProvider
 
 def define_efs(config: AWSPulumiConfig, vpc_data: dict) -> dict:
     ingress = [{
         'from_port': 0,
         'to_port': 0,
         'protocol': '-1',
-        'cidr_ip': config.vpc['cidr']
+        'cidr_ip': config.vpc.cidr
     }]
     efs_sec = common.create_security_group(
         resource_prefix=config.resource_prefix,
@@ -21,8 +27,11 @@ def define_efs(config: AWSPulumiConfig, vpc_data: dict) -> dict:
 
     efs = paws.efs.FileSystem(config.resource_prefix,
         creation_token=config.resource_prefix,
+        throughput_mode=config.efs.throughput_mode,
+        provisioned_throughput_in_mibps=config.efs.provisioned_throughput,
+        performance_mode=config.efs.performance_mode,
         lifecycle_policies=[paws.efs.FileSystemLifecyclePolicyArgs(
-            transition_to_ia=config.efs['transition_to_ia'],
+            transition_to_ia=config.efs.transition_to_ia,
         )]
     )
 
@@ -52,7 +61,56 @@ def define_efs(config: AWSPulumiConfig, vpc_data: dict) -> dict:
         'efs': efs
     }
 
-def define_efs_controller(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list) -> Release:
+def define_storage_class(config: AWSPulumiConfig, k8s_provider: 'k8sProvider', efs: paws.efs.FileSystem, release: 'Release') -> 'StorageClass':
+    ## Dynamic provisioning (efs-ap): the driver creates an access point per PVC on our file system
+    from pulumi_kubernetes.storage.v1 import StorageClass
+
+    settings = config.efs.storage_class
+    parameters = {
+        'provisioningMode': 'efs-ap',
+        'fileSystemId': efs.id,
+        'directoryPerms': settings.directory_perms,
+        'basePath': settings.base_path,
+    }
+    if settings.uid is not None:
+        parameters['uid'] = str(settings.uid)
+    if settings.gid is not None:
+        parameters['gid'] = str(settings.gid)
+
+    storage_class = StorageClass(f'{config.resource_prefix}-{settings.name}',
+        metadata={'name': settings.name},
+        provisioner='efs.csi.aws.com',
+        parameters=parameters,
+        reclaim_policy=settings.reclaim_policy,
+        opts=pulumi.ResourceOptions(provider=k8s_provider.get_provider(), depends_on=[release])
+    )
+    pulumi.export('efs_storage_class', storage_class.metadata['name'])
+
+    return storage_class
+
+def _define_controller_role(config: AWSPulumiConfig, k8s_provider: 'k8sProvider') -> paws.iam.Role:
+    ## IRSA: the controller creates and deletes the access points of efs-ap volumes
+    from modules.eks_lb_controller import create_service_account_role
+
+    policy = paws.iam.Policy(f'{config.resource_prefix}-efs-csi-driver-policy',
+        name_prefix=config.resource_prefix,
+        policy=common.get_datafile(CONST.FILE_EFS_CSI_DRIVER_POLICY)
+    )
+    cluster = k8s_provider.cluster
+    return create_service_account_role(
+        config=config,
+        role_name=f'{config.resource_prefix}-efs-csi-controller',
+        oidc_provider_url=cluster.core.oidc_provider.url,
+        oidc_provider_arn=cluster.core.oidc_provider.arn,
+        service_account_name=CONST.EFS_CONTROLLER_SA,
+        policy=policy
+    )
+
+def define_efs_controller(config: AWSPulumiConfig, k8s_provider: 'k8sProvider', node_groups: list, efs_data: dict = None) -> 'Release':
+    from pulumi_kubernetes.helm.v3 import Release, ReleaseArgs, RepositoryOptsArgs
+
+    role = _define_controller_role(config, k8s_provider)
+
     repo_opt_args = RepositoryOptsArgs(
         repo='https://kubernetes-sigs.github.io/aws-efs-csi-driver/'
     )
@@ -63,17 +121,29 @@ def define_efs_controller(config: AWSPulumiConfig, k8s_provider: k8sProvider, no
         namespace='kube-system',
         repository_opts=repo_opt_args,
         timeout=300,
-        version=config.efs.get('csi_driver').get('version')
+        values={
+            'controller': {
+                'serviceAccount': {
+                    'create': True,
+                    'name': CONST.EFS_CONTROLLER_SA,
+                    'annotations': {'eks.amazonaws.com/role-arn': role.arn},
+                }
+            }
+        },
+        version=config.efs.csi_driver.version
     )
     release = Release(
         resource_name=f'{config.resource_prefix}-efs-controller',
         args=release_args,
         opts=pulumi.ResourceOptions(
-            provider=k8s_provider.get_provider(), depends_on=node_groups
+            provider=k8s_provider.get_provider(), depends_on=common.node_group_dependencies(config, node_groups)
         )
     )
 
     combined = pulumi.Output.all(release.name, release.version, release.status['status'])
     pulumi.export(f'helm_eks_efs_controller', combined.apply(lambda x: f'Name: {x[0]}, Version: {x[1]}, Status: {x[2]}'))
 
+    if efs_data and config.efs.storage_class.enabled:
+        define_storage_class(config, k8s_provider, efs_data['efs'], release)
+
     return release
\ No newline at end of file
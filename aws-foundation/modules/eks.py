@@ -4,8 +4,10 @@ import pulumi_eks as peks
 import pulumi_kubernetes as pk8s
 import modules.common as common
 from pulumi_kubernetes.helm.v3 import Release, ReleaseArgs, RepositoryOptsArgs
-from config import AWSPulumiConfig
+from config import AWSPulumiConfig, NodeGroupsConfig, NodePoolConfig
 from constants import Constants as CONST
+import base64
+import json
 import os
 import yaml
 
@@ -59,15 +61,6 @@ def __cluster_role_attachments(resource_prefix: str, tags: list) -> dict:
     cluster_role = paws.iam.Role(f'{resource_prefix}-cluster',
         assume_role_policy=common.get_datafile(CONST.FILE_CLUSTER_ROLE_POLICY))
     
-    efs_policy = paws.iam.Policy(f'{resource_prefix}-efs-csi-driver-policy',
-        name_prefix=resource_prefix,
-        policy=common.get_datafile(CONST.FILE_EFS_CSI_DRIVER_POLICY)
-    )
-    _efs_att = paws.iam.RolePolicyAttachment(f'{resource_prefix}-efs-att',
-        role=cluster_role.name,
-        policy_arn=efs_policy.arn
-    )
-
     autoscaling_policy = paws.iam.Policy(f'{resource_prefix}-autoscaling',
         name_prefix=resource_prefix,
         policy=common.get_datafile(CONST.FILE_AUTOSCALING_POLICY)
@@ -78,16 +71,18 @@ def __cluster_role_attachments(resource_prefix: str, tags: list) -> dict:
     )
 
     cluster_policy_attachments = __policy_attachments(resource_prefix, 'cluster', cluster_role)
-    cluster_policy_attachments.append(_efs_att)
     cluster_policy_attachments.append(_auto_att)
 
     return {
         'attachments': cluster_policy_attachments,
-        'cluster_role': cluster_role
+        'cluster_role': cluster_role,
+        'autoscaling_policy': autoscaling_policy
     }
 
 def __get_asg_name(cluster_name: str, node_group_name: str) -> str:
-    node_group_info = paws.eks.get_node_group(
+    ## Node groups come and go with the cluster; only dedupe within the run
+    node_group_info = common.cached_invoke(paws.eks.get_node_group,
+        ttl=0,
         cluster_name=cluster_name,
         node_group_name=node_group_name
     )
@@ -115,24 +110,128 @@ def _tag_asgs(config: AWSPulumiConfig, asg_names: list, node_groups: list):
             ]
         )
 
-def _define_launch_template(config: AWSPulumiConfig) -> paws.ec2.LaunchTemplate:
+def max_pods(instance_type: object, prefix_delegation: bool = False) -> int:
+    ## What fits a node, as in the EKS max-pods calculator: each ENI has its primary IP plus (ips-1) for
+    ## pods, or with prefix delegation (ips-1) /28 prefixes of 16 IPs, capped by what kubelet handles well.
+    ## +2 for the host network pods (aws-node, kube-proxy).
+    enis = instance_type.maximum_network_interfaces
+    ips = instance_type.maximum_ipv4_addresses_per_interface - 1
+    if not prefix_delegation:
+        return enis * ips + 2
+
+    cap = CONST.MAX_PODS_SMALL_INSTANCE if instance_type.default_vcpus < CONST.MAX_PODS_VCPU_THRESHOLD else CONST.MAX_PODS_LARGE_INSTANCE
+    return min(enis * ips * 16 + 2, cap)
+
+def node_max_pods(config: AWSPulumiConfig, node_groups: NodeGroupsConfig = None) -> int:
+    ## max-pods for the nodes, the lowest of the allowed instance types so it's right for any of them.
+    ## None leaves it to EKS, which doesn't know about prefix delegation.
+    node_groups = node_groups or config.eks.node_groups
+    if node_groups.max_pods:
+        return node_groups.max_pods
+    if not config.vpc_cni_prefix_delegation():
+        return None
+
+    return min(
+        max_pods(common.cached_invoke(paws.ec2.get_instance_type, instance_type=t), prefix_delegation=True)
+        for t in node_groups.instance_types
+    )
+
+def _bottlerocket_user_data(max_pods: int = None) -> str:
+    ## Bottlerocket takes TOML settings, merged by EKS with the cluster's. Its AMI has a data volume
+    ## (CONST.NODE_DATA_DEVICE) for containerd already, so there's nothing to mount.
+    if not max_pods:
+        return None
+    return base64.b64encode(f'[settings.kubernetes]\nmax-pods = {max_pods}\n'.encode()).decode()
+
+def _node_user_data(node_groups: NodeGroupsConfig, max_pods: int = None) -> str:
+    ## User data for the launch template, merged by EKS with the bootstrap of the managed node group:
+    ## nodeadm (AL2023) config, and the script that mounts the data volume. None when there's nothing to add.
+    if node_groups.ami_family == 'BOTTLEROCKET':
+        return _bottlerocket_user_data(max_pods)
+
+    storage = node_groups.storage
+    spec = {}
+    if max_pods:
+        spec['kubelet'] = {'config': {'maxPods': max_pods}}
+    if storage.instance_store:
+        spec['instance'] = {'localStorage': {'strategy': 'RAID0'}}
+
+    parts = []
+    if spec:
+        node_config = yaml.safe_dump({'apiVersion': 'node.eks.aws/v1alpha1', 'kind': 'NodeConfig', 'spec': spec})
+        parts.append(('application/node.eks.aws', f'---\n{node_config}'))
+    if storage.data_volume:
+        parts.append(('text/x-shellscript', common.get_datafile(CONST.FILE_NODE_DATA_VOLUME)))
+    if not parts:
+        return None
+
+    mime = 'MIME-Version: 1.0\nContent-Type: multipart/mixed; boundary="BOUNDARY"\n\n'
+    for content_type, content in parts:
+        mime += f'--BOUNDARY\nContent-Type: {content_type}\n\n{content}\n'
+    mime += '--BOUNDARY--\n'
+    return base64.b64encode(mime.encode()).decode()
+
+def _block_device(device_name: str, volume: object) -> paws.ec2.LaunchTemplateBlockDeviceMappingArgs:
+    return paws.ec2.LaunchTemplateBlockDeviceMappingArgs(
+        device_name=device_name,
+        ebs=paws.ec2.LaunchTemplateBlockDeviceMappingEbsArgs(
+            volume_size=volume.size,
+            volume_type=volume.type,
+            iops=volume.iops,
+            throughput=volume.throughput,
+            snapshot_id=volume.snapshot_id,
+            encrypted=str(volume.encrypted).lower(),
+            delete_on_termination='true'
+        )
+    )
+
+def _check_instance_store(node_groups: NodeGroupsConfig, pool_prefix: str):
+    ## Types without an instance store still work, their containerd just stays on the root volume
+    for t in node_groups.instance_types:
+        if '*' in t:
+            continue
+        if not common.cached_invoke(paws.ec2.get_instance_type, instance_type=t).instance_storage_supported:
+            pulumi.log.warn(f'{t} has no instance store, storage.instance_store of {pool_prefix} has no effect on it')
+
+def _pool_prefix(config: AWSPulumiConfig, pool: NodePoolConfig) -> str:
+    ## The default pool keeps the names the node groups had before there were pools
+    if pool.name == 'default':
+        return config.resource_prefix
+    return f'{config.resource_prefix}-{pool.name}'
+
+def _define_launch_template(config: AWSPulumiConfig, pool: NodePoolConfig) -> paws.ec2.LaunchTemplate:
     ## Setting up for a launch template based on data from the yaml config
+    pool_prefix = _pool_prefix(config, pool)
+    node_groups = pool.node_groups(config.eks.node_groups)
     instance_requirements_args = paws.ec2.LaunchTemplateInstanceRequirementsArgs(
         memory_mib=paws.ec2.LaunchTemplateInstanceRequirementsMemoryMibArgs(
-            min=config.eks['node_groups']['memory_mib']['min'],
-            max=config.eks['node_groups']['memory_mib']['max']
+            min=node_groups.memory_mib.min,
+            max=node_groups.memory_mib.max
         ),
         vcpu_count=paws.ec2.LaunchTemplateInstanceRequirementsVcpuCountArgs(
-            min=config.eks['node_groups']['vcpu_count']['min'],
-            max=config.eks['node_groups']['vcpu_count']['max']
+            min=node_groups.vcpu_count.min,
+            max=node_groups.vcpu_count.max
         ),
-        allowed_instance_types=config.eks['node_groups']['instance_types']
+        allowed_instance_types=node_groups.instance_types
     )
 
+    ## Node storage: root and data volume, and the instance store
+    storage = node_groups.storage
+    block_devices = []
+    if storage.root_volume:
+        block_devices.append(_block_device(CONST.NODE_ROOT_DEVICE, storage.root_volume))
+    if storage.data_volume:
+        block_devices.append(_block_device(CONST.NODE_DATA_DEVICE, storage.data_volume))
+    if storage.instance_store:
+        _check_instance_store(node_groups, pool_prefix)
+
     ## Define the launch template for nodes in the node group
-    _tags = config.tags | {'Name': f'{config.resource_prefix}-nodes'}
-    launch_template = paws.ec2.LaunchTemplate(f'{config.resource_prefix}-nodegroup',
+    _tags = config.tags | {'Name': f'{pool_prefix}-nodes'}
+    launch_template = paws.ec2.LaunchTemplate(f'{pool_prefix}-nodegroup',
         instance_requirements=instance_requirements_args,
+        block_device_mappings=block_devices or None,
+        ebs_optimized=str(storage.ebs_optimized).lower() if storage.ebs_optimized is not None else None,
+        user_data=_node_user_data(node_groups, node_max_pods(config, node_groups)),
         tag_specifications=[paws.ec2.LaunchTemplateTagSpecificationArgs(
             resource_type='instance',
             tags=_tags
@@ -149,14 +248,24 @@ def define_cluster(config: AWSPulumiConfig, vpc: dict) -> dict:
         'from_port': 0,
         'to_port': 0,
         'protocol': '-1',
-        'cidr_ip': config.vpc['cidr']
+        'cidr_ip': config.vpc.cidr
     }]
+    ipv6 = config.eks.ip_family == 'ipv6'
+    if ipv6:
+        ## Pods and nodes talk IPv6 in an ipv6 cluster
+        ingress.append({
+            'from_port': 0,
+            'to_port': 0,
+            'protocol': '-1',
+            'ipv6_cidr_ip': vpc['vpc_ipv6_cidr']
+        })
 
     sec_group = common.create_security_group(
         resource_prefix=config.resource_prefix,
         vpc_id=vpc['vpc_id'].apply(lambda x: x),
         ingress_data=ingress,
-        identifier='eks'
+        identifier='eks',
+        ipv6=ipv6
     )
 
     ## The standard node group policy...
@@ -166,18 +275,30 @@ def define_cluster(config: AWSPulumiConfig, vpc: dict) -> dict:
         name=f'{config.resource_prefix}-nodegroup',
         assume_role_policy=common.get_datafile(CONST.FILE_NODEGROUP_ROLE_POLICY))
 
+    ## The cluster component manages the vpc-cni addon itself, its settings from eks.addons go there
+    vpc_cni_options = None
+    vpc_cni = config.addon('vpc-cni')
+    if vpc_cni:
+        _values = vpc_cni.configuration()
+        vpc_cni_options = peks.VpcCniOptionsArgs(
+            addon_version=vpc_cni.version,
+            configuration_values=_values or None
+        )
+
     _tags = config.tags | {'Name': config.resource_prefix}
     cluster_args = peks.ClusterArgs(
         enabled_cluster_log_types=["api", "audit", "authenticator", "controllerManager", "scheduler"],
         name=config.resource_prefix,
         skip_default_node_group=True,
         tags=_tags,
-        version=config.eks['version'],
+        version=config.eks.version,
+        ip_family=config.eks.ip_family,
         vpc_id=vpc['vpc_id'],
         cluster_security_group=sec_group,
         private_subnet_ids=vpc['private_subnets'],
         create_oidc_provider=True,
         instance_roles=[cluster_role, node_role],
+        vpc_cni_options=vpc_cni_options,
     )
 
     cluster = peks.Cluster(config.resource_prefix,
@@ -193,15 +314,88 @@ def define_cluster(config: AWSPulumiConfig, vpc: dict) -> dict:
 
     return {
         'cluster': cluster,
-        'node_role': node_role
+        'node_role': node_role,
+        'autoscaling_policy': _attachments['autoscaling_policy']
     }
 
+def _define_node_pool(config: AWSPulumiConfig, pool: NodePoolConfig, cluster: pulumi.Output, node_role: pulumi.Output, vpc: dict, ng_tags: dict, node_depends_on: list) -> pulumi.Output:
+    pool_prefix = _pool_prefix(config, pool)
+    node_groups = pool.node_groups(config.eks.node_groups)
+
+    ## Launch template to be used to define nodes in the pool's node groups
+    launch_template = _define_launch_template(config, pool)
+
+    ## Spot node groups have Capacity Rebalancing on: EKS launches a replacement when a node gets a rebalance
+    ## recommendation and drains the node before it's interrupted. That needs more than one instance type to
+    ## pick from, a single spot pool goes away at once.
+    if pool.capacity_type == 'SPOT' and len(node_groups.instance_types) < 2 and not any('*' in t for t in node_groups.instance_types):
+        pulumi.log.warn(f'{pool_prefix}: a spot pool with a single instance type is interrupted all at once, allow a few more')
+
+    ## arm64 (Graviton) or x86_64 nodes, from the EKS-optimized AL2023 or Bottlerocket AMI of that
+    ## architecture. Nodes get the kubernetes.io/arch label from kubelet, for nodeSelectors in
+    ## mixed-architecture clusters.
+    ami_type = None
+    if node_groups.architecture:
+        common.check_architecture(node_groups.instance_types, node_groups.architecture, f'{pool_prefix} instance_types')
+    if node_groups.architecture or node_groups.ami_family:
+        ami_type = CONST.EKS_AMI_TYPES[node_groups.ami_family or 'AL2023'][node_groups.architecture or 'x86_64']
+
+    desired_size = pool.desired_size if pool.desired_size is not None else config.eks.desired_nodes_per_group
+
+    ## Set up managed node group definition. The component only reads the args, the subnets go in there too.
+    def _node_group(name: str, subnet_ids: list) -> peks.ManagedNodeGroup:
+        managed_nodegroup_args = peks.ManagedNodeGroupArgs(
+            capacity_type=pool.capacity_type,
+            ami_type=ami_type,
+            cluster=cluster,
+            cluster_name=config.resource_prefix,
+            node_group_name_prefix=pool_prefix,
+            subnet_ids=subnet_ids,
+            launch_template=paws.eks.NodeGroupLaunchTemplateArgs(
+                id=launch_template.id,
+                version=launch_template.latest_version
+            ),
+            scaling_config=paws.eks.NodeGroupScalingConfigArgs(
+                desired_size=desired_size,
+                max_size=pool.max_size if pool.max_size is not None else config.eks.max_nodes_per_group,
+                min_size=pool.min_size if pool.min_size is not None else desired_size
+            ),
+            labels=pool.labels or None,
+            taints=[
+                paws.eks.NodeGroupTaintArgs(key=t.key, value=t.value, effect=t.effect) for t in pool.taints
+            ] or None,
+            node_role_arn=node_role.arn,
+            tags=(config.tags | ng_tags)
+        )
+        return peks.ManagedNodeGroup(name,
+            args=managed_nodegroup_args,
+            opts=pulumi.ResourceOptions(
+                depends_on=node_depends_on
+            )
+        )
+
+    ## per_az: a group per private subnet, so the cluster-autoscaler can scale the AZs separately.
+    ## multi_az: a single group that spreads its nodes over the private subnets.
+    if pool.placement == 'multi_az':
+        return vpc['private_subnets'].apply(lambda subnets: [_node_group(f'{pool_prefix}-mng', subnets)])
+    return vpc['private_subnets'].apply(
+        lambda subnets: [_node_group(f'{pool_prefix}-mng-{subnet_id[-4:]}', [subnet_id]) for subnet_id in subnets]
+    )
+
 def define_node_groups(config: AWSPulumiConfig, cluster: pulumi.Output, node_role: pulumi.Output, vpc: dict) -> list:
     ## Attachments for the managed policies
     node_policy_attachments = __policy_attachments(config.resource_prefix, 'nodegroups', node_role, 20)
 
-    ## Launch template to be used to define nodes in our node groups
-    launch_template = _define_launch_template(config)
+    ## AmazonEKS_CNI_Policy only covers IPv4, the VPC CNI assigns the pods' IPv6 addresses with this one
+    if config.eks.ip_family == 'ipv6':
+        cni_ipv6_policy = paws.iam.Policy(f'{config.resource_prefix}-cni-ipv6',
+            name_prefix=config.resource_prefix,
+            policy=common.get_datafile(CONST.FILE_CNI_IPV6_POLICY)
+        )
+        node_policy_attachments.append(paws.iam.RolePolicyAttachment(f'{config.resource_prefix}-cni-ipv6-att',
+            role=node_role.name,
+            policy_arn=cni_ipv6_policy.arn
+        ))
 
     ## Required tags for k8s scheduling
     ng_tags = {
@@ -210,38 +404,19 @@ def define_node_groups(config: AWSPulumiConfig, cluster: pulumi.Output, node_rol
         f'k8s.io/cluster/{config.resource_prefix}': 'owned'
     }
 
-    ## Set up managed node group definition
-    managed_nodegroup_args = peks.ManagedNodeGroupArgs(
-        capacity_type='ON_DEMAND',
-        cluster=cluster,
-        cluster_name=config.resource_prefix,
-        node_group_name_prefix=config.resource_prefix,
-        launch_template=paws.eks.NodeGroupLaunchTemplateArgs(
-            id=launch_template.id,
-            version=launch_template.latest_version
-        ),
-        scaling_config=paws.eks.NodeGroupScalingConfigArgs(
-            desired_size=config.eks['desired_nodes_per_group'],
-            max_size=config.eks['max_nodes_per_group'],
-            min_size=config.eks['desired_nodes_per_group']
-        ),
-        node_role_arn=node_role.arn,
-        tags=(config.tags | ng_tags)
-    )
+    ## The role is an input already (node_role_arn). The cluster is passed as a resource reference, which
+    ## doesn't count as a dependency of a component, and the nodes can't join without the policy attachments.
+    node_depends_on = [cluster] + node_policy_attachments
+    if not config.minimal_dependencies():
+        node_depends_on.append(node_role)
 
-    node_groups = vpc['private_subnets'].apply(
-        lambda subnets: [
-            peks.ManagedNodeGroup(f'{config.resource_prefix}-mng-{subnet_id[-4:]}',
-                cluster_name=cluster.eks_cluster,
-                args=managed_nodegroup_args,
-                subnet_ids=subnet_id,
-                opts=pulumi.ResourceOptions(
-                    depends_on=[cluster, node_role] + node_policy_attachments
-                )
-            )
-            for subnet_id in subnets
-        ]
-    )
+    ## Pools in config order, with dependency_mode: minimal the addons wait for the first group of the
+    ## first pool (the one for system pods)
+    pool_groups = [
+        _define_node_pool(config, pool, cluster, node_role, vpc, ng_tags, node_depends_on)
+        for pool in config.node_pools()
+    ]
+    node_groups = pulumi.Output.all(*pool_groups).apply(lambda pools: [g for groups in pools for g in groups])
 
     asgs = node_groups.apply(
         lambda group: [
@@ -260,34 +435,97 @@ def define_node_groups(config: AWSPulumiConfig, cluster: pulumi.Output, node_rol
 
     return node_groups
 
-def define_addons(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list) -> list:
-    addons = config.eks['addons']
+def define_addons(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list) -> dict:
+    ## {addon name: Addon}
+    addons = config.eks.addons
     if not addons:
         ## Just to show in the outputs that we didn't install any
         pulumi.export('addons', [])
-        return []
+        return {}
 
-    installed_addons = []
+    installed_addons = {}
     cluster = k8s_provider.cluster
 
     for addon in addons:
+        if addon.name == 'vpc-cni':
+            ## Installed by the cluster (see define_cluster)
+            continue
+
+        _values = addon.configuration()
         args = paws.eks.AddonArgs(
             cluster_name=cluster.eks_cluster,
-            addon_name=addon['name'],
-            addon_version=addon['version'],
+            addon_name=addon.name,
+            addon_version=addon.version,
+            configuration_values=json.dumps(_values) if _values else None,
             resolve_conflicts_on_create="OVERWRITE",
             resolve_conflicts_on_update="PRESERVE"
         )
 
-        installed_addons.append(paws.eks.Addon(
-            resource_name=f'{config.resource_prefix}-{addon["name"]}',
+        installed_addons[addon.name] = paws.eks.Addon(
+            resource_name=f'{config.resource_prefix}-{addon.name}',
             args=args,
             opts=pulumi.ResourceOptions(
                 provider=k8s_provider.get_provider(),
-                depends_on=node_groups
+                depends_on=common.node_group_dependencies(config, node_groups)
             )
-        ))
+        )
 
-    pulumi.export('addons', [a.arn for a in installed_addons])
+    pulumi.export('addons', [a.arn for a in installed_addons.values()])
 
     return installed_addons
+
+def define_storage_classes(config: AWSPulumiConfig, k8s_provider: k8sProvider, addons: dict) -> list:
+    ## EBS StorageClasses for the aws-ebs-csi-driver addon. Volumes are created once a pod is scheduled
+    ## (WaitForFirstConsumer), in that pod's AZ.
+    ebs_addon = addons.get('aws-ebs-csi-driver')
+    storage_classes = []
+
+    for storage_class in config.eks.storage_classes:
+        parameters = {
+            'type': storage_class.type,
+            'encrypted': str(storage_class.encrypted).lower(),
+            'csi.storage.k8s.io/fstype': storage_class.fs_type,
+        }
+        if storage_class.iops:
+            parameters['iops'] = str(storage_class.iops)
+        if storage_class.throughput:
+            parameters['throughput'] = str(storage_class.throughput)
+        if storage_class.kms_key_id:
+            parameters['kmsKeyId'] = storage_class.kms_key_id
+
+        allowed_topologies = None
+        if storage_class.zones:
+            allowed_topologies = [{'matchLabelExpressions': [{'key': 'topology.kubernetes.io/zone', 'values': storage_class.zones}]}]
+
+        storage_classes.append(pk8s.storage.v1.StorageClass(f'{config.resource_prefix}-sc-{storage_class.name}',
+            metadata={
+                'name': storage_class.name,
+                'annotations': {'storageclass.kubernetes.io/is-default-class': str(storage_class.default).lower()}
+            },
+            provisioner='ebs.csi.aws.com',
+            parameters=parameters,
+            reclaim_policy=storage_class.reclaim_policy,
+            allow_volume_expansion=storage_class.allow_volume_expansion,
+            volume_binding_mode='WaitForFirstConsumer',
+            allowed_topologies=allowed_topologies,
+            opts=pulumi.ResourceOptions(provider=k8s_provider.get_provider(), depends_on=ebs_addon)
+        ))
+
+    ## EKS' in-tree gp2 class is annotated as the default too (on clusters created before 1.30). With a
+    ## default of ours it is annotated false, so PVCs without a class only get ours.
+    if any(c.default for c in config.eks.storage_classes) and 'gp2' not in [c.name for c in config.eks.storage_classes]:
+        storage_classes.append(pk8s.storage.v1.StorageClassPatch(f'{config.resource_prefix}-sc-gp2-not-default',
+            metadata={
+                'name': 'gp2',
+                'annotations': {
+                    'storageclass.kubernetes.io/is-default-class': 'false',
+                    ## EKS created the class, so its field manager owns the annotation
+                    'pulumi.com/patchForce': 'true',
+                }
+            },
+            opts=pulumi.ResourceOptions(provider=k8s_provider.get_provider(), depends_on=storage_classes[:])
+        ))
+
+    pulumi.export('storage_classes', [c.name for c in config.eks.storage_classes])
+
+    return storage_classes
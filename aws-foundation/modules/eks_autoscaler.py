@@ -0,0 +1,326 @@
+import json
+import pulumi
+import pulumi_aws as paws
+import pulumi_kubernetes as pk8s
+from pulumi_kubernetes.helm.v3 import Release, ReleaseArgs, RepositoryOptsArgs
+from modules.eks import k8sProvider
+from modules.eks_lb_controller import create_service_account_role
+from config import AWSPulumiConfig
+from constants import Constants as CONST
+
+import modules.common as common
+
+## Node autoscaling for the cluster: cluster-autoscaler scales the managed node groups (up to
+## eks.max_nodes_per_group), Karpenter launches nodes itself from a NodePool shaped like eks.node_groups.
+
+def define_autoscaler(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list, cluster_data: dict, vpc_data: dict) -> dict:
+    if config.eks.autoscaler.type == 'karpenter':
+        return define_karpenter(config, k8s_provider, node_groups, cluster_data['node_role'], vpc_data)
+    return define_cluster_autoscaler(config, k8s_provider, node_groups, cluster_data['autoscaling_policy'])
+
+def _service_account_role(config: AWSPulumiConfig, k8s_provider: k8sProvider, service_account: str, policy: paws.iam.Policy) -> paws.iam.Role:
+    ## IRSA: the chart's service account assumes this role
+    cluster = k8s_provider.cluster
+    return create_service_account_role(
+        config=config,
+        role_name=f'{config.resource_prefix}-{service_account}',
+        oidc_provider_url=cluster.core.oidc_provider.url,
+        oidc_provider_arn=cluster.core.oidc_provider.arn,
+        service_account_name=service_account,
+        policy=policy
+    )
+
+def _release(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list, chart: dict, name: str) -> Release:
+    source = chart.get('source')
+    release_args = ReleaseArgs(
+        chart=chart.get('chart_name'),
+        create_namespace=True,
+        force_update=True,
+        namespace=chart.get('namespace'),
+        repository_opts=RepositoryOptsArgs(repo=source.get('url')) if source else None,
+        timeout=300,
+        values=chart.get('values'),
+        version=config.eks.autoscaler.version or chart.get('version')
+    )
+
+    release = Release(
+        resource_name=f'{config.resource_prefix}-{name}',
+        args=release_args,
+        opts=pulumi.ResourceOptions(
+            provider=k8s_provider.get_provider(), depends_on=common.node_group_dependencies(config, node_groups)
+        )
+    )
+
+    combined = pulumi.Output.all(release.name, release.version, release.status['status'])
+    pulumi.export('helm_eks_autoscaler', combined.apply(lambda x: f'Name: {x[0]}, Version: {x[1]}, Status: {x[2]}'))
+
+    return release
+
+def define_cluster_autoscaler(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list, autoscaling_policy: paws.iam.Policy) -> dict:
+    settings = config.eks.autoscaler.cluster_autoscaler
+    chart = common.get_datafile(CONST.FILE_CA_VALUES)
+    service_account = config.eks.autoscaler.service_role_name or chart['values']['rbac']['serviceAccount']['name']
+    role = _service_account_role(config, k8s_provider, service_account, autoscaling_policy)
+
+    region = common.cached_invoke(paws.get_region)
+    values = chart['values']
+    values['autoDiscovery']['clusterName'] = config.resource_prefix
+    values['awsRegion'] = getattr(region, 'region', None) or region.name
+    ## The cluster-autoscaler minor version has to match the cluster's
+    values['image']['tag'] = settings.image_tag or f'v{config.eks.version}.0'
+    values['rbac']['serviceAccount']['name'] = service_account
+    values['rbac']['serviceAccount']['annotations']['eks.amazonaws.com/role-arn'] = role.arn
+    values['extraArgs'].update({
+        'expander': settings.expander,
+        'scan-interval': settings.scan_interval,
+        'new-pod-scale-up-delay': settings.new_pod_scale_up_delay,
+        'max-node-provision-time': settings.max_node_provision_time,
+        'scale-down-delay-after-add': settings.scale_down_delay_after_add,
+        'scale-down-unneeded-time': settings.scale_down_unneeded_time,
+        'scale-down-utilization-threshold': settings.scale_down_utilization_threshold,
+    })
+
+    release = _release(config, k8s_provider, node_groups, chart, 'cluster-autoscaler')
+
+    return {
+        'service_account_role': role,
+        'release': release
+    }
+
+def _instance_type_requirement(instance_types: list) -> dict:
+    ## Karpenter compares the values literally, so family wildcards (m6a.*) become an instance-family
+    ## requirement. The config validation keeps them from being mixed with instance types.
+    if any('*' in t for t in instance_types):
+        return {'key': 'karpenter.k8s.aws/instance-family', 'operator': 'In', 'values': [t.removesuffix('.*') for t in instance_types]}
+    return {'key': 'node.kubernetes.io/instance-type', 'operator': 'In', 'values': instance_types}
+
+def _node_pool_requirements(config: AWSPulumiConfig) -> list:
+    ## The same instances the node groups' launch template asks for
+    node_groups = config.eks.node_groups
+    return [
+        _instance_type_requirement(node_groups.instance_types),
+        {'key': 'karpenter.k8s.aws/instance-memory', 'operator': 'Gt', 'values': [str(node_groups.memory_mib.min - 1)]},
+        {'key': 'karpenter.k8s.aws/instance-memory', 'operator': 'Lt', 'values': [str(node_groups.memory_mib.max + 1)]},
+        {'key': 'karpenter.k8s.aws/instance-cpu', 'operator': 'Gt', 'values': [str(node_groups.vcpu_count.min - 1)]},
+        {'key': 'karpenter.k8s.aws/instance-cpu', 'operator': 'Lt', 'values': [str(node_groups.vcpu_count.max + 1)]},
+        {'key': 'karpenter.sh/capacity-type', 'operator': 'In', 'values': config.eks.autoscaler.karpenter.capacity_types},
+        {'key': 'kubernetes.io/arch', 'operator': 'In', 'values': [CONST.K8S_ARCHITECTURES[node_groups.architecture or 'x86_64']]},
+    ]
+
+def _ami_alias(config: AWSPulumiConfig) -> str:
+    return 'bottlerocket@latest' if config.eks.node_groups.ami_family == 'BOTTLEROCKET' else 'al2023@latest'
+
+def _karpenter_policy(cluster_name: str, region: str, node_role_arn: str) -> str:
+    ## Karpenter's reference controller policy: it only creates, tags and deletes what carries this cluster's
+    ## tags (Karpenter adds them to everything it launches), and only passes the nodes' role
+    partition, account = node_role_arn.split(':')[1], node_role_arn.split(':')[4]
+    ec2 = f'arn:{partition}:ec2:{region}'
+    profiles = f'arn:{partition}:iam::{account}:instance-profile/*'
+    owned = {f'aws:ResourceTag/kubernetes.io/cluster/{cluster_name}': 'owned'}
+    request_owned = {f'aws:RequestTag/kubernetes.io/cluster/{cluster_name}': 'owned', 'aws:RequestTag/eks:eks-cluster-name': cluster_name}
+    launched = [f'{ec2}:*:{r}/*' for r in ('fleet', 'instance', 'volume', 'network-interface', 'launch-template', 'spot-instances-request')]
+
+    return json.dumps({
+        'Version': '2012-10-17',
+        'Statement': [
+            {
+                'Sid': 'AllowScopedEC2InstanceAccessActions',
+                'Effect': 'Allow',
+                'Action': ['ec2:RunInstances', 'ec2:CreateFleet'],
+                'Resource': [f'{ec2}::image/*', f'{ec2}::snapshot/*', f'{ec2}:*:security-group/*', f'{ec2}:*:subnet/*'],
+            },
+            {
+                'Sid': 'AllowScopedEC2LaunchTemplateAccessActions',
+                'Effect': 'Allow',
+                'Action': ['ec2:RunInstances', 'ec2:CreateFleet'],
+                'Resource': f'{ec2}:*:launch-template/*',
+                'Condition': {'StringEquals': owned, 'StringLike': {'aws:ResourceTag/karpenter.sh/nodepool': '*'}},
+            },
+            {
+                'Sid': 'AllowScopedEC2InstanceActionsWithTags',
+                'Effect': 'Allow',
+                'Action': ['ec2:RunInstances', 'ec2:CreateFleet', 'ec2:CreateLaunchTemplate'],
+                'Resource': launched,
+                'Condition': {'StringEquals': request_owned, 'StringLike': {'aws:RequestTag/karpenter.sh/nodepool': '*'}},
+            },
+            {
+                'Sid': 'AllowScopedResourceCreationTagging',
+                'Effect': 'Allow',
+                'Action': 'ec2:CreateTags',
+                'Resource': launched,
+                'Condition': {
+                    'StringEquals': request_owned | {'ec2:CreateAction': ['RunInstances', 'CreateFleet', 'CreateLaunchTemplate']},
+                    'StringLike': {'aws:RequestTag/karpenter.sh/nodepool': '*'},
+                },
+            },
+            {
+                ## The node claim's name, once the instance is up
+                'Sid': 'AllowScopedResourceTagging',
+                'Effect': 'Allow',
+                'Action': 'ec2:CreateTags',
+                'Resource': f'{ec2}:*:instance/*',
+                'Condition': {
+                    'StringEquals': owned,
+                    'StringLike': {'aws:ResourceTag/karpenter.sh/nodepool': '*'},
+                    'StringEqualsIfExists': {'aws:RequestTag/eks:eks-cluster-name': cluster_name},
+                    'ForAllValues:StringEquals': {'aws:TagKeys': ['eks:eks-cluster-name', 'karpenter.sh/nodeclaim', 'Name']},
+                },
+            },
+            {
+                'Sid': 'AllowScopedDeletion',
+                'Effect': 'Allow',
+                'Action': ['ec2:TerminateInstances', 'ec2:DeleteLaunchTemplate'],
+                'Resource': [f'{ec2}:*:instance/*', f'{ec2}:*:launch-template/*'],
+                'Condition': {'StringEquals': owned, 'StringLike': {'aws:ResourceTag/karpenter.sh/nodepool': '*'}},
+            },
+            {
+                'Sid': 'AllowRegionalReadActions',
+                'Effect': 'Allow',
+                'Action': [
+                    'ec2:DescribeAvailabilityZones',
+                    'ec2:DescribeImages',
+                    'ec2:DescribeInstances',
+                    'ec2:DescribeInstanceTypeOfferings',
+                    'ec2:DescribeInstanceTypes',
+                    'ec2:DescribeLaunchTemplates',
+                    'ec2:DescribeSecurityGroups',
+                    'ec2:DescribeSpotPriceHistory',
+                    'ec2:DescribeSubnets',
+                ],
+                'Resource': '*',
+                'Condition': {'StringEquals': {'aws:RequestedRegion': region}},
+            },
+            {
+                'Sid': 'AllowSSMReadActions',
+                'Effect': 'Allow',
+                'Action': 'ssm:GetParameter',
+                'Resource': f'arn:{partition}:ssm:{region}::parameter/aws/service/*',
+            },
+            {
+                'Sid': 'AllowPricingReadActions',
+                'Effect': 'Allow',
+                'Action': 'pricing:GetProducts',
+                'Resource': '*',
+            },
+            {
+                'Sid': 'AllowPassingInstanceRole',
+                'Effect': 'Allow',
+                'Action': 'iam:PassRole',
+                'Resource': node_role_arn,
+                'Condition': {'StringEquals': {'iam:PassedToService': 'ec2.amazonaws.com'}},
+            },
+            {
+                'Sid': 'AllowScopedInstanceProfileCreationActions',
+                'Effect': 'Allow',
+                'Action': 'iam:CreateInstanceProfile',
+                'Resource': profiles,
+                'Condition': {
+                    'StringEquals': request_owned | {'aws:RequestTag/topology.kubernetes.io/region': region},
+                    'StringLike': {'aws:RequestTag/karpenter.k8s.aws/ec2nodeclass': '*'},
+                },
+            },
+            {
+                'Sid': 'AllowScopedInstanceProfileTagActions',
+                'Effect': 'Allow',
+                'Action': 'iam:TagInstanceProfile',
+                'Resource': profiles,
+                'Condition': {
+                    'StringEquals': owned | {'aws:ResourceTag/topology.kubernetes.io/region': region} | request_owned
+                        | {'aws:RequestTag/topology.kubernetes.io/region': region},
+                    'StringLike': {'aws:ResourceTag/karpenter.k8s.aws/ec2nodeclass': '*', 'aws:RequestTag/karpenter.k8s.aws/ec2nodeclass': '*'},
+                },
+            },
+            {
+                'Sid': 'AllowScopedInstanceProfileActions',
+                'Effect': 'Allow',
+                'Action': ['iam:AddRoleToInstanceProfile', 'iam:RemoveRoleFromInstanceProfile', 'iam:DeleteInstanceProfile'],
+                'Resource': profiles,
+                'Condition': {
+                    'StringEquals': owned | {'aws:ResourceTag/topology.kubernetes.io/region': region},
+                    'StringLike': {'aws:ResourceTag/karpenter.k8s.aws/ec2nodeclass': '*'},
+                },
+            },
+            {
+                'Sid': 'AllowInstanceProfileReadActions',
+                'Effect': 'Allow',
+                'Action': 'iam:GetInstanceProfile',
+                'Resource': profiles,
+            },
+            {
+                'Sid': 'AllowAPIServerEndpointDiscovery',
+                'Effect': 'Allow',
+                'Action': 'eks:DescribeCluster',
+                'Resource': f'arn:{partition}:eks:{region}:{account}:cluster/{cluster_name}',
+            },
+        ]
+    })
+
+def define_karpenter(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list, node_role: paws.iam.Role, vpc_data: dict) -> dict:
+    settings = config.eks.autoscaler.karpenter
+    chart = common.get_datafile(CONST.FILE_KARPENTER_VALUES)
+    service_account = config.eks.autoscaler.service_role_name or chart['values']['serviceAccount']['name']
+
+    ## Scoped to this cluster's name and node role, which are only known at deploy time
+    region = common.cached_invoke(paws.get_region)
+    policy = paws.iam.Policy(f'{config.resource_prefix}-karpenter',
+        name_prefix=f'{config.resource_prefix}-karpenter',
+        policy=node_role.arn.apply(
+            lambda arn: _karpenter_policy(config.resource_prefix, getattr(region, 'region', None) or region.name, arn)
+        )
+    )
+    role = _service_account_role(config, k8s_provider, service_account, policy)
+
+    values = chart['values']
+    values['settings']['clusterName'] = config.resource_prefix
+    values['serviceAccount']['name'] = service_account
+    values['serviceAccount']['annotations']['eks.amazonaws.com/role-arn'] = role.arn
+
+    release = _release(config, k8s_provider, node_groups, chart, 'karpenter')
+    _opts = pulumi.ResourceOptions(provider=k8s_provider.get_provider(), depends_on=[release])
+
+    ## Nodes use the node groups' role (already mapped in the cluster), private subnets and the
+    ## security group EKS created for the cluster
+    node_class = pk8s.apiextensions.CustomResource(f'{config.resource_prefix}-karpenter-nodeclass',
+        api_version='karpenter.k8s.aws/v1',
+        kind='EC2NodeClass',
+        metadata={'name': 'default'},
+        spec={
+            'role': node_role.name,
+            'amiSelectorTerms': [{'alias': settings.ami_alias or _ami_alias(config)}],
+            'subnetSelectorTerms': vpc_data['private_subnets'].apply(lambda ids: [{'id': i} for i in ids]),
+            'securityGroupSelectorTerms': [{'tags': {'aws:eks:cluster-name': config.resource_prefix}}],
+            'tags': config.tags,
+        },
+        opts=_opts
+    )
+
+    ## Without an explicit limit, no more CPUs than the node groups could scale to
+    cpu_limit = settings.cpu_limit or vpc_data['private_subnets'].apply(
+        lambda ids: len(ids) * config.eks.max_nodes_per_group * config.eks.node_groups.vcpu_count.max
+    )
+    node_pool = pk8s.apiextensions.CustomResource(f'{config.resource_prefix}-karpenter-nodepool',
+        api_version='karpenter.sh/v1',
+        kind='NodePool',
+        metadata={'name': 'default'},
+        spec={
+            'template': {
+                'spec': {
+                    'nodeClassRef': {'group': 'karpenter.k8s.aws', 'kind': 'EC2NodeClass', 'name': 'default'},
+                    'requirements': _node_pool_requirements(config),
+                }
+            },
+            'limits': {'cpu': cpu_limit},
+            'disruption': {
+                'consolidationPolicy': settings.consolidation_policy,
+                'consolidateAfter': settings.consolidate_after,
+            },
+        },
+        opts=pulumi.ResourceOptions(provider=k8s_provider.get_provider(), depends_on=[release, node_class])
+    )
+
+    return {
+        'service_account_role': role,
+        'release': release,
+        'node_class': node_class,
+        'node_pool': node_pool
+    }
@@ -12,8 +12,8 @@ import json
 def define_lb_controller(config: AWSPulumiConfig, k8s_provider: k8sProvider, node_groups: list, vpc_id: str) -> dict:
     service_role_policy = create_service_role_policy(config)
     cluster = k8s_provider.cluster
-    _role_name = f'{config.resource_prefix}-{config.eks.get("loadbalancer_controller").get("role_name_prefix")}'
-    _service_role_name = f'{config.resource_prefix}-{config.eks.get("loadbalancer_controller").get("service_role_name")}'
+    _role_name = f'{config.resource_prefix}-{config.eks.loadbalancer_controller.role_name_prefix}'
+    _service_role_name = f'{config.resource_prefix}-{config.eks.loadbalancer_controller.service_role_name}'
 
     service_account_role = create_service_account_role(
         config=config,
@@ -49,7 +49,7 @@ def define_lb_controller(config: AWSPulumiConfig, k8s_provider: k8sProvider, nod
         resource_name=f'{config.resource_prefix}-lb-controller',
         args=release_args,
         opts=pulumi.ResourceOptions(
-            provider=k8s_provider.get_provider(), depends_on=node_groups
+            provider=k8s_provider.get_provider(), depends_on=common.node_group_dependencies(config, node_groups)
         )
     )
 
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+import pulumi
+from config import AWSPulumiConfig
+from constants import Constants as CONST
+
+## The outputs of the foundation stack, for the stacks built on top of it. They're read through a
+## StackReference, which is a round trip to the backend on every preview. With foundation_snapshot.enabled
+## they're read from a local snapshot instead; tools/foundation_snapshot.py takes one after an update.
+SNAPSHOT_VERSION = 1
+FOUNDATION_STACK = 'foundation'
+
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def snapshot_file(config: AWSPulumiConfig = None) -> str:
+    if config and config.foundation_snapshot.file:
+        return config.foundation_snapshot.file
+    return os.path.join(CONST.PATH_SNAPSHOTS, f'{FOUNDATION_STACK}.json')
+
+def _config_digest() -> str:
+    ## A change to the foundation stack config means a newer foundation update is likely
+    config_file = os.path.join(CONST.PATH_STACK_CONFIGS, f'sc-{FOUNDATION_STACK}.yaml')
+    if not os.path.isfile(config_file):
+        return None
+    with open(config_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def write_snapshot(path: str, project: str, outputs: dict, update: dict) -> dict:
+    ## outputs: {name: {'value': ..., 'secret': bool}}, update: {'version': int, 'end_time': str} of the
+    ## foundation update the outputs are from
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'project': project,
+        'stack': FOUNDATION_STACK,
+        'taken_at': time.time(),
+        'update': update,
+        'config_digest': _config_digest(),
+        'outputs': outputs,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+    os.replace(f'{path}.tmp', path)
+    return snapshot
+
+def load_snapshot(path: str) -> dict:
+    if not os.path.isfile(path):
+        raise OSError(f'No foundation snapshot at {path}')
+    with open(path, 'r') as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f'Foundation snapshot {path} has version {snapshot.get("version")}, expected {SNAPSHOT_VERSION}')
+    return snapshot
+
+def latest_update(stack_name: str = FOUNDATION_STACK, work_dir: str = None) -> dict:
+    ## {'version', 'end_time'} of the last successful update of the stack, from the backend
+    from pulumi import automation
+
+    stack = automation.select_stack(stack_name=stack_name, work_dir=work_dir or _PROJECT_DIR)
+    for update in stack.history(page_size=10):
+        if update.kind == 'update' and update.result == 'succeeded':
+            return {'version': update.version, 'end_time': update.end_time.isoformat() if update.end_time else None}
+    return None
+
+def stale_reason(snapshot: dict, project: str = None, max_age: int = 0, update: dict = None) -> str:
+    ## Why the snapshot can't be used, or None when it can
+    if project and snapshot.get('project') != project:
+        return f'it is for project {snapshot.get("project")}, not {project}'
+    if max_age and time.time() - snapshot['taken_at'] > max_age:
+        return f'it is older than {max_age}s'
+    digest = _config_digest()
+    if digest and snapshot.get('config_digest') and digest != snapshot['config_digest']:
+        return f'sc-{FOUNDATION_STACK}.yaml changed since it was taken'
+    if update and (snapshot.get('update') or {}).get('version') != update['version']:
+        return f'the {FOUNDATION_STACK} stack was updated since (version {update["version"]})'
+    return None
+
+class FoundationSnapshot(object):
+    ## Stands in for the StackReference to the foundation stack
+
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+
+    def get_output(self, name: str) -> pulumi.Output:
+        output = self.snapshot['outputs'].get(name)
+        if output is None:
+            raise KeyError(f'The foundation snapshot has no output {name}')
+        if output.get('secret'):
+            return pulumi.Output.secret(output['value'])
+        return pulumi.Output.from_input(output['value'])
+
+def reference(config: AWSPulumiConfig, org: str, project: str) -> object:
+    ## The foundation outputs: from the snapshot when it's enabled and fresh, otherwise a StackReference
+    settings = config.foundation_snapshot
+    if settings.enabled:
+        path = snapshot_file(config)
+        try:
+            snapshot = load_snapshot(path)
+            update = latest_update() if settings.verify else None
+            reason = stale_reason(snapshot, project, settings.max_age, update)
+        except Exception as e:
+            reason = str(e)
+
+        if not reason:
+            pulumi.log.debug(f'Foundation outputs from snapshot {path}')
+            return FoundationSnapshot(snapshot)
+        pulumi.log.warn(f'Not using the foundation snapshot, {reason}. Reading the {FOUNDATION_STACK} stack instead.')
+
+    return pulumi.StackReference(f'{org}/{project}/{FOUNDATION_STACK}')
@@ -13,12 +13,12 @@ def define_lb(config: AWSPulumiConfig, vpc_data: dict, instances: list) -> paws.
     lb_sec = common.create_security_group(
         resource_prefix=config.resource_prefix, 
         vpc_id=vpc_data['vpc_id'], 
-        ingress_data=config.lb.get('security_group').get('rules')['ingress'], 
+        ingress_data=config.lb.security_group['rules']['ingress'], 
         identifier='alb'
     )
 
     lb = paws.lb.LoadBalancer(f'{config.resource_prefix}-lb',
-        load_balancer_type=config.lb.get('type'),
+        load_balancer_type=config.lb.type,
         enable_deletion_protection=False,
         idle_timeout=5,
         internal=False,
@@ -72,7 +72,7 @@ def _define_ssl_listener(config: AWSPulumiConfig, lb: paws.lb.LoadBalancer, targ
         port=443,
         protocol="HTTPS",
         ssl_policy="ELBSecurityPolicy-2016-08",
-        certificate_arn=config.lb.get('certificate_arn'),
+        certificate_arn=config.lb.certificate_arn,
         default_actions=[
             paws.lb.ListenerDefaultActionArgs(
                 type="forward",
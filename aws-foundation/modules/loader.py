@@ -0,0 +1,53 @@
+import importlib
+import os
+import sys
+import time
+import pulumi
+
+## Only the modules a stack's config actually enables get imported. The EKS related modules pull
+## in pulumi_eks, pulumi_kubernetes and the helm module, which are expensive to import and never
+## used by the foundation or jenkins-ec2 stacks.
+_PROVIDER_PACKAGES = ('pulumi', 'pulumi_aws', 'pulumi_eks', 'pulumi_kubernetes')
+
+_import_times = {}
+
+def _top_level_packages() -> set:
+    return {name for name in sys.modules if '.' not in name}
+
+def load(name: str) -> object:
+    ## Import modules.<name>, recording how long it took and which provider packages it pulled in
+    module_name = f'modules.{name}'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    before = _top_level_packages()
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    record(name, start, before)
+
+    return module
+
+## Record an import measured from start, e.g. the eager imports at the top of __main__
+def record(name: str, start: float, before: set = None):
+    elapsed = time.perf_counter() - start
+    new_packages = _top_level_packages() - (before or set())
+    _import_times[name] = {
+        'ms': round(elapsed * 1000, 1),
+        'packages': sorted(p for p in new_packages if p in _PROVIDER_PACKAGES)
+    }
+
+def import_report() -> dict:
+    return dict(_import_times)
+
+## Log the import time breakdown. It's a debug message unless PULUMI_IMPORT_REPORT is set, in which
+## case it's logged as info and exported as the import_times stack output so regressions are easy to track.
+def report():
+    _report = import_report()
+    _lines = [f'{k}: {v["ms"]}ms {", ".join(v["packages"])}'.rstrip() for k, v in _report.items()]
+    _msg = 'Import times:\n  ' + '\n  '.join(_lines)
+
+    if os.environ.get('PULUMI_IMPORT_REPORT'):
+        pulumi.log.info(_msg)
+        pulumi.export('import_times', _report)
+    else:
+        pulumi.log.debug(_msg)
@@ -1,29 +1,73 @@
 import pulumi
 import pulumi_aws as paws
 from config import AWSPulumiConfig
+from constants import Constants as CONST
 import modules.common as common
+import modules.rds_tuning as rds_tuning
 
 
-def _define_db_subnet_group(config: AWSPulumiConfig, subnets: list) -> pulumi.Output:
+def _define_db_subnet_group(config: AWSPulumiConfig, subnets: pulumi.Output) -> pulumi.Output:
     subnet_group = paws.rds.SubnetGroup(config.resource_prefix,
         name_prefix=config.resource_prefix,
-        subnet_ids=[s.id for s in subnets]
+        subnet_ids=subnets
     )
     return subnet_group
 
 def _define_parameter_group(config: AWSPulumiConfig) -> pulumi.Output:
-    parameters = []
-    if config.rds['parameters']:
-        for k, v in config.rds['parameters'].items():
-            parameters.append(paws.rds.ClusterParameterGroupParameterArgs(name=k, value=v))
+    parameters = rds_tuning.parameter_args(config, [config.rds.instance_class], paws.rds.ClusterParameterGroupParameterArgs)
 
     param_group = paws.rds.ClusterParameterGroup(f'{config.resource_prefix}-pgroup',
         name_prefix=config.resource_prefix,
-        family=config.rds['family'],
+        family=config.rds.family,
         parameters=parameters
     )
     return param_group
 
+def _define_aurora_instances(config: AWSPulumiConfig, db_cluster: paws.rds.Cluster) -> list:
+    ## The writer fails over to the reader with the lowest promotion tier
+    instances = []
+    for i in range(1 + config.rds.aurora.readers):
+        name = f'{config.resource_prefix}-writer' if i == 0 else f'{config.resource_prefix}-reader-{i - 1}'
+        instances.append(paws.rds.ClusterInstance(name,
+            identifier=name,
+            cluster_identifier=db_cluster.id,
+            instance_class=config.rds.aurora.instance_class,
+            engine=db_cluster.engine,
+            engine_version=db_cluster.engine_version,
+            promotion_tier=min(i, 15),
+            ## Readers created before the writer would take its place
+            opts=pulumi.ResourceOptions(depends_on=instances[:1])
+        ))
+    return instances
+
+def _define_reader_autoscaling(config: AWSPulumiConfig, db_cluster: paws.rds.Cluster, instances: list) -> paws.appautoscaling.Policy:
+    ## Readers added by Application Auto Scaling are like the writer and not in the stack. It only removes
+    ## the ones it added, so the readers above stay.
+    settings = config.rds.aurora.autoscaling
+    target = paws.appautoscaling.Target(f'{config.resource_prefix}-rds-readers',
+        service_namespace='rds',
+        scalable_dimension='rds:cluster:ReadReplicaCount',
+        resource_id=db_cluster.id.apply(lambda i: f'cluster:{i}'),
+        min_capacity=settings.min_readers,
+        max_capacity=settings.max_readers,
+        opts=pulumi.ResourceOptions(depends_on=instances)
+    )
+
+    return paws.appautoscaling.Policy(f'{config.resource_prefix}-rds-readers',
+        policy_type='TargetTrackingScaling',
+        service_namespace=target.service_namespace,
+        scalable_dimension=target.scalable_dimension,
+        resource_id=target.resource_id,
+        target_tracking_scaling_policy_configuration=paws.appautoscaling.PolicyTargetTrackingScalingPolicyConfigurationArgs(
+            predefined_metric_specification=paws.appautoscaling.PolicyTargetTrackingScalingPolicyConfigurationPredefinedMetricSpecificationArgs(
+                predefined_metric_type=CONST.AURORA_SCALING_METRICS[settings.metric]
+            ),
+            target_value=settings.target,
+            scale_in_cooldown=settings.scale_in_cooldown,
+            scale_out_cooldown=settings.scale_out_cooldown
+        )
+    )
+
 def define_rds(config: AWSPulumiConfig, vpc_data: dict) -> pulumi.Output:
     return define_rds_cluster(config, vpc_data)
 
@@ -32,10 +76,10 @@ def define_rds_cluster(config: AWSPulumiConfig, vpc_data: dict) -> pulumi.Output
     subnet_group = _define_db_subnet_group(config, vpc_data['private_subnets'])
     
     ingress_rules = [{
-        'from_port': config.rds['port'],
-        'to_port': config.rds['port'],
+        'from_port': config.rds.port,
+        'to_port': config.rds.port,
         'protocol': 'tcp',
-        'cidr_ip': [config.vpc['cidr']]
+        'cidr_ip': config.vpc.cidr
     }]
     security_group = common.create_security_group(
         resource_prefix=config.resource_prefix,
@@ -44,27 +88,48 @@ def define_rds_cluster(config: AWSPulumiConfig, vpc_data: dict) -> pulumi.Output
         identifier='rds'
     )
 
+    if config.aurora_requested():
+        ## Aurora storage grows by itself, the instances are ClusterInstances
+        cluster_args = {
+            'storage_type': None if config.rds.storage_type == 'aurora' else config.rds.storage_type,
+            'serverlessv2_scaling_configuration': paws.rds.ClusterServerlessv2ScalingConfigurationArgs(
+                min_capacity=config.rds.aurora.min_capacity,
+                max_capacity=config.rds.aurora.max_capacity
+            ),
+        }
+    else:
+        cluster_args = {
+            'allocated_storage': config.rds.storage,
+            'storage_type': config.rds.storage_type,
+            'db_cluster_instance_class': config.rds.instance_class,
+        }
+
     db_cluster = paws.rds.Cluster(config.resource_prefix,
-        allocated_storage=config.rds['storage'],
-        storage_type=config.rds['storage_type'],
         cluster_identifier=config.resource_prefix,
-        engine=config.rds['engine'],
-        engine_version=config.rds['engine_version'],
-        database_name=config.rds['db_name'],
-        master_username=config.rds['db_user'],
+        engine=config.rds.engine,
+        engine_version=config.rds.engine_version,
+        database_name=config.rds.db_name,
+        master_username=config.rds.db_user,
         manage_master_user_password=True,
-        port=config.rds['port'],
-        db_cluster_instance_class=config.rds['instance_class'],
+        port=config.rds.port,
         db_subnet_group_name=subnet_group.name,
         skip_final_snapshot=True,
         vpc_security_group_ids=[security_group.id],
         db_cluster_parameter_group_name=parameter_group.name,
+        **cluster_args,
         opts=pulumi.ResourceOptions(
-            depends_on=[parameter_group, subnet_group, security_group]
+            ## All three are inputs already, so minimal dependency mode leaves them out
+            depends_on=None if config.minimal_dependencies() else [parameter_group, subnet_group, security_group]
         )
     )
 
+    if config.aurora_requested():
+        instances = _define_aurora_instances(config, db_cluster)
+        if config.rds.aurora.autoscaling.enabled:
+            _define_reader_autoscaling(config, db_cluster, instances)
+
     pulumi.export('rds_endpoint', db_cluster.endpoint)
+    pulumi.export('rds_reader_endpoint', db_cluster.reader_endpoint)
     pulumi.export('rds_master_password', db_cluster.master_password)
 
-    return db_cluster
\ No newline at end of file
+    return db_cluster
@@ -1,25 +1,29 @@
+import json
 import pulumi
 import pulumi_aws as paws
 from config import AWSPulumiConfig
+from constants import Constants as CONST
 import modules.common as common
+import modules.rds_tuning as rds_tuning
 
 
-def _define_db_subnet_group(config: AWSPulumiConfig, subnets: list) -> pulumi.Output:
+def _define_db_subnet_group(config: AWSPulumiConfig, subnets: pulumi.Output) -> pulumi.Output:
     subnet_group = paws.rds.SubnetGroup(config.resource_prefix,
         name_prefix=config.resource_prefix,
-        subnet_ids=[s.id for s in subnets]
+        subnet_ids=subnets
     )
     return subnet_group
 
 def _define_parameter_group(config: AWSPulumiConfig) -> pulumi.Output:
-    parameters = []
-    if config.rds['parameters']:
-        for k, v in config.rds['parameters'].items():
-            parameters.append(paws.rds.ParameterGroupParameterArgs(name=k, value=v))
+    ## The read replicas share the group, it has to fit their class too
+    instance_classes = [config.rds.instance_class]
+    if config.rds.read_replicas.count and config.rds.read_replicas.instance_class:
+        instance_classes.append(config.rds.read_replicas.instance_class)
+    parameters = rds_tuning.parameter_args(config, instance_classes, paws.rds.ParameterGroupParameterArgs)
 
     param_group = paws.rds.ParameterGroup(f'{config.resource_prefix}-pgroup',
         name_prefix=config.resource_prefix,
-        family=config.rds['family'],
+        family=config.rds.family,
         parameters=parameters
     )
     return param_group
@@ -32,10 +36,10 @@ def define_rds_instance(config: AWSPulumiConfig, vpc_data: dict) -> pulumi.Outpu
     subnet_group = _define_db_subnet_group(config, vpc_data['private_subnets'])
 
     ingress_rules = [{
-        'from_port': config.rds['port'],
-        'to_port': config.rds['port'],
+        'from_port': config.rds.port,
+        'to_port': config.rds.port,
         'protocol': 'tcp',
-        'cidr_ip': [config.vpc['cidr']]
+        'cidr_ip': config.vpc.cidr
     }]
     security_group = common.create_security_group(
         resource_prefix=config.resource_prefix,
@@ -45,26 +49,139 @@ def define_rds_instance(config: AWSPulumiConfig, vpc_data: dict) -> pulumi.Outpu
     )
 
     db_instance = paws.rds.Instance(config.resource_prefix,
-        allocated_storage=config.rds['storage'],
-        storage_type=config.rds['storage_type'],
+        allocated_storage=config.rds.storage,
+        storage_type=config.rds.storage_type,
         identifier=config.resource_prefix,
-        engine=config.rds['engine'],
-        engine_version=config.rds['engine_version'],
-        db_name=config.rds['db_name'],
-        username=config.rds['db_user'],
+        engine=config.rds.engine,
+        engine_version=config.rds.engine_version,
+        db_name=config.rds.db_name,
+        username=config.rds.db_user,
         manage_master_user_password=True,
-        port=config.rds['port'],
-        instance_class=config.rds['instance_class'],
+        port=config.rds.port,
+        instance_class=config.rds.instance_class,
         db_subnet_group_name=subnet_group.name,
         skip_final_snapshot=True,
         vpc_security_group_ids=[security_group.id],
         parameter_group_name=parameter_group.name,
         opts=pulumi.ResourceOptions(
-            depends_on=[parameter_group, subnet_group, security_group]
+            ## All three are inputs already, so minimal dependency mode leaves them out
+            depends_on=None if config.minimal_dependencies() else [parameter_group, subnet_group, security_group]
         )
     )
 
+    replicas = _define_read_replicas(config, db_instance, parameter_group, security_group)
+    proxy = _define_proxy(config, db_instance, vpc_data, security_group) if config.rds.proxy.enabled else None
+    if replicas or proxy:
+        _define_private_dns(config, vpc_data, proxy.endpoint if proxy else db_instance.address, replicas)
+
     pulumi.export('rds_endpoint', db_instance.endpoint)
+    pulumi.export('rds_reader_endpoints', [r.endpoint for r in replicas])
+    pulumi.export('rds_proxy_endpoint', proxy.endpoint if proxy else None)
     pulumi.export('rds_master_password', db_instance.master_user_secrets)
 
-    return db_instance
\ No newline at end of file
+    return db_instance
+
+def _define_read_replicas(config: AWSPulumiConfig, db_instance: paws.rds.Instance, parameter_group: paws.rds.ParameterGroup,
+    security_group: paws.ec2.SecurityGroup) -> list:
+    ## Storage, engine, credentials and subnets come from the source instance
+    settings = config.rds.read_replicas
+    azs = settings.availability_zones
+    return [
+        paws.rds.Instance(f'{config.resource_prefix}-replica-{i}',
+            identifier=f'{config.resource_prefix}-replica-{i}',
+            replicate_source_db=db_instance.identifier,
+            instance_class=settings.instance_class or config.rds.instance_class,
+            availability_zone=azs[i % len(azs)] if azs else None,
+            port=config.rds.port,
+            skip_final_snapshot=True,
+            vpc_security_group_ids=[security_group.id],
+            parameter_group_name=parameter_group.name
+        )
+        for i in range(settings.count)
+    ]
+
+def _define_proxy(config: AWSPulumiConfig, db_instance: paws.rds.Instance, vpc_data: dict, security_group: paws.ec2.SecurityGroup) -> paws.rds.Proxy:
+    ## Pools the connections of short-lived clients (CI jobs) so they don't each cost a database connection.
+    ## The proxy reads the master user secret RDS manages (manage_master_user_password).
+    settings = config.rds.proxy
+    secret_arn = db_instance.master_user_secrets.apply(lambda secrets: secrets[0]['secret_arn'])
+
+    role = paws.iam.Role(f'{config.resource_prefix}-rds-proxy',
+        name_prefix=f'{config.resource_prefix}-rds-proxy',
+        assume_role_policy=common.get_datafile(CONST.FILE_RDS_PROXY_ROLE_POLICY),
+        tags=config.tags
+    )
+    paws.iam.RolePolicy(f'{config.resource_prefix}-rds-proxy-secret',
+        role=role.id,
+        policy=secret_arn.apply(lambda arn: json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [
+                {'Effect': 'Allow', 'Action': 'secretsmanager:GetSecretValue', 'Resource': arn},
+                {'Effect': 'Allow', 'Action': 'kms:Decrypt', 'Resource': '*',
+                 'Condition': {'StringEquals': {'kms:ViaService': f'secretsmanager.{arn.split(":")[3]}.amazonaws.com'}}},
+            ]
+        }))
+    )
+
+    proxy = paws.rds.Proxy(config.resource_prefix,
+        name=config.resource_prefix,
+        engine_family=CONST.RDS_PROXY_ENGINE_FAMILIES[config.rds.engine],
+        auths=[paws.rds.ProxyAuthArgs(
+            auth_scheme='SECRETS',
+            iam_auth='REQUIRED' if settings.iam_auth else 'DISABLED',
+            secret_arn=secret_arn
+        )],
+        role_arn=role.arn,
+        vpc_subnet_ids=vpc_data['private_subnets'],
+        vpc_security_group_ids=[security_group.id],
+        require_tls=settings.require_tls,
+        idle_client_timeout=settings.idle_client_timeout,
+        tags=config.tags
+    )
+    target_group = paws.rds.ProxyDefaultTargetGroup(config.resource_prefix,
+        db_proxy_name=proxy.name,
+        connection_pool_config=paws.rds.ProxyDefaultTargetGroupConnectionPoolConfigArgs(
+            max_connections_percent=settings.max_connections_percent,
+            max_idle_connections_percent=settings.max_idle_connections_percent,
+            connection_borrow_timeout=settings.connection_borrow_timeout
+        )
+    )
+    paws.rds.ProxyTarget(config.resource_prefix,
+        db_proxy_name=proxy.name,
+        target_group_name=target_group.name,
+        db_instance_identifier=db_instance.identifier
+    )
+
+    return proxy
+
+def _define_private_dns(config: AWSPulumiConfig, vpc_data: dict, writer: pulumi.Output, replicas: list) -> paws.route53.Zone:
+    ## {subdomain}.{resource_prefix}.{tld} for the writer (the proxy when there is one), and with replicas
+    ## {subdomain}-ro.{resource_prefix}.{tld} spread evenly over them
+    zone = paws.route53.Zone(f'{config.resource_prefix}-rds',
+        name=f'{config.resource_prefix}.{config.rds.tld}',
+        vpcs=[paws.route53.ZoneVpcArgs(vpc_id=vpc_data['vpc_id'])],
+        tags=config.tags
+    )
+    writer_record = paws.route53.Record(f'{config.resource_prefix}-rds-writer',
+        zone_id=zone.zone_id,
+        name=config.rds.fqdn_internal,
+        type='CNAME',
+        ttl=60,
+        records=[writer]
+    )
+    for i, replica in enumerate(replicas):
+        paws.route53.Record(f'{config.resource_prefix}-rds-reader-{i}',
+            zone_id=zone.zone_id,
+            name=f'{config.rds.subdomain}-ro.{config.resource_prefix}.{config.rds.tld}',
+            type='CNAME',
+            ttl=30,
+            records=[replica.address],
+            set_identifier=f'replica-{i}',
+            weighted_routing_policies=[paws.route53.RecordWeightedRoutingPolicyArgs(weight=1)]
+        )
+
+    pulumi.export('rds_fqdn', writer_record.fqdn)
+    if replicas:
+        pulumi.export('rds_reader_fqdn', f'{config.rds.subdomain}-ro.{config.resource_prefix}.{config.rds.tld}')
+
+    return zone
\ No newline at end of file
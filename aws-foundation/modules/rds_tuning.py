@@ -0,0 +1,134 @@
+import pulumi
+import pulumi_aws as paws
+from config import AWSPulumiConfig
+import modules.common as common
+
+## Parameter group values sized for the instance class and storage, instead of the family defaults.
+## Sized for the smallest of the classes sharing the group (read replicas use the writer's group), with
+## rds.parameters on top. The numbers follow the usual MySQL and PostgreSQL sizing rules (buffer pool /
+## shared_buffers share of memory, RDS' own max_connections formulas, I/O capacity from the volume's IOPS).
+
+MIB = 1024 ** 2
+GIB = 1024 ** 3
+
+## Tuned parameters that only change on a reboot, by engine. RDS refuses to apply them immediately.
+STATIC_PARAMETERS = {
+    'mysql': ('innodb_log_file_size',),
+    'mariadb': ('innodb_log_file_size',),
+    'postgres': ('shared_buffers', 'max_connections', 'max_worker_processes'),
+}
+
+def _version(engine_version: str) -> tuple:
+    return tuple(int(p) for p in engine_version.split('.') if p.isdigit())
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(value, high))
+
+def instance_resources(instance_classes: list) -> tuple:
+    ## (memory in MiB, vCPUs) of the smallest class, RDS classes are EC2 types with a db. prefix
+    infos = [common.cached_invoke(paws.ec2.get_instance_type, instance_type=c.removeprefix('db.')) for c in instance_classes]
+    return min(i.memory_size for i in infos), min(i.default_vcpus for i in infos)
+
+def storage_iops(storage_type: str, storage: int) -> int:
+    ## Baseline IOPS of the volume, None when there isn't one to size for (io1/io2 have whatever is provisioned)
+    if storage_type == 'gp3':
+        return 3000 if storage < 400 else 12000
+    if storage_type == 'gp2':
+        return _clamp(3 * storage, 100, 16000)
+    return None
+
+def mysql_parameters(engine: str, engine_version: str, profile: str, memory_mib: int, vcpus: int, iops: int) -> dict:
+    analytics = profile == 'analytics'
+    memory = memory_mib * MIB
+    ## In 128 MiB chunks, leaving room for connections, and temp tables with analytics
+    buffer_pool = int(memory * (0.6 if analytics else 0.7)) // (128 * MIB) * (128 * MIB)
+    ## RDS' default is DBInstanceClassMemory/12582880
+    connections = min(memory // 12582880, 16000)
+    redo = _clamp(buffer_pool // 4, 512 * MIB, 16 * GIB)
+
+    parameters = {
+        'innodb_buffer_pool_size': buffer_pool,
+        'max_connections': max(50, connections // 4) if analytics else connections,
+    }
+    if iops:
+        ## Background flushing gets half the volume's IOPS, and all of it when behind
+        parameters['innodb_io_capacity'] = max(200, iops // 2)
+        parameters['innodb_io_capacity_max'] = max(2000, iops)
+    if engine == 'mysql' and _version(engine_version) >= (8, 0, 30):
+        parameters['innodb_redo_log_capacity'] = redo
+    else:
+        ## Two log files on mysql before 8.0.30, one on mariadb
+        parameters['innodb_log_file_size'] = redo if engine == 'mariadb' else redo // 2
+    if analytics:
+        parameters['tmp_table_size'] = parameters['max_heap_table_size'] = _clamp(memory // 64, 16 * MIB, GIB)
+
+    return parameters
+
+def postgres_parameters(profile: str, memory_mib: int, vcpus: int, iops: int) -> dict:
+    analytics = profile == 'analytics'
+    memory = memory_mib * MIB
+    shared_buffers = memory // 4
+    ## RDS' default is DBInstanceClassMemory/9531392
+    connections = min(memory // 9531392, 5000)
+    if analytics:
+        connections = max(20, connections // 4)
+    per_gather = max(1, vcpus // 2) if analytics else _clamp(vcpus // 2, 1, 4)
+
+    ## shared_buffers and effective_cache_size are in 8 kB pages, work_mem and maintenance_work_mem in kB,
+    ## the WAL sizes in MB
+    parameters = {
+        'shared_buffers': shared_buffers // 8192,
+        'effective_cache_size': memory * 3 // 4 // 8192,
+        'max_connections': connections,
+        ## A query can use work_mem for each sort and hash, in each parallel worker
+        'work_mem': max(4096, (memory - shared_buffers) // (connections * 3 * per_gather) // 1024),
+        'maintenance_work_mem': min(memory // (8 if analytics else 16), 2 * GIB) // 1024,
+        'max_worker_processes': max(8, vcpus),
+        'max_parallel_workers': vcpus,
+        'max_parallel_workers_per_gather': per_gather,
+        'max_parallel_maintenance_workers': _clamp(vcpus // 2, 1, 4),
+        'min_wal_size': 4096 if analytics else 2048,
+        'max_wal_size': 16384 if analytics else 8192,
+    }
+    if iops:
+        ## SSD volumes: random reads cost about what sequential ones do
+        parameters['random_page_cost'] = 1.1
+        parameters['effective_io_concurrency'] = 200
+
+    return parameters
+
+def apply_method(engine: str, name: str) -> str:
+    return 'pending-reboot' if name in STATIC_PARAMETERS[engine] else None
+
+def tuned_parameters(config: AWSPulumiConfig, instance_classes: list) -> dict:
+    ## {name: value} of the tuned parameters rds.parameters doesn't set, exported as rds_tuning for review
+    settings = config.rds.tuning
+    memory_mib, vcpus = instance_resources(instance_classes)
+    iops = storage_iops(config.rds.storage_type, config.rds.storage)
+
+    if config.rds.engine == 'postgres':
+        computed = postgres_parameters(settings.profile, memory_mib, vcpus, iops)
+    else:
+        computed = mysql_parameters(config.rds.engine, config.rds.engine_version, settings.profile, memory_mib, vcpus, iops)
+
+    overrides = config.rds.parameters or {}
+    parameters = {k: str(v) for k, v in computed.items() if k not in overrides}
+
+    pulumi.export('rds_tuning', {
+        'profile': settings.profile,
+        'instance_classes': instance_classes,
+        'memory_mib': memory_mib,
+        'vcpus': vcpus,
+        'iops': iops,
+        'parameters': parameters,
+        'overridden': sorted(k for k in computed if k in overrides),
+    })
+    return parameters
+
+def parameter_args(config: AWSPulumiConfig, instance_classes: list, args_type: type) -> list:
+    ## Parameter group parameters: the tuned ones (with rds.tuning), then rds.parameters
+    tuned = tuned_parameters(config, instance_classes) if config.rds.tuning.enabled else {}
+    parameters = [args_type(name=k, value=v, apply_method=apply_method(config.rds.engine, k)) for k, v in tuned.items()]
+    for k, v in (config.rds.parameters or {}).items():
+        parameters.append(args_type(name=k, value=v))
+    return parameters
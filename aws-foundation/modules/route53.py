@@ -1,9 +1,10 @@
 import pulumi
 import pulumi_aws as paws
+import modules.common as common
 from config import AWSPulumiConfig
 
 def define_dns(config: AWSPulumiConfig, lb_dns: str) -> paws.route53.Record:
-    zone = paws.route53.get_zone(name=config.hosted_zone)
+    zone = common.cached_invoke(paws.route53.get_zone, name=config.hosted_zone)
 
     record = paws.route53.Record(
         f'{config.resource_prefix}-record',
@@ -0,0 +1,70 @@
+import ipaddress
+
+## Carves subnets out of the VPC CIDR block(s) on demand. Subnets are handed out in order, each one at
+## the next free address aligned to its size, so the same requests always give the same CIDRs. Tiers
+## sharing a block are allocated one after the other: only the last one (public in vpc.cidr, pod in
+## vpc.secondary_cidrs) can grow without moving the others. Adding a private subnet shifts every public
+## CIDR after it, and those subnets get replaced. Nothing is materialized up front, a /8 costs the same
+## as a /24.
+
+class SubnetAllocator(object):
+
+    def __init__(self, cidrs: list):
+        self.pools = [ipaddress.ip_network(c) for c in cidrs]
+        self.__next = [int(p.network_address) for p in self.pools]
+
+    def allocate(self, prefixlen: int) -> str:
+        ## The next free subnet of the given size, from the first pool it fits in
+        for i, pool in enumerate(self.pools):
+            if prefixlen < pool.prefixlen or prefixlen > pool.max_prefixlen:
+                continue
+
+            size = 1 << (pool.max_prefixlen - prefixlen)
+            start = -(-self.__next[i] // size) * size
+            if start + size > int(pool.broadcast_address) + 1:
+                continue
+
+            self.__next[i] = start + size
+            return str(ipaddress.ip_network((start, prefixlen)))
+
+        raise ValueError(f'No room left for a /{prefixlen} subnet in {", ".join(str(p) for p in self.pools) or "(no CIDR blocks)"}')
+
+    def free(self) -> int:
+        ## Addresses left, over all pools
+        return sum(int(p.broadcast_address) + 1 - n for p, n in zip(self.pools, self.__next))
+
+def ipv6_subnet(cidr: str, index: int, prefixlen: int = 64) -> str:
+    ## The index-th /64 of a VPC's IPv6 block (a /56 from Amazon, so 256 of them)
+    net = ipaddress.ip_network(cidr)
+    size = 1 << (net.max_prefixlen - prefixlen)
+    if (index + 1) * size > net.num_addresses:
+        raise ValueError(f'{cidr} has no /{prefixlen} subnet number {index}')
+    return str(ipaddress.ip_network((int(net.network_address) + index * size, prefixlen)))
+
+def tier_sizes(vpc) -> dict:
+    ## {tier: (count, prefixlen)} of a vpc config, sizes default to vpc.subnet_size
+    return {
+        'private': (vpc.num_private_subnets or 0, vpc.private_subnet_size or vpc.subnet_size),
+        'public': (vpc.num_public_subnets or 0, vpc.public_subnet_size or vpc.subnet_size),
+        'pod': (vpc.num_pod_subnets or 0, vpc.pod_subnet_size or vpc.subnet_size),
+    }
+
+def plan_cidrs(vpc) -> dict:
+    ## {tier: [cidr]} of a vpc config. Private then public subnets come out of vpc.cidr (with equal sizes
+    ## that's the same CIDRs as slicing it in order), pod subnets out of vpc.secondary_cidrs.
+    sizes = tier_sizes(vpc)
+    primary = SubnetAllocator([vpc.cidr])
+    secondary = SubnetAllocator(vpc.secondary_cidrs or [])
+    return {
+        tier: [(secondary if tier == 'pod' else primary).allocate(prefixlen) for _ in range(count)]
+        for tier, (count, prefixlen) in sizes.items()
+    }
+
+def format_table(plan: list) -> str:
+    ## The allocation table, for reviewing a plan: one row per subnet
+    rows = [('tier', 'name', 'cidr', 'addresses', 'az')]
+    for s in plan:
+        rows.append((s['tier'], s['name'], s['cidr'], str(ipaddress.ip_network(s['cidr']).num_addresses), str(s['az'])))
+
+    widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(v.ljust(w) for v, w in zip(r, widths)).rstrip() for r in rows)
@@ -1,150 +1,357 @@
 import pulumi
 import pulumi_aws as paws
-import ipaddress
+import modules.common as common
+import modules.subnets as subnets
 from config import AWSPulumiConfig
 
-azs = paws.get_availability_zones(state='available')
+def get_availability_zones(cache_ttl: int = None) -> dict:
+    ## Memoized per region for the life of the process, and persisted on disk for cache_ttl seconds
+    result = common.cached_invoke(paws.get_availability_zones, ttl=cache_ttl, state='available')
+    return {
+        'names': list(result.names),
+        'zone_ids': list(result.zone_ids)
+    }
 
-def __slice_vpc_into_subnets(vpc_cidr: str, subnet_bits: int) -> list:
-    vpc_net = ipaddress.ip_network(vpc_cidr)
+def _subnet_az(config: AWSPulumiConfig, azs: dict, index: int) -> dict:
+    ## AZ ids (use1-az1) are the same physical zone in every account, AZ names (us-east-1a) are not.
+    ## Subnets past the last AZ wrap around, round-robin.
+    index = index % len(azs['names'])
+    if config.vpc.az_placement == 'id':
+        return {'availability_zone_id': azs['zone_ids'][index]}
+    return {'availability_zone': azs['names'][index]}
 
-    if (vpc_net.prefixlen >= subnet_bits):
-        print(f'Subnet size ({subnet_bits}) must be greater than the VPC network ({vpc_net.prefixlen})')
-        return False
+def _az_key(config: AWSPulumiConfig, azs: dict, index: int) -> str:
+    return list(_subnet_az(config, azs, index).values())[0]
 
-    subs = [str(s) for s in vpc_net.subnets(new_prefix=subnet_bits)]
-    
-    return subs
+def _public_az_index(config: AWSPulumiConfig, azs: dict, index: int) -> int:
+    ## index is the position among the public subnets. With per-AZ NAT gateways the public subnets go in
+    ## the AZs of the private subnets, so every private subnet can have a NAT in its own AZ.
+    if config.vpc.nat_mode == 'per_az':
+        return index % len(azs['names'])
 
-def _define_public_subnets(config: AWSPulumiConfig, vpc_id: str, az_subnets: list) -> list:
-    public_subs = []
-    num_private_subnets = config.vpc['num_private_subnets']
-    num_public_subnets = config.vpc['num_public_subnets']
+    i = config.vpc.num_private_subnets + index
+    return i if i < len(azs['names']) else index
+
+def plan_subnets(config: AWSPulumiConfig, azs: dict) -> list:
+    ## The allocation table of the VPC: [{'tier', 'name', 'cidr', 'az_index', 'az'}], in the order the
+    ## subnets are allocated. Private and pod subnets go round-robin over the AZs.
+    cidrs = subnets.plan_cidrs(config.vpc)
+    num_private = len(cidrs['private'])
+    plan = []
+    for i, cidr in enumerate(cidrs['private']):
+        plan.append({'tier': 'private', 'name': f'{config.resource_prefix}-privnet-{i}', 'cidr': cidr, 'az_index': i})
+    for i, cidr in enumerate(cidrs['public']):
+        plan.append({'tier': 'public', 'name': f'{config.resource_prefix}-pubnet-{num_private+i}', 'cidr': cidr,
+                     'az_index': _public_az_index(config, azs, i)})
+    for i, cidr in enumerate(cidrs['pod']):
+        plan.append({'tier': 'pod', 'name': f'{config.resource_prefix}-podnet-{i}', 'cidr': cidr, 'az_index': i})
 
+    for s in plan:
+        s['az_index'] = s['az_index'] % len(azs['names'])
+        s['az'] = _az_key(config, azs, s['az_index'])
+    return plan
+
+def _ipv6_subnet_args(ipv6_cidr: pulumi.Output, index: int, dns: bool = False) -> dict:
+    ## Dual-stack subnet settings: the index-th /64 of the VPC's IPv6 block
+    if ipv6_cidr is None:
+        return {}
+
+    args = {
+        'ipv6_cidr_block': ipv6_cidr.apply(lambda cidr: subnets.ipv6_subnet(cidr, index)),
+        'assign_ipv6_address_on_creation': True
+    }
+    if dns:
+        args['enable_resource_name_dns_aaaa_record_on_launch'] = True
+    return args
+
+def _define_public_subnets(config: AWSPulumiConfig, vpc_id: str, plan: list, azs: dict, ipv6_cidr: pulumi.Output = None) -> list:
+    public_subs = []
     _add_tags = {
         'Name' : f'{config.resource_prefix}-pub',
         f'kubernetes.io/cluster/{config.resource_prefix}': 'shared',
         'kubernetes.io/role/elb': '1'
     }
     _tags = config.tags | _add_tags
-    for i in range(num_private_subnets, num_private_subnets+num_public_subnets):
-        try:
-            az = azs.names[i]
-        except IndexError:
-            az = azs.names[i-num_private_subnets]
+    for index, s in enumerate(plan):
+        if s['tier'] != 'public':
+            continue
 
-        sub = paws.ec2.Subnet(f'{config.resource_prefix}-pubnet-{i}',
+        sub = paws.ec2.Subnet(s['name'],
             vpc_id=vpc_id,
-            availability_zone=az,
-            cidr_block=az_subnets[i],
+            cidr_block=s['cidr'],
             map_public_ip_on_launch=True,
-            tags=_tags)
+            tags=_tags,
+            **_ipv6_subnet_args(ipv6_cidr, index),
+            **_subnet_az(config, azs, s['az_index']))
 
         public_subs.append(sub)
     return public_subs
 
-def _define_private_subnets(config: AWSPulumiConfig, vpc_id: str, az_subnets: list) -> list:
+def _define_private_subnets(config: AWSPulumiConfig, vpc_id: str, plan: list, azs: dict, tier: str = 'private', opts: pulumi.ResourceOptions = None, ipv6_cidr: pulumi.Output = None) -> list:
     private_subs = []
     _add_tags = {
-        'Name' : f'{config.resource_prefix}-priv',
+        'Name' : f'{config.resource_prefix}-{"priv" if tier == "private" else tier}',
         f'kubernetes.io/cluster/{config.resource_prefix}': "shared",
-        'kubernetes.io/role/internal-elb': '1'
     }
+    if tier == 'private':
+        _add_tags['kubernetes.io/role/internal-elb'] = '1'
     _tags = config.tags | _add_tags
-    for i in range(config.vpc['num_private_subnets']):    
-        sub = paws.ec2.Subnet(f'{config.resource_prefix}-privnet-{i}',
+    for index, s in enumerate(plan):
+        if s['tier'] != tier:
+            continue
+
+        sub = paws.ec2.Subnet(s['name'],
             vpc_id=vpc_id,
-            availability_zone=azs.names[i],
-            cidr_block=az_subnets[i],
+            cidr_block=s['cidr'],
             enable_resource_name_dns_a_record_on_launch=True,
             private_dns_hostname_type_on_launch='ip-name',
-            tags=_tags)
+            tags=_tags,
+            opts=opts,
+            **_ipv6_subnet_args(ipv6_cidr, index, dns=True),
+            **_subnet_az(config, azs, s['az_index']))
         private_subs.append(sub)
     return private_subs
 
+def _private_routes(ngw: paws.ec2.NatGateway, eigw: paws.ec2.EgressOnlyInternetGateway = None) -> list:
+    ## IPv4 egress through the NAT, IPv6 egress (dual-stack) through the egress-only internet gateway
+    routes = [
+        paws.ec2.RouteTableRouteArgs(
+            cidr_block='0.0.0.0/0',
+            nat_gateway_id=ngw.id
+        )
+    ]
+    if eigw:
+        routes.append(paws.ec2.RouteTableRouteArgs(
+            ipv6_cidr_block='::/0',
+            egress_only_gateway_id=eigw.id
+        ))
+    return routes
+
+def _define_single_nat(config: AWSPulumiConfig, vpc_id: str, gw: paws.ec2.InternetGateway, public_subs: list, private_subs: list, eigw: paws.ec2.EgressOnlyInternetGateway = None) -> list:
+    ## One NAT gateway, in the first public subnet, and one private route table for all private subnets.
+    ## Returns the route table of every private subnet.
+    eip = paws.ec2.Eip(f'{config.resource_prefix}-eip',
+        domain='vpc',
+        opts=pulumi.ResourceOptions(depends_on=[gw]))
+
+    ngw = paws.ec2.NatGateway(f'{config.resource_prefix}-nat',
+        allocation_id=eip.id,
+        subnet_id=public_subs[0].id)
+
+    prv_rt = paws.ec2.RouteTable(f'{config.resource_prefix}-priv',
+        vpc_id=vpc_id,
+        routes=_private_routes(ngw, eigw))
+
+    return [prv_rt for _ in private_subs]
+
+def _define_per_az_nat(config: AWSPulumiConfig, vpc_id: str, gw: paws.ec2.InternetGateway, public_subs: list, private_subs: list, azs: dict, eigw: paws.ec2.EgressOnlyInternetGateway = None) -> list:
+    ## A NAT gateway (and EIP) in every AZ that has a public subnet, and a private route table per AZ
+    ## routing to the NAT in the same AZ. Private subnets in an AZ without a public subnet use the first NAT.
+    ## Returns the route table of every private subnet.
+    nat_gateways = {}
+    for index, pub_sub in enumerate(public_subs):
+        az = _az_key(config, azs, _public_az_index(config, azs, index))
+        if az in nat_gateways:
+            continue
+
+        eip = paws.ec2.Eip(f'{config.resource_prefix}-eip-{az}',
+            domain='vpc',
+            tags=config.tags | {'Name': f'{config.resource_prefix}-nat-{az}'},
+            opts=pulumi.ResourceOptions(depends_on=[gw]))
+
+        nat_gateways[az] = paws.ec2.NatGateway(f'{config.resource_prefix}-nat-{az}',
+            allocation_id=eip.id,
+            subnet_id=pub_sub.id,
+            tags=config.tags | {'Name': f'{config.resource_prefix}-nat-{az}'})
+
+    route_tables = {}
+    private_rts = []
+    for index, _ in enumerate(private_subs):
+        az = _az_key(config, azs, index)
+        if az not in route_tables:
+            ngw = nat_gateways.get(az) or next(iter(nat_gateways.values()))
+            route_tables[az] = paws.ec2.RouteTable(f'{config.resource_prefix}-priv-{az}',
+                vpc_id=vpc_id,
+                routes=_private_routes(ngw, eigw),
+                tags=config.tags | {'Name': f'{config.resource_prefix}-priv-{az}'})
+        private_rts.append(route_tables[az])
+
+    return private_rts
+
+def _aws_region() -> str:
+    result = common.cached_invoke(paws.get_region)
+    return getattr(result, 'region', None) or result.name
+
+def _define_endpoints(config: AWSPulumiConfig, vpc_id: str, private_subs: list, private_rts: list, azs: dict) -> dict:
+    ## VPC endpoints keep traffic to AWS services (image pulls, STS for IRSA, logs, SSM) off the NAT.
+    ## Returns {'endpoints': {service: id}, 'security_group': id or None}
+    settings = config.vpc.endpoints
+    if not settings.gateway and not settings.interface:
+        return {'endpoints': {}, 'security_group': None}
+
+    region = _aws_region()
+    endpoints = {}
+
+    route_table_ids = [rt.id for rt in dict.fromkeys(private_rts)]
+    for service in settings.gateway:
+        endpoints[service] = paws.ec2.VpcEndpoint(f'{config.resource_prefix}-vpce-{service}',
+            vpc_id=vpc_id,
+            service_name=f'com.amazonaws.{region}.{service}',
+            vpc_endpoint_type='Gateway',
+            route_table_ids=route_table_ids,
+            tags=config.tags | {'Name': f'{config.resource_prefix}-{service}'})
+
+    security_group = None
+    if settings.interface:
+        security_group = common.create_security_group(
+            resource_prefix=config.resource_prefix,
+            vpc_id=vpc_id,
+            ingress_data=[{'protocol': 'tcp', 'from_port': 443, 'to_port': 443, 'cidr_ip': cidr} for cidr in [config.vpc.cidr] + config.vpc.secondary_cidrs],
+            identifier='endpoints'
+        )
+
+        ## An interface endpoint takes at most one subnet per AZ
+        subnet_ids = {}
+        for index, sub in enumerate(private_subs):
+            subnet_ids.setdefault(_az_key(config, azs, index), sub.id)
+
+        for service in settings.interface:
+            endpoints[service] = paws.ec2.VpcEndpoint(f'{config.resource_prefix}-vpce-{service.replace(".", "-")}',
+                vpc_id=vpc_id,
+                service_name=f'com.amazonaws.{region}.{service}',
+                vpc_endpoint_type='Interface',
+                subnet_ids=list(subnet_ids.values()),
+                security_group_ids=[security_group.id],
+                private_dns_enabled=settings.private_dns,
+                tags=config.tags | {'Name': f'{config.resource_prefix}-{service}'})
+
+    return {
+        'endpoints': {service: e.id for service, e in endpoints.items()},
+        'security_group': security_group.id if security_group else None
+    }
+
 ## Define the VPC
 def define_vpc(config: AWSPulumiConfig) -> dict:
     _name = f'{config.resource_prefix}-vpc'
     vpc = paws.ec2.Vpc(_name,
-        cidr_block=config.vpc['cidr'],
+        cidr_block=config.vpc.cidr,
+        assign_generated_ipv6_cidr_block=config.vpc.ipv6 or None,
         tags=config.tags | {'Name': _name},
         enable_dns_hostnames=True)
+    ipv6_cidr = vpc.ipv6_cidr_block if config.vpc.ipv6 else None
+
+    azs = get_availability_zones(config.vpc.az_cache_ttl)
+    plan = plan_subnets(config, azs)
+    pulumi.log.debug(f'Subnet plan:\n{subnets.format_table(plan)}')
 
-    subnets = __slice_vpc_into_subnets(config.vpc['cidr'], config.vpc['subnet_size'])
+    private_subs = _define_private_subnets(config, vpc.id, plan, azs, ipv6_cidr=ipv6_cidr)
+    public_subs = _define_public_subnets(config, vpc.id, plan, azs, ipv6_cidr=ipv6_cidr)
 
-    if not subnets:
-        raise ValueError(f'Unable to determine subnets from VPC: {config.vpc["cidr"]} and the specified subnet size of {config.vpc["subnet_size"]}')
-    
-    private_subs = _define_private_subnets(config, vpc.id, subnets)
-    public_subs = _define_public_subnets(config, vpc.id, subnets)
+    ## Secondary CIDR blocks, and the pod subnets carved out of them
+    cidr_blocks = [
+        paws.ec2.VpcIpv4CidrBlockAssociation(f'{config.resource_prefix}-cidr-{index}',
+            vpc_id=vpc.id,
+            cidr_block=cidr)
+        for index, cidr in enumerate(config.vpc.secondary_cidrs)
+    ]
+    pod_subs = _define_private_subnets(config, vpc.id, plan, azs, tier='pod',
+        opts=pulumi.ResourceOptions(depends_on=cidr_blocks), ipv6_cidr=ipv6_cidr)
 
     ## Define an internet gateway
     gw = paws.ec2.InternetGateway(f'{config.resource_prefix}-igw',
         vpc_id=vpc.id)
 
-    ## Define an EIP for the public subnet(s)
-    eip = paws.ec2.Eip(f'{config.resource_prefix}-eip',
-        domain='vpc',
-        opts=pulumi.ResourceOptions(depends_on=[gw]))
+    ## Dual-stack: outbound only IPv6 for the private subnets, no NAT needed
+    eigw = None
+    if config.vpc.ipv6:
+        eigw = paws.ec2.EgressOnlyInternetGateway(f'{config.resource_prefix}-eigw',
+            vpc_id=vpc.id,
+            tags=config.tags | {'Name': f'{config.resource_prefix}-eigw'})
 
-    ## Define a NAT Gateway
-    ngw = paws.ec2.NatGateway(f'{config.resource_prefix}-nat',
-        allocation_id=eip.id,
-        subnet_id=public_subs[0].id)
-
-    ## Define the PRIVATE route table
-    _tags = config.tags | {'Name': f'{config.resource_prefix}-priv'}
-    prv_rt = paws.ec2.RouteTable(f'{config.resource_prefix}-priv',
-        vpc_id=vpc.id,
-        routes=[
-            paws.ec2.RouteTableRouteArgs(
-                cidr_block='0.0.0.0/0',
-                nat_gateway_id=ngw.id
-            )
-        ])
+    ## NAT gateway(s) and the PRIVATE route table(s) routing to them
+    if config.vpc.nat_mode == 'per_az':
+        private_rts = _define_per_az_nat(config, vpc.id, gw, public_subs, private_subs, azs, eigw)
+    else:
+        private_rts = _define_single_nat(config, vpc.id, gw, public_subs, private_subs, eigw)
 
     ## Define PUBLIC route table
     _tags = config.tags | {'Name': f'{config.resource_prefix}-pub'}
+    pub_routes = [
+        paws.ec2.RouteTableRouteArgs(
+            cidr_block='0.0.0.0/0',
+            gateway_id=gw.id
+        )
+    ]
+    if config.vpc.ipv6:
+        pub_routes.append(paws.ec2.RouteTableRouteArgs(
+            ipv6_cidr_block='::/0',
+            gateway_id=gw.id
+        ))
     pub_rt = paws.ec2.RouteTable(f'{config.resource_prefix}-pub',
         vpc_id=vpc.id,
-        routes=[
-            paws.ec2.RouteTableRouteArgs(
-                cidr_block='0.0.0.0/0',
-                gateway_id=gw.id
-            )
-        ])
+        routes=pub_routes)
 
     ## Private RT association(s)
     for index, priv_sub in enumerate(private_subs):
         priv_rta = paws.ec2.RouteTableAssociation(f'{config.resource_prefix}-rta-{index}',
-            subnet_id=priv_sub,
-            route_table_id=prv_rt.id)
+            subnet_id=priv_sub.id,
+            route_table_id=private_rts[index].id)
+
+    ## Pod subnets route like the private subnets in their AZ
+    private_rt_by_az = {}
+    for index, rt in enumerate(private_rts):
+        private_rt_by_az.setdefault(_az_key(config, azs, index), rt)
+    pod_plan = [s for s in plan if s['tier'] == 'pod']
+    for index, pod_sub in enumerate(pod_subs):
+        rt = private_rt_by_az.get(pod_plan[index]['az']) or private_rts[0]
+        paws.ec2.RouteTableAssociation(f'{config.resource_prefix}-rta-pod-{index}',
+            subnet_id=pod_sub.id,
+            route_table_id=rt.id)
 
     ## Public RT association(s)
     index_start = len(private_subs)
     for index, pub_sub in enumerate(public_subs):
         pub_rta = paws.ec2.RouteTableAssociation(f'{config.resource_prefix}-rta-{index+index_start}',
-            subnet_id=pub_sub,
+            subnet_id=pub_sub.id,
             route_table_id=pub_rt.id)
 
+    endpoints = _define_endpoints(config, vpc.id, private_subs, private_rts, azs)
+
     vpc_data = {
         'vpc_id': vpc.id,
-        'vpc_cidr': config.vpc['cidr'],
+        'vpc_cidr': config.vpc.cidr,
+        'vpc_ipv6_cidr': ipv6_cidr,
         'public_subnets': [s.id for s in public_subs],
-        'private_subnets': [s.id for s in private_subs]
+        'private_subnets': [s.id for s in private_subs],
+        'pod_subnets': [s.id for s in pod_subs],
+        'secondary_cidrs': config.vpc.secondary_cidrs,
+        'availability_zones': azs['names'],
+        'availability_zone_ids': azs['zone_ids'],
+        'vpc_endpoints': endpoints['endpoints'],
+        'endpoint_security_group': endpoints['security_group']
     }
     pulumi.export('vpc_data', vpc_data)
+    pulumi.export('subnet_plan', [{k: s[k] for k in ('tier', 'name', 'cidr', 'az')} for s in plan])
 
     return {
         'vpc_id': vpc.id,
-        'vpc_cidr': config.vpc['cidr'],
+        'vpc_cidr': config.vpc.cidr,
+        'vpc_ipv6_cidr': ipv6_cidr,
         'public_subnets': [s.id for s in public_subs],
-        'private_subnets': [s.id for s in private_subs]
+        'private_subnets': [s.id for s in private_subs],
+        'pod_subnets': [s.id for s in pod_subs],
+        'secondary_cidrs': config.vpc.secondary_cidrs,
+        'private_route_tables': [rt.id for rt in dict.fromkeys(private_rts)],
+        'availability_zones': azs['names'],
+        'availability_zone_ids': azs['zone_ids'],
+        'vpc_endpoints': endpoints['endpoints'],
+        'endpoint_security_group': endpoints['security_group'],
+        'subnet_plan': plan
     }
 
     # return {
     #     'vpc_id': vpc.id,
-    #     'vpc_cidr': config.vpc['cidr'],
+    #     'vpc_cidr': config.vpc.cidr,
     #     'public_subnets': public_subs,
     #     'private_subnets': private_subs
     # }
@@ -1,9 +1,103 @@
 # Credit: https://github.com/joeduffy/aws-tags-example/blob/master/autotag-py/taggable.py
+import importlib.metadata
+import importlib.util
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+from constants import Constants as CONST
+
+# The set of taggable type tokens is generated from the installed pulumi-aws SDK: every
+# resource module that declares a `tags_all` property participates in provider tagging.
+# The generated index is cached on disk, keyed by the provider version.
+_TAGS_MARKER = 'def tags_all(self)'
+_RESOURCE_MODULES = re.compile(r'resource_modules="""(.*?)"""', re.S)
+
+_taggable_types = None
+
 # isTaggable returns true if the given resource type is an AWS resource that supports tags.
+# Type tokens repeat for every resource of the same kind, so each is classified only once.
+@lru_cache(maxsize=None)
 def is_taggable(t: str) -> bool:
-    return t in taggable_resource_types
+    return t in get_taggable_types()
+
+def get_taggable_types() -> frozenset:
+    global _taggable_types
+    if _taggable_types is None:
+        _taggable_types = _load_taggable_types()
+    return _taggable_types
+
+def _provider_version() -> str:
+    try:
+        return importlib.metadata.version('pulumi_aws')
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def _cache_file(version: str) -> str:
+    return os.path.join(CONST.PATH_CACHE, f'taggable-aws-{version}.json')
+
+def _load_taggable_types() -> frozenset:
+    version = _provider_version()
+    if not version:
+        return frozenset(sys.intern(t) for t in taggable_resource_types)
+
+    cache_file = _cache_file(version)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as f:
+                return frozenset(sys.intern(t) for t in json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    types = scan_provider_schema()
+    if not types:
+        return frozenset(sys.intern(t) for t in taggable_resource_types)
+
+    try:
+        os.makedirs(CONST.PATH_CACHE, exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(sorted(types), f, indent=1)
+    except OSError:
+        pass
+
+    return types
+
+def scan_provider_schema() -> frozenset:
+    spec = importlib.util.find_spec('pulumi_aws')
+    if spec is None or spec.origin is None:
+        return frozenset()
+
+    with open(spec.origin, 'r') as f:
+        match = _RESOURCE_MODULES.search(f.read())
+    if not match:
+        return frozenset()
+
+    root = os.path.dirname(spec.origin)
+    files = {}
+    types = set()
+    for mod in json.loads(match.group(1)):
+        pkg_dir = os.path.join(root, *mod['fqn'].split('.')[1:])
+        if pkg_dir not in files:
+            ## Module file names are the snake_cased resource names, e.g. graphQLApi -> graph_ql_api.py
+            files[pkg_dir] = {
+                f[:-3].replace('_', ''): os.path.join(pkg_dir, f)
+                for f in os.listdir(pkg_dir) if f.endswith('.py')
+            } if os.path.isdir(pkg_dir) else {}
+
+        mod_file = files[pkg_dir].get(mod['mod'].split('/')[-1].lower())
+        if not mod_file:
+            continue
+
+        with open(mod_file, 'r') as f:
+            if _TAGS_MARKER not in f.read():
+                continue
+        types.update(sys.intern(t) for t in mod['classes'])
+
+    return frozenset(types)
 
-# taggable_resource_types is a list of known AWS type tokens that are taggable.
+# taggable_resource_types is a static list of known AWS type tokens that are taggable. It is
+# only used when the pulumi-aws SDK can't be inspected.
 taggable_resource_types = [
     'aws:accessanalyzer/analyzer:Analyzer',
     'aws:acm/certificate:Certificate',
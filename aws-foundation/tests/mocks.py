@@ -1,4 +1,17 @@
+import concurrent.futures
+import json
+import os
+import re
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
 import pulumi
+import yaml
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
 class Ec2Mocks(pulumi.runtime.Mocks):
     def new_resource(self, args: pulumi.runtime.MockResourceArgs):
@@ -8,6 +21,8 @@ class Ec2Mocks(pulumi.runtime.Mocks):
                 **args.inputs,
                 "id": "vpc-12345678"
             }
+            if args.inputs.get("assignGeneratedIpv6CidrBlock"):
+                outputs["ipv6CidrBlock"] = "2600:1f18:abcd:ef00::/56"
         if args.typ == "aws:ec2/instance:Instance":
             outputs = {
                 **args.inputs,
@@ -23,11 +38,190 @@ class Ec2Mocks(pulumi.runtime.Mocks):
                 "architecture": "x86_64",
                 "id": "ami-0eb1f3cdeeb8eed2a",
             }
+        if args.token == "aws:index/getRegion:getRegion":
+            return {"name": "us-east-1", "region": "us-east-1"}
         if "getAvailabilityZones" in args.token:
             return {
                 "names": ["us-east-1a", "us-east-1b", "us-east-1c", "us-east-1d"],
-                "zone_ids": ["use1-az1", "use1-az2", "use1-az3", "use1-az4"],
+                "zoneIds": ["use1-az1", "use1-az2", "use1-az3", "use1-az4"],
                 "state": "available",
             }
         return {}
-    
\ No newline at end of file
+    
+## The marker pulumi uses for serialized resource references
+_RESOURCE_REF = {'4dabf18193072939515e22adb298388d': '5cf8f73096256a8f31e491e813e4eb8e'}
+
+FOUNDATION_VPC_DATA = {
+    'vpc_id': 'vpc-12345678',
+    'vpc_cidr': '192.168.0.0/16',
+    'public_subnets': ['subnet-pub00000', 'subnet-pub00001'],
+    'private_subnets': ['subnet-prv00000', 'subnet-prv00001'],
+    'availability_zones': ['us-east-1a', 'us-east-1b', 'us-east-1c', 'us-east-1d'],
+    'availability_zone_ids': ['use1-az1', 'use1-az2', 'use1-az3', 'use1-az4'],
+}
+
+class ProgramMocks(Ec2Mocks):
+    ## Mocks for running the whole program (__main__.py) for any stack. Counts resource registrations
+    ## and invokes, answers the stack reference to the foundation stack with vpc_data, and fills in the
+    ## outputs of the pulumi_eks components that the modules read.
+    def __init__(self, vpc_data: dict = None, azs: int = 4):
+        self.vpc_data = vpc_data or FOUNDATION_VPC_DATA
+        self.azs = azs
+        self.registrations = Counter()
+        self.invokes = Counter()
+
+    def _resource_ref(self, typ: str, name: str, state: dict) -> dict:
+        ## The referenced resource has to be known to the mock monitor, so it can be read back
+        from pulumi.runtime.mocks import MockMonitor
+        monitor = pulumi.runtime.settings.get_monitor()
+        urn = monitor.make_urn('', typ, name)
+        monitor.resources[urn] = MockMonitor.ResourceRegistration(urn, f'{name}_id', state)
+        return {**_RESOURCE_REF, 'urn': urn, 'id': f'{name}_id', 'packageVersion': ''}
+
+    def new_resource(self, args: pulumi.runtime.MockResourceArgs):
+        self.registrations[args.typ] += 1
+
+        if args.typ == 'pulumi:pulumi:StackReference':
+            return [args.name, {**args.inputs, 'outputs': {'vpc_data': self.vpc_data}}]
+        if args.typ == 'eks:index:Cluster':
+            ## eks_cluster is only used where the cluster name is expected (a resource serializes as its id)
+            return [args.name + '_id', {
+                'eksCluster': args.name,
+                'core': {
+                    'oidcProvider': self._resource_ref('aws:iam/openIdConnectProvider:OpenIdConnectProvider', f'{args.name}-oidc', {
+                        'url': f'oidc.eks.us-east-1.amazonaws.com/id/{args.name}',
+                        'arn': f'arn:aws:iam::123456789012:oidc-provider/oidc.eks.us-east-1.amazonaws.com/id/{args.name}'
+                    })
+                },
+                'kubeconfig': {'apiVersion': 'v1', 'kind': 'Config'},
+            }]
+        if args.typ == 'eks:index:ManagedNodeGroup':
+            return [args.name + '_id', {
+                'nodeGroup': self._resource_ref('aws:eks/nodeGroup:NodeGroup', f'{args.name}-ng', {'nodeGroupName': args.name})
+            }]
+        if args.typ == 'kubernetes:helm.sh/v3:Release':
+            return [args.name + '_id', {**args.inputs, 'status': {'status': 'deployed'}}]
+        if args.typ in ('aws:rds/instance:Instance', 'aws:rds/cluster:Cluster'):
+            address = f'{args.name}.abcdefghijkl.us-east-1.rds.amazonaws.com'
+            outputs = {**args.inputs, 'address': address, 'endpoint': f'{address}:{args.inputs.get("port")}'}
+            if args.inputs.get('manageMasterUserPassword'):
+                outputs['masterUserSecrets'] = [{'secretArn': f'arn:aws:secretsmanager:us-east-1:123456789012:secret:rds!{args.name}'}]
+            if args.typ == 'aws:rds/cluster:Cluster':
+                outputs['readerEndpoint'] = f'{args.name}.cluster-ro-abcdefghijkl.us-east-1.rds.amazonaws.com'
+            return [args.name + '_id', outputs]
+        if args.typ == 'aws:rds/proxy:Proxy':
+            return [args.name + '_id', {**args.inputs, 'endpoint': f'{args.name}.proxy-abcdefghijkl.us-east-1.rds.amazonaws.com'}]
+        if args.typ.startswith('aws:iam/'):
+            return [args.name + '_id', {**args.inputs, 'arn': f'arn:aws:iam::123456789012:{args.name}', 'name': args.inputs.get('name', args.name)}]
+
+        return super().new_resource(args)
+
+    def call(self, args: pulumi.runtime.MockCallArgs):
+        self.invokes[args.token] += 1
+
+        if args.token == 'aws:index/getAvailabilityZones:getAvailabilityZones':
+            return {
+                'names': [f'us-east-1{chr(97 + i)}' for i in range(self.azs)],
+                'zoneIds': [f'use1-az{i + 1}' for i in range(self.azs)],
+                'state': 'available',
+            }
+        if args.token == 'aws:ec2/getInstanceType:getInstanceType':
+            return {'instanceType': args.args.get('instanceType'), 'memorySize': 16384, 'defaultVcpus': 4,
+                    'maximumNetworkInterfaces': 4, 'maximumIpv4AddressesPerInterface': 15,
+                    'instanceStorageSupported': args.args.get('instanceType', '').split('.')[0].endswith('d'),
+                    'supportedArchitectures': ['arm64'] if re.match(r'[a-z]+\d+g', args.args.get('instanceType', '')) else ['i386', 'x86_64']}
+        if args.token == 'aws:ssm/getParameter:getParameter':
+            return {'name': args.args.get('name'), 'type': 'String', 'value': f'ami-{args.args.get("name").rsplit("-", 1)[-1]}'}
+        if args.token == 'aws:route53/getZone:getZone':
+            return {'name': args.args.get('name'), 'zoneId': 'Z0123456789ABCDEFGHIJ'}
+        if args.token == 'aws:eks/getNodeGroup:getNodeGroup':
+            return {'resources': [{'autoscalingGroups': [{'name': f'eks-{args.args.get("nodeGroupName")}'}]}]}
+
+        return super().call(args)
+
+
+class _InlineExecutor(concurrent.futures.ThreadPoolExecutor):
+    ## The mock monitor deserializes resource references (e.g. the inputs of the pulumi_eks components)
+    ## inside run_in_executor. Running that inline keeps everything on the program's event loop.
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+def run_program(stack: str, config: dict, mocks: pulumi.runtime.Mocks, before_run=None) -> float:
+    ## Run __main__.py for the stack under the mocks, with config as its stack config (written to a temp
+    ## dir, which is also used as the cache dir). before_run is called once the mocks are set. Returns the evaluation time in seconds. The constants
+    ## are changed for the rest of the process, so this is meant to be run in a fresh interpreter.
+    from pulumi.runtime.stack import run_pulumi_func
+    from pulumi.runtime.sync_await import _ensure_event_loop, _sync_await
+    from constants import Constants as CONST
+
+    workdir = tempfile.mkdtemp(prefix='aws-foundation-')
+    CONST.PATH_STACK_CONFIGS = os.path.join(workdir, 'stack-configs')
+    CONST.PATH_CACHE = os.path.join(workdir, 'cache')
+    os.makedirs(CONST.PATH_STACK_CONFIGS)
+    with open(os.path.join(CONST.PATH_STACK_CONFIGS, f'sc-{stack}.yaml'), 'w') as f:
+        yaml.safe_dump(config, f)
+
+    loop = _ensure_event_loop()
+    loop.set_default_executor(_InlineExecutor())
+    pulumi.runtime.set_mocks(mocks, project='aws-foundation', stack=stack, preview=False)
+    if before_run:
+        before_run()
+
+    start = time.perf_counter()
+    _sync_await(run_pulumi_func(lambda: runpy.run_path(os.path.join(ROOT, '__main__.py'), run_name='__main__')))
+    return time.perf_counter() - start
+
+class _RecordingMocks(ProgramMocks):
+    def __init__(self):
+        super().__init__()
+        self.inputs = {}
+
+    def new_resource(self, args: pulumi.runtime.MockResourceArgs):
+        ## Providers are named like the resources they're for (the k8s provider like the cluster)
+        if not args.typ.startswith('pulumi:providers:'):
+            self.inputs[args.name] = args.inputs
+        ## Other resources can share a name too (the EFS file system and the cluster), by type and name as well
+        self.inputs[f'{args.typ}::{args.name}'] = args.inputs
+        return super().new_resource(args)
+
+def program_inputs(stack: str, config: dict) -> dict:
+    ## {resource name: inputs} of the resources a run of the program registers (also as {'type::name': inputs}),
+    ## with config as the stack config. Runs in a fresh interpreter, as run_program changes the constants.
+    out = subprocess.run([sys.executable, __file__, stack], input=json.dumps(config), cwd=ROOT, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f'{stack} failed:\n{out.stderr}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def merge_config(config: dict, overrides: dict) -> dict:
+    ## Merges overrides into config in place: mappings key by key, other values (lists too) replace the
+    ## setting, None removes it
+    for key, value in overrides.items():
+        if value is None:
+            config.pop(key, None)
+        elif isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge_config(config[key], value)
+        else:
+            config[key] = value
+    return config
+
+def stack_config(stack: str, overrides: dict = None) -> dict:
+    ## The stack's shipped example config, with overrides of its aws sections merged in, see merge_config
+    with open(os.path.join(ROOT, 'stack-configs', f'sc-{stack}.example.yaml'), 'r') as f:
+        config = yaml.safe_load(f)
+    merge_config(config['aws'], overrides or {})
+    return config
+
+def stack_inputs(stack: str, overrides: dict = None) -> dict:
+    ## program_inputs of the stack's example config with overrides, see stack_config
+    return program_inputs(stack, stack_config(stack, overrides))
+
+if __name__ == '__main__':
+    sys.path.append(ROOT)
+    mocks = _RecordingMocks()
+    run_program(sys.argv[1], json.load(sys.stdin), mocks)
+    print(json.dumps(mocks.inputs, default=str))
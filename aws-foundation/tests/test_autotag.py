@@ -0,0 +1,34 @@
+import os, sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import taggable
+from modules.autotag import _auto_tag
+
+AUTO_TAGS = {'user': 'tester', 'environment': 'test'}
+
+def _args(type_, tags=None):
+    return SimpleNamespace(type_=type_, props={'tags': tags}, opts=None)
+
+def test_taggable_types_from_provider():
+    types = taggable.get_taggable_types()
+    assert isinstance(types, frozenset)
+    for t in ('aws:ec2/vpc:Vpc', 'aws:eks/addon:Addon', 'aws:iam/policy:Policy'):
+        assert taggable.is_taggable(t), f"{t} should be taggable"
+
+def test_untaggable_types():
+    for t in ('aws:iam/rolePolicyAttachment:RolePolicyAttachment', 'kubernetes:core/v1:ServiceAccount', 'pulumi:providers:aws'):
+        assert not taggable.is_taggable(t), f"{t} should not be taggable"
+
+def test_auto_tag_merges_tags():
+    result = _auto_tag(_args('aws:ec2/vpc:Vpc', {'Name': 'my-vpc', 'user': 'someone'}), AUTO_TAGS)
+    assert result.props['tags'] == {'Name': 'my-vpc', 'user': 'tester', 'environment': 'test'}
+
+def test_auto_tag_skips_untaggable():
+    assert _auto_tag(_args('aws:iam/rolePolicyAttachment:RolePolicyAttachment'), AUTO_TAGS) is None
+
+def test_scan_matches_cache():
+    ## Whatever is cached on disk must be what a fresh scan of the provider SDK produces
+    scanned = taggable.scan_provider_schema()
+    if scanned:
+        assert scanned == taggable.get_taggable_types()
@@ -0,0 +1,123 @@
+import os, sys, json
+import pytest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import modules.common as common
+
+class FakeResult:
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+class FakeInvoke:
+    def __init__(self):
+        self.calls = 0
+        self.__name__ = 'get_fake'
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        return FakeResult(args=kwargs, resources=[{'autoscaling_groups': [{'name': 'asg-1'}]}])
+
+def _setup(tmp_path, monkeypatch, region='xx-test-1'):
+    monkeypatch.setattr(common, '_invoke_cache', {})
+    monkeypatch.setattr(common.CONST, 'PATH_CACHE', str(tmp_path))
+    monkeypatch.delenv('PULUMI_INVOKE_CACHE_TTL', raising=False)
+    monkeypatch.delenv('PULUMI_INVOKE_CACHE_BYPASS', raising=False)
+    if region:
+        monkeypatch.setenv('AWS_REGION', region)
+    else:
+        monkeypatch.delenv('AWS_REGION', raising=False)
+        monkeypatch.delenv('AWS_DEFAULT_REGION', raising=False)
+    return FakeInvoke()
+
+def test_identical_invokes_deduplicated(tmp_path, monkeypatch):
+    fn = _setup(tmp_path, monkeypatch)
+    for _ in range(5):
+        common.cached_invoke(fn, instance_type='t3a.xlarge')
+    common.cached_invoke(fn, instance_type='m6a.xlarge')
+    assert fn.calls == 2
+    assert not os.listdir(tmp_path), "nothing should be persisted without a ttl"
+
+def test_bypass(tmp_path, monkeypatch):
+    fn = _setup(tmp_path, monkeypatch)
+    common.cached_invoke(fn, name='example.net')
+    common.cached_invoke(fn, bypass=True, name='example.net')
+    monkeypatch.setenv('PULUMI_INVOKE_CACHE_BYPASS', '1')
+    common.cached_invoke(fn, name='example.net')
+    assert fn.calls == 3
+
+def test_persisted_across_runs(tmp_path, monkeypatch):
+    fn = _setup(tmp_path, monkeypatch)
+    first = common.cached_invoke(fn, ttl=60, name='example.net')
+
+    ## A new run: nothing in memory, result comes back from disk
+    monkeypatch.setattr(common, '_invoke_cache', {})
+    cached = common.cached_invoke(fn, ttl=60, name='example.net')
+    assert fn.calls == 1
+    assert cached.args == first.args
+    assert cached.resources[0]['autoscaling_groups'][0]['name'] == 'asg-1'
+
+    ## A different region is a different key
+    monkeypatch.setattr(common, '_invoke_cache', {})
+    monkeypatch.setenv('AWS_REGION', 'xx-test-2')
+    common.cached_invoke(fn, ttl=60, name='example.net')
+    assert fn.calls == 2
+
+def test_expired(tmp_path, monkeypatch):
+    fn = _setup(tmp_path, monkeypatch)
+    common.cached_invoke(fn, ttl=60, name='example.net')
+    for f in (tmp_path / 'invokes').iterdir():
+        os.utime(f, (0, 0))
+
+    monkeypatch.setattr(common, '_invoke_cache', {})
+    common.cached_invoke(fn, ttl=60, name='example.net')
+    assert fn.calls == 2
+
+def test_not_persisted_without_region(tmp_path, monkeypatch):
+    fn = _setup(tmp_path, monkeypatch, region=None)
+    common.cached_invoke(fn, ttl=60, name='example.net')
+    assert not os.listdir(tmp_path)
+
+def test_datafile_returns_copies(monkeypatch):
+    monkeypatch.setattr(common, '_datafiles', {})
+    values = common.get_datafile(common.CONST.FILE_LB_CONTROLLER_VALUES)
+    values['values']['clusterName'] = 'mutated'
+    assert common.get_datafile(common.CONST.FILE_LB_CONTROLLER_VALUES)['values'].get('clusterName') != 'mutated'
+
+def test_datafile_parsed_once(monkeypatch):
+    monkeypatch.setattr(common, '_datafiles', {})
+    parsed = []
+    _parse = common._parse_datafile
+    monkeypatch.setattr(common, '_parse_datafile', lambda f: parsed.append(f) or _parse(f))
+    for _ in range(3):
+        common.get_datafile(common.CONST.FILE_CLUSTER_ROLE_POLICY)
+    assert len(parsed) == 1
+
+def test_json_datafile_canonical(monkeypatch):
+    monkeypatch.setattr(common, '_datafiles', {})
+    policy = common.get_datafile(common.CONST.FILE_CLUSTER_ROLE_POLICY)
+    assert ' ' not in policy and '\n' not in policy
+    assert json.loads(policy) == common.get_json_datafile(common.CONST.FILE_CLUSTER_ROLE_POLICY)
+
+def test_missing_datafile(monkeypatch):
+    monkeypatch.setattr(common, '_datafiles', {})
+    with pytest.raises(OSError):
+        common.get_datafile('does-not-exist.json')
+
+def test_datafile_pack(tmp_path, monkeypatch):
+    pack = str(tmp_path / 'datafiles.pack')
+    common.build_datafile_pack(pack)
+
+    monkeypatch.setattr(common, '_datafiles', {})
+    monkeypatch.setattr(common, '_parse_datafile', None)
+    assert common.load_datafile_pack(pack)
+    assert common.get_json_datafile(common.CONST.FILE_NODEGROUP_ROLE_POLICY)['Version'] == '2012-10-17'
+    assert isinstance(common.get_datafile('kube/jenkins/jenkins-sa.yaml'), list)
+
+def test_stale_datafile_pack_ignored(tmp_path, monkeypatch):
+    pack = str(tmp_path / 'datafiles.pack')
+    common.build_datafile_pack(pack)
+    monkeypatch.setattr(common, '_datafile_fingerprint', lambda: [('changed.json', 1, 1)])
+    monkeypatch.setattr(common, '_datafiles', {})
+    assert not common.load_datafile_pack(pack)
+    assert common._datafiles == {}
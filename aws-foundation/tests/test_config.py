@@ -0,0 +1,273 @@
+import copy, os, sys
+import pytest
+import yaml
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import config as cfg
+from config import AWSPulumiConfig
+from mocks import merge_config
+
+TAGS = """
+  tags:
+    user: 'tester'
+    environment: 'test'
+    purpose: 'testing'
+"""
+
+@pytest.fixture
+def stack_configs(tmp_path, monkeypatch):
+    monkeypatch.setattr(cfg.CONST, 'PATH_STACK_CONFIGS', str(tmp_path / 'stack-configs'))
+    monkeypatch.setattr(cfg.CONST, 'PATH_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(cfg, '_compiled', {})
+    os.makedirs(tmp_path / 'stack-configs')
+
+    def write(stack: str, body: str):
+        with open(tmp_path / 'stack-configs' / f'sc-{stack}.yaml', 'w') as f:
+            f.write(body)
+    return write
+
+## A valid std-eks config, the tests below override only the settings they check
+STD_EKS = {
+    'tags': {'user': 'tester', 'environment': 'test', 'purpose': 'testing'},
+    'vpc': {'cidr': '10.0.0.0/16'},
+    'eks': {
+        'enabled': True,
+        'version': '1.31',
+        'desired_nodes_per_group': 2,
+        'max_nodes_per_group': 10,
+        'node_groups': {
+            'instance_types': ['m6a.xlarge'],
+            'memory_mib': {'min': 8192, 'max': 16384},
+            'vcpu_count': {'min': 4, 'max': 8},
+        },
+    },
+}
+
+@pytest.fixture
+def std_eks(stack_configs):
+    def load(overrides: dict = None) -> AWSPulumiConfig:
+        ## STD_EKS with overrides merged in (see mocks.merge_config), written and loaded as the std-eks stack
+        stack_configs('std-eks', yaml.safe_dump({'aws': merge_config(copy.deepcopy(STD_EKS), overrides or {})}))
+        return AWSPulumiConfig('std-eks')
+    return load
+
+def test_typed_sections(std_eks):
+    config = std_eks({'eks': {'addons': [{'name': 'aws-ebs-csi-driver', 'version': 'v1.39.0-eksbuild.1'}]}})
+    assert config.vpc.cidr == '10.0.0.0/16'
+    assert config.eks.node_groups.memory_mib.max == 16384
+    assert config.eks.addons[0].name == 'aws-ebs-csi-driver'
+    ## loadbalancer_controller isn't in the file; this used to raise AttributeError
+    assert config.lb_controller_enabled() is False
+    assert config.efs_csi_driver_enabled() is False
+    assert config.rds is None and config.rds_enabled() is False
+
+
+def test_all_errors_reported_at_once(stack_configs):
+    stack_configs('broken', 'dependency_mode: sometimes\naws:' + TAGS + """
+  vpc:
+    cidr: '10.0.0.0/16'
+    subnet_sise: 24
+  ec2:
+    enabled: !!bool true
+    count: 'two'
+  eks:
+    enabled: !!bool true
+    version: '1.31'
+    ip_family: ipv5
+""")
+    with pytest.raises(ValueError) as e:
+        AWSPulumiConfig('broken')
+
+    errors = str(e.value).splitlines()
+    assert 'aws.vpc.subnet_sise: unknown setting' in errors
+    assert "aws.ec2.count: expected int, got str ('two')" in errors
+    assert 'aws.ec2.instance_type: required setting is missing' in errors
+    assert 'aws.eks.node_groups: required setting is missing' in errors
+    ## The cross-checks in the same run
+    assert 'Invalid dependency_mode: "sometimes". This must be one of full, minimal' in errors
+    assert 'Invalid eks.ip_family: "ipv5". This must be one of ipv4, ipv6' in errors
+    assert len(errors) >= 6
+
+def test_disabled_sections_can_be_partial(stack_configs):
+    stack_configs('partial', 'aws:' + TAGS + """
+  rds:
+    enabled: !!bool false
+    engine: mysql
+""")
+    config = AWSPulumiConfig('partial')
+    assert config.rds.engine == 'mysql'
+    assert config.rds.port is None
+
+def test_missing_tags(stack_configs):
+    stack_configs('notags', 'aws:\n  tags:\n    user: tester\n')
+    with pytest.raises(ValueError, match='Tag: environment is missing!'):
+        AWSPulumiConfig('notags')
+
+def test_dependency_mode(stack_configs):
+    stack_configs('default', 'aws:' + TAGS)
+    assert not AWSPulumiConfig('default').minimal_dependencies()
+    stack_configs('minimal', 'dependency_mode: minimal\naws:' + TAGS)
+    assert AWSPulumiConfig('minimal').minimal_dependencies()
+    stack_configs('bad', 'dependency_mode: fastest\naws:' + TAGS)
+    with pytest.raises(ValueError, match='Invalid dependency_mode'):
+        AWSPulumiConfig('bad')
+
+def test_vpc_subnets_must_fit(stack_configs):
+    stack_configs('foundation', 'aws:' + TAGS + """
+  vpc:
+    cidr: '10.0.0.0/24'
+    subnet_size: 26
+    private_subnet_size: 25
+    num_private_subnets: 2
+    num_public_subnets: 1
+    num_pod_subnets: 1
+""")
+    with pytest.raises(ValueError) as e:
+        AWSPulumiConfig('foundation')
+    assert 'vpc.num_pod_subnets needs vpc.secondary_cidrs' in str(e.value)
+
+    stack_configs('foundation', 'aws:' + TAGS + """
+  vpc:
+    cidr: '10.0.0.0/24'
+    subnet_size: 26
+    private_subnet_size: 25
+    num_private_subnets: 2
+    num_public_subnets: 1
+""")
+    with pytest.raises(ValueError, match="The vpc subnets don't fit: No room left for a /26 subnet in 10.0.0.0/24"):
+        AWSPulumiConfig('foundation')
+
+def test_eks_ip_family(std_eks):
+    assert std_eks({'eks': {'ip_family': 'ipv6'}}).eks.ip_family == 'ipv6'
+    with pytest.raises(ValueError, match='Invalid eks.ip_family'):
+        std_eks({'eks': {'ip_family': 'ipv5'}})
+
+
+def test_efs_throughput(std_eks):
+    assert std_eks({'efs': {'enabled': True, 'throughput_mode': 'elastic'}}).efs.throughput_mode == 'elastic'
+
+    with pytest.raises(ValueError, match='efs.provisioned_throughput is needed with'):
+        std_eks({'efs': {'enabled': True, 'throughput_mode': 'provisioned'}})
+    with pytest.raises(ValueError, match='efs.throughput_mode: elastic needs efs.performance_mode: generalPurpose'):
+        std_eks({'efs': {'enabled': True, 'throughput_mode': 'elastic', 'performance_mode': 'maxIO'}})
+
+
+def test_storage_classes(std_eks):
+    with pytest.raises(ValueError) as e:
+        std_eks({'eks': {'storage_classes': [
+            {'name': 'fast', 'throughput': 500, 'default': True},
+            {'name': 'db', 'type': 'io2', 'throughput': 500, 'default': True},
+        ]}})
+
+    errors = str(e.value).splitlines()
+    assert 'eks.storage_classes need the aws-ebs-csi-driver addon in eks.addons' in errors
+    assert 'eks.storage_classes: only one can be the default' in errors
+    assert 'eks.storage_classes db: throughput can only be set for gp3 volumes' in errors
+
+
+def test_node_storage(std_eks):
+    with pytest.raises(ValueError) as e:
+        std_eks({'eks': {'node_groups': {
+            'instance_types': ['m6id.xlarge'],
+            'storage': {
+                'root_volume': {'type': 'gp2', 'throughput': 500},
+                'data_volume': {'size': 100},
+                'instance_store': True,
+            },
+        }}})
+
+    errors = str(e.value).splitlines()
+    assert 'eks.node_groups.storage.root_volume.throughput can only be set for gp3 volumes' in errors
+    assert 'eks.node_groups.storage: data_volume and instance_store both hold containerd, only one can be used' in errors
+
+
+def test_node_pools(std_eks):
+    with pytest.raises(ValueError) as e:
+        std_eks({'eks': {'node_pools': [
+            {
+                'name': 'ci',
+                'capacity_type': 'spot',
+                'placement': 'multi_az',
+                'max_size': 1,
+                'taints': [{'key': 'workload', 'effect': 'NoSchedule'}],
+                'storage': {'data_volume': {'type': 'st1', 'iops': 3000}},
+            },
+            {'name': 'ci'},
+        ]}})
+
+    errors = str(e.value).splitlines()
+    assert 'eks.node_pools: the name "ci" is used more than once' in errors
+    assert 'Invalid eks.node_pools.ci.capacity_type: "spot". This must be one of ON_DEMAND, SPOT' in errors
+    assert 'Invalid eks.node_pools.ci.taints workload effect: "NoSchedule". This must be one of NO_SCHEDULE, NO_EXECUTE, PREFER_NO_SCHEDULE' in errors
+    assert 'eks.node_pools.ci: the sizes need min_size <= desired_size <= max_size, got 2, 2, 1' in errors
+    assert 'eks.node_pools.ci.storage.data_volume.iops can only be set for gp3, io1, io2 volumes' in errors
+
+
+def test_karpenter_instance_types(std_eks):
+    karpenter = {'autoscaler': {'enabled': True, 'type': 'karpenter'}}
+    assert std_eks({'eks': karpenter | {'node_groups': {'instance_types': ['m6a.*', 'm7a.*']}}}).eks.node_groups.instance_types == ['m6a.*', 'm7a.*']
+
+    with pytest.raises(ValueError) as e:
+        std_eks({'eks': karpenter | {'node_groups': {'instance_types': ['m6*.xlarge', 'm6a.*', 't3a.xlarge']}}})
+    errors = str(e.value).splitlines()
+    assert 'eks.node_groups.instance_types: "m6*.xlarge" can\'t be used with karpenter, only whole families (like m6a.*) can' in errors
+    assert 'eks.node_groups.instance_types: with karpenter these are either instance types or families (like m6a.*), not both' in errors
+
+def test_aurora(std_eks):
+    rds = {
+        'enabled': True,
+        'aws_rds_type': 'aurora',
+        'engine': 'aurora-postgresql',
+        'storage': 0,
+        'storage_type': 'aurora',
+        'engine_version': '16.4',
+        'family': 'aurora-postgresql16',
+        'instance_class': 'db.serverless',
+        'port': 5432,
+        'db_name': 'app',
+        'db_user': 'app',
+        'subdomain': 'db',
+        'tld': 'internal.com',
+    }
+    assert std_eks({'rds': rds}).rds.aurora.instance_class == 'db.serverless'
+
+    with pytest.raises(ValueError) as e:
+        std_eks({'rds': {**rds, 'engine': 'postgres', 'aurora': {'min_capacity': 0.3, 'autoscaling': {'enabled': True, 'metric': 'memory'}}}})
+    assert 'rds.aws_rds_type: aurora needs an aurora-mysql or aurora-postgresql engine, not postgres' in str(e.value)
+    assert 'in steps of 0.5' in str(e.value)
+    assert 'Invalid rds.aurora.autoscaling.metric: "memory"' in str(e.value)
+
+
+def test_compiled_config_cached(stack_configs, monkeypatch):
+    stack_configs('cached', 'aws:' + TAGS)
+    first = AWSPulumiConfig('cached')
+    first.add_tags({'extra': 'tag'})
+
+    ## Neither rebuilding in this process, nor a new process (cache on disk) parses the yaml again
+    monkeypatch.setattr(cfg.yaml, 'load', None)
+    second = AWSPulumiConfig('cached')
+    monkeypatch.setattr(cfg, '_compiled', {})
+    third = AWSPulumiConfig('cached')
+
+    assert 'extra' not in second.tags and 'extra' not in third.tags
+    assert third.tags == {'user': 'tester', 'environment': 'test', 'purpose': 'testing'}
+
+def test_config_change_invalidates_cache(stack_configs):
+    stack_configs('changing', 'aws:' + TAGS)
+    assert AWSPulumiConfig('changing').tags['user'] == 'tester'
+    stack_configs('changing', 'aws:' + TAGS.replace("'tester'", "'someone-else'"))
+    assert AWSPulumiConfig('changing').tags['user'] == 'someone-else'
+
+def test_config_cache_pruned(stack_configs):
+    cache_dir = os.path.join(cfg.CONST.PATH_CACHE, 'config')
+    for user in ('first', 'second', 'third'):
+        stack_configs('pruned', 'aws:' + TAGS.replace("'tester'", f"'{user}'"))
+        AWSPulumiConfig('pruned')
+
+    ## Only the pickle of the last edit is left
+    assert len([f for f in os.listdir(cache_dir) if f.startswith('sc-pruned.yaml.')]) == 1
+
+def test_example_configs():
+    ## The shipped examples must pass validation
+    for stack in ('foundation', 'jenkins-ec2', 'std-eks'):
+        assert cfg._read_config(os.path.join(cfg.CONST.PATH_STACK_CONFIGS, f'sc-{stack}.example.yaml'))['errors'] == []
@@ -0,0 +1,53 @@
+import os, sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import tools.dag_analyzer as dag_analyzer
+
+def _node(typ: str, implicit: list = (), explicit: list = ()) -> dict:
+    return {'type': typ, 'name': typ.split(':')[-1].lower(), 'implicit': list(implicit), 'explicit': list(explicit),
+            'dependencies': sorted(set(implicit) | set(explicit))}
+
+## A small std-eks like graph, with the dependencies the modules declare in full mode
+NODES = {
+    'role': _node('aws:iam/role:Role'),
+    'attachment': _node('aws:iam/rolePolicyAttachment:RolePolicyAttachment', implicit=['role']),
+    'cluster': _node('eks:index:Cluster', implicit=['role']),
+    'ng-a': _node('eks:index:ManagedNodeGroup', implicit=['role'], explicit=['cluster', 'role', 'attachment']),
+    'ng-b': _node('eks:index:ManagedNodeGroup', implicit=['role'], explicit=['cluster', 'role', 'attachment']),
+    'addon': _node('aws:eks/addon:Addon', implicit=['cluster'], explicit=['ng-a', 'ng-b', 'cluster']),
+}
+DURATIONS = {'eks:index:Cluster': 600, 'eks:index:ManagedNodeGroup': 240, 'aws:eks/addon:Addon': 60}
+
+def test_schedule_and_critical_path():
+    steps = dag_analyzer.schedule(NODES, DURATIONS)
+    assert steps['cluster']['start'] == 2
+    assert steps['ng-a']['start'] == 602
+    assert steps['addon']['end'] == 902
+
+    text, _, _ = dag_analyzer.report(NODES, DURATIONS)
+    assert 'estimated 902.0s' in text
+
+def test_redundant_dependencies():
+    redundant = {(urn, dep): reason for urn, dep, reason in dag_analyzer.redundant_dependencies(NODES)}
+    assert redundant[('ng-a', 'role')] == 'already an input'
+    assert redundant[('addon', 'cluster')] == 'already an input'
+    assert ('ng-a', 'attachment') not in redundant
+    assert ('addon', 'ng-a') not in redundant
+
+def test_explicit_delays():
+    delays = dict((urn, delay) for delay, urn in dag_analyzer.explicit_delays(NODES, dag_analyzer.schedule(NODES, DURATIONS)))
+    assert delays['addon'] == 240
+    assert delays['ng-a'] == 600
+
+def test_minimal_mode_under_mocks():
+    ## The program itself, with dependency_mode: minimal
+    nodes = dag_analyzer.run_capture('std-eks', 'minimal')
+    by_name = {n['name']: n for n in nodes.values()}
+
+    groups = [urn for urn, n in nodes.items() if n['type'] == 'eks:index:ManagedNodeGroup']
+    assert len(groups) == 2
+    addon = next(n for n in nodes.values() if n['type'] == 'aws:eks/addon:Addon')
+    assert len([d for d in addon['explicit'] if d in groups]) == 1, "addons wait for the first node group only"
+    assert not dag_analyzer.redundant_dependencies(nodes)
+    assert by_name['std-eks-lb-controller']['explicit']
@@ -0,0 +1,100 @@
+import os, sys, json
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+from pulumi.automation import EngineEvent
+import tools.deploy_trace as deploy_trace
+
+_URN = 'urn:pulumi:std-eks::aws-foundation::{}::{}'
+VPC = _URN.format('aws:ec2/vpc:Vpc', 'vpc')
+ROLE = _URN.format('aws:iam/role:Role', 'node-role')
+CLUSTER = _URN.format('eks:index:Cluster', 'eks')
+NODES = _URN.format('eks:index:ManagedNodeGroup', 'nodes')
+RELEASE = _URN.format('kubernetes:helm.sh/v3:Release', 'lb-controller')
+
+DEPENDENCIES = {
+    VPC: [],
+    ROLE: [],
+    CLUSTER: [VPC, ROLE],
+    NODES: [CLUSTER, ROLE],
+    RELEASE: [NODES],
+}
+
+## (urn, op, start, end) of an update; the role is unchanged
+STEPS = [
+    (VPC, 'create', 0, 5),
+    (ROLE, 'same', 0, 0),
+    (CLUSTER, 'create', 5, 605),
+    (NODES, 'create', 605, 905),
+    (RELEASE, 'create', 905, 1200),
+]
+
+def _event_log() -> list:
+    ## Engine events the way the CLI writes them to --event-log
+    events = []
+    for urn, op, start, end in STEPS:
+        metadata = {'op': op, 'urn': urn, 'type': urn.split('::')[2], 'provider': '', 'new': {'urn': urn, 'parent': ''}}
+        events.append({'timestamp': start, 'resourcePreEvent': {'metadata': metadata}})
+        events.append({'timestamp': end, 'resOutputsEvent': {'metadata': metadata}})
+    events.append({'timestamp': 1200, 'summaryEvent': {'resourceChanges': {'create': 4}}})
+    events.sort(key=lambda e: e['timestamp'])
+    for i, e in enumerate(events):
+        e['sequence'] = i
+    return events
+
+def _write_log(tmp_path) -> str:
+    path = tmp_path / 'events.jsonl'
+    path.write_text('\n'.join(json.dumps(e) for e in _event_log()))
+    state = tmp_path / 'state.json'
+    state.write_text(json.dumps({'version': 3, 'deployment': {'resources': [
+        {'urn': urn, 'dependencies': deps} for urn, deps in DEPENDENCIES.items()
+    ]}}))
+    return str(path), str(state)
+
+def test_steps_from_event_log(tmp_path):
+    records, _ = deploy_trace.load_trace(*_write_log(tmp_path))
+    steps = deploy_trace.build_steps(records)
+
+    assert ROLE not in steps, "unchanged resources aren't steps"
+    assert steps[CLUSTER]['duration'] == 600
+    assert steps[RELEASE]['end'] == 1200
+    assert all(s['status'] == 'done' for s in steps.values())
+
+def test_critical_path(tmp_path):
+    records, dependencies = deploy_trace.load_trace(*_write_log(tmp_path))
+    steps = deploy_trace.build_steps(records)
+
+    path = deploy_trace.critical_path(steps, dependencies)
+    assert [s['urn'] for s in path] == [VPC, CLUSTER, NODES, RELEASE]
+    assert 'Critical path' in deploy_trace.summary(steps, dependencies)
+
+def test_chrome_trace_rows_dont_overlap(tmp_path):
+    records, dependencies = deploy_trace.load_trace(*_write_log(tmp_path))
+    trace = deploy_trace.chrome_trace(deploy_trace.build_steps(records), dependencies)
+
+    complete = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert len(complete) == 4
+    for tid in {e['tid'] for e in complete}:
+        row = sorted((e['ts'], e['ts'] + e['dur']) for e in complete if e['tid'] == tid)
+        assert all(a[1] <= b[0] for a, b in zip(row, row[1:]))
+
+def test_saved_trace_replays(tmp_path):
+    ## What `record` captures from the Automation API replays offline the same way
+    records = [deploy_trace.record_from_event(EngineEvent.from_json(e)) for e in _event_log()]
+    records = [r for r in records if r]
+    deploy_trace.save_trace(str(tmp_path / 'trace.json'), records, DEPENDENCIES, 'std-eks')
+
+    replayed, dependencies = deploy_trace.load_trace(str(tmp_path / 'trace.json'))
+    assert replayed == records
+    assert dependencies == DEPENDENCIES
+
+def test_failed_and_unfinished_steps():
+    records = [
+        {'kind': 'start', 'sequence': 0, 'timestamp': 10, 'urn': VPC, 'type': 'aws:ec2/vpc:Vpc', 'op': 'create', 'parent': ''},
+        {'kind': 'start', 'sequence': 1, 'timestamp': 11, 'urn': CLUSTER, 'type': 'eks:index:Cluster', 'op': 'create', 'parent': ''},
+        {'kind': 'failed', 'sequence': 2, 'timestamp': 40, 'urn': VPC, 'type': 'aws:ec2/vpc:Vpc', 'op': 'create', 'parent': ''},
+    ]
+    steps = deploy_trace.build_steps(records)
+    assert steps[VPC]['status'] == 'failed'
+    assert steps[CLUSTER]['status'] == 'running'
+    assert steps[CLUSTER]['end'] == 30
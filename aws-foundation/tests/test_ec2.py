@@ -1,3 +1,4 @@
+import pytest
 import pulumi
 import sys, os
 
@@ -9,11 +10,10 @@ pulumi.runtime.set_mocks(Ec2Mocks(), preview=False)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from config import AWSPulumiConfig
 
-# Mock the foundation stack first
-stack = 'foundation'
-import modules.vpc as vpc
-config = AWSPulumiConfig(stack)
-new_vpc = vpc.define_vpc(config)
+# The foundation stack's outputs come from a canned snapshot
+import modules.foundation as foundation
+snapshot = foundation.load_snapshot(os.path.join(os.path.dirname(__file__), 'snapshots', 'foundation.json'))
+new_vpc = foundation.FoundationSnapshot(snapshot).get_output('vpc_data')
 
 # Mock the jenkins-ec2 stack
 stack = 'jenkins-ec2'
@@ -29,7 +29,7 @@ instance = instances[0]
 def test_instance_type():
     def check_instance_type(args):
         urn, i_type, _config = args
-        config_type = _config.ec2.get('instance_type')
+        config_type = _config.ec2.instance_type
         assert config_type.startswith(i_type), f"Type '{i_type}' of resource does not match the value specified in the config: {config_type}"
 
     return pulumi.Output.all(instance.urn, instance.instance_type, config).apply(check_instance_type)
@@ -63,3 +63,14 @@ def test_security_group_rules():
 
     # Return the results of the unit tests.
     return pulumi.Output.all(ec2_security_group.urn, ec2_security_group.ingress).apply(check_security_group_rules)
+
+
+# Without an ami, the latest Amazon Linux 2023 for the instance type's architecture
+def test_ami_from_architecture():
+    from mocks import stack_inputs
+
+    inputs = stack_inputs('jenkins-ec2', {'ec2': {'ami': None, 'instance_type': 't4g.xlarge'}})
+    assert inputs['jenkins-ec2-jenkins-0']['ami'] == 'ami-arm64'
+
+    with pytest.raises(RuntimeError, match='t4g.xlarge is not an x86_64 instance type'):
+        stack_inputs('jenkins-ec2', {'ec2': {'ami': None, 'instance_type': 't4g.xlarge', 'architecture': 'x86_64'}})
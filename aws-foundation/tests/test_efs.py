@@ -0,0 +1,28 @@
+import os, sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+from mocks import stack_inputs
+
+def test_throughput_and_storage_class():
+    inputs = stack_inputs('std-eks', {
+        'efs': {'throughput_mode': 'provisioned', 'provisioned_throughput': 256, 'storage_class': {'uid': 1000, 'gid': 1000}}
+    })
+
+    efs = inputs['aws:efs/fileSystem:FileSystem::std-eks']
+    assert efs['throughputMode'] == 'provisioned' and efs['provisionedThroughputInMibps'] == 256
+    assert efs['performanceMode'] == 'generalPurpose'
+
+    storage_class = inputs['std-eks-efs-ap']
+    assert storage_class['metadata'] == {'name': 'efs-ap'}
+    assert storage_class['provisioner'] == 'efs.csi.aws.com'
+    assert storage_class['parameters'] == {'provisioningMode': 'efs-ap', 'fileSystemId': 'std-eks_id', 'directoryPerms': '700',
+                                           'basePath': '/dynamic', 'uid': '1000', 'gid': '1000'}
+
+    ## The controller creates the access points with its own IRSA role
+    service_account = inputs['std-eks-efs-controller']['values']['controller']['serviceAccount']
+    assert service_account['name'] == 'efs-csi-controller-sa'
+    assert service_account['annotations']['eks.amazonaws.com/role-arn'].endswith('std-eks-efs-csi-controller')
+    assert 'system:serviceaccount:kube-system:efs-csi-controller-sa' in inputs['std-eks-efs-csi-controller']['assumeRolePolicy']
+    assert inputs['std-eks-efs-csi-controller-attachment']['policyArn'].endswith('std-eks-efs-csi-driver-policy')
+    assert 'std-eks-efs-att' not in inputs
@@ -0,0 +1,140 @@
+import os, sys, base64
+import pytest
+from types import SimpleNamespace
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import modules.eks as eks
+from mocks import stack_inputs
+
+## The example's default storage class needs it
+EBS_CSI_DRIVER = {'name': 'aws-ebs-csi-driver', 'version': 'v1.39.0-eksbuild.1'}
+
+def _instance_type(vcpus: int, enis: int, ips: int) -> SimpleNamespace:
+    return SimpleNamespace(default_vcpus=vcpus, maximum_network_interfaces=enis, maximum_ipv4_addresses_per_interface=ips)
+
+def test_max_pods():
+    ## Values from the EKS max-pods calculator
+    m5_large = _instance_type(2, 3, 10)
+    assert eks.max_pods(m5_large) == 29
+    assert eks.max_pods(m5_large, prefix_delegation=True) == 110
+    t3_micro = _instance_type(2, 2, 2)
+    assert eks.max_pods(t3_micro, prefix_delegation=True) == 34
+    m5_16xlarge = _instance_type(64, 15, 50)
+    assert eks.max_pods(m5_16xlarge) == 737
+    assert eks.max_pods(m5_16xlarge, prefix_delegation=True) == 250
+
+def test_vpc_cni_prefix_delegation():
+    inputs = stack_inputs('std-eks', {'eks': {'addons': [
+        {'name': 'vpc-cni', 'version': 'v1.19.2-eksbuild.1', 'profile': 'prefix-delegation',
+         'configuration_values': {'env': {'WARM_PREFIX_TARGET': '2'}}},
+        {'name': 'coredns', 'version': 'v1.11.4-eksbuild.2', 'configuration_values': {'replicaCount': 3}},
+        EBS_CSI_DRIVER,
+    ]}})
+
+    ## vpc-cni goes to the cluster component, the rest are addons
+    env = inputs['std-eks']['vpcCniOptions']['configurationValues']['env']
+    assert env == {'ENABLE_PREFIX_DELEGATION': 'true', 'WARM_PREFIX_TARGET': '2', 'MINIMUM_IP_TARGET': '16'}
+    assert 'std-eks-vpc-cni' not in inputs
+    assert inputs['std-eks-coredns']['configurationValues'] == '{"replicaCount": 3}'
+
+    user_data = base64.b64decode(inputs['std-eks-nodegroup']['userData']).decode()
+    assert 'maxPods: 110' in user_data
+
+def test_no_max_pods_by_default():
+    inputs = stack_inputs('std-eks')
+    assert 'userData' not in inputs['std-eks-nodegroup']
+    assert 'vpcCniOptions' not in inputs['std-eks']
+
+def test_node_storage():
+    template = stack_inputs('std-eks', {'eks': {'node_groups': {'storage': {
+        'root_volume': {'size': 50},
+        'data_volume': {'size': 200, 'iops': 6000, 'throughput': 500},
+        'ebs_optimized': True,
+    }}}})['std-eks-nodegroup']
+
+    devices = {d['deviceName']: d['ebs'] for d in template['blockDeviceMappings']}
+    assert devices['/dev/xvda'] == {'volumeSize': 50, 'volumeType': 'gp3', 'encrypted': 'true', 'deleteOnTermination': 'true'}
+    assert devices['/dev/xvdb']['iops'] == 6000 and devices['/dev/xvdb']['throughput'] == 500
+    assert template['ebsOptimized'] == 'true'
+    assert 'mount -a' in base64.b64decode(template['userData']).decode()
+
+def test_instance_store():
+    template = stack_inputs('std-eks', {'eks': {'node_groups': {
+        'instance_types': ['m6id.xlarge'], 'storage': {'instance_store': True}
+    }}})['std-eks-nodegroup']
+
+    assert 'strategy: RAID0' in base64.b64decode(template['userData']).decode()
+    assert 'blockDeviceMappings' not in template
+
+def test_node_pools():
+    inputs = stack_inputs('std-eks', {'eks': {'node_pools': [
+        {'name': 'system'},
+        {'name': 'ci', 'capacity_type': 'SPOT', 'placement': 'multi_az', 'instance_types': ['c6a.2xlarge', 'c6i.2xlarge'],
+         'labels': {'workload': 'ci'}, 'taints': [{'key': 'workload', 'value': 'ci'}], 'min_size': 0, 'desired_size': 0, 'max_size': 40},
+    ]}})
+
+    ## system: one on-demand group per private subnet, like the node groups without pools
+    system = [inputs[n] for n in inputs if n.startswith('std-eks-system-mng-')]
+    assert len(system) == 2
+    assert system[0]['capacityType'] == 'ON_DEMAND' and 'taints' not in system[0]
+
+    ci = inputs['std-eks-ci-mng']
+    assert ci['capacityType'] == 'SPOT'
+    assert ci['subnetIds'] == ['subnet-prv00000', 'subnet-prv00001']
+    assert ci['scalingConfig'] == {'desiredSize': 0, 'maxSize': 40, 'minSize': 0}
+    assert ci['labels'] == {'workload': 'ci'}
+    assert ci['taints'] == [{'key': 'workload', 'value': 'ci', 'effect': 'NO_SCHEDULE'}]
+    assert inputs['std-eks-ci-nodegroup']['instanceRequirements']['allowedInstanceTypes'] == ['c6a.2xlarge', 'c6i.2xlarge']
+    assert inputs['std-eks-system-nodegroup']['instanceRequirements']['allowedInstanceTypes'] == ['m6a.xlarge', 'm6a.2xlarge', 't3a.xlarge']
+
+def test_mixed_architecture_node_pools():
+    def _pools(graviton_types: list) -> dict:
+        return {'eks': {'node_pools': [
+            {'name': 'system'},
+            {'name': 'graviton', 'architecture': 'arm64', 'instance_types': graviton_types},
+        ]}}
+    inputs = stack_inputs('std-eks', _pools(['m7g.xlarge', 'c7g.2xlarge']))
+
+    assert 'amiType' not in inputs['std-eks-system-mng-0000']
+    assert inputs['std-eks-graviton-mng-0000']['amiType'] == 'AL2023_ARM_64_STANDARD'
+
+    with pytest.raises(RuntimeError, match='m6a.xlarge is not an arm64 instance type'):
+        stack_inputs('std-eks', _pools(['m7g.xlarge', 'c7g.2xlarge', 'm6a.xlarge']))
+
+def test_bottlerocket_with_image_snapshot():
+    inputs = stack_inputs('std-eks', {'eks': {
+        'addons': [{'name': 'vpc-cni', 'version': 'v1.19.2-eksbuild.1', 'profile': 'prefix-delegation'}, EBS_CSI_DRIVER],
+        'node_groups': {'ami_family': 'BOTTLEROCKET', 'storage': {'data_volume': {'size': 100, 'snapshot_id': 'snap-0123456789abcdef0'}}},
+    }})
+
+    assert inputs['std-eks-mng-0000']['amiType'] == 'BOTTLEROCKET_x86_64'
+    template = inputs['std-eks-nodegroup']
+    assert base64.b64decode(template['userData']).decode() == '[settings.kubernetes]\nmax-pods = 110\n'
+    devices = {d['deviceName']: d['ebs'] for d in template['blockDeviceMappings']}
+    assert devices['/dev/xvdb']['snapshotId'] == 'snap-0123456789abcdef0'
+
+def test_storage_classes():
+    inputs = stack_inputs('std-eks', {'eks': {'storage_classes': [
+        {'name': 'gp3-fast', 'iops': 6000, 'throughput': 500, 'default': True, 'zones': ['us-east-1a', 'us-east-1b']},
+        {'name': 'io2-db', 'type': 'io2', 'iops': 16000, 'reclaim_policy': 'Retain'},
+    ]}})
+
+    gp3 = inputs['std-eks-sc-gp3-fast']
+    assert gp3['provisioner'] == 'ebs.csi.aws.com'
+    assert gp3['parameters'] == {'type': 'gp3', 'encrypted': 'true', 'csi.storage.k8s.io/fstype': 'ext4', 'iops': '6000', 'throughput': '500'}
+    assert gp3['metadata']['annotations'] == {'storageclass.kubernetes.io/is-default-class': 'true'}
+    assert gp3['volumeBindingMode'] == 'WaitForFirstConsumer'
+    assert gp3['allowedTopologies'][0]['matchLabelExpressions'][0]['values'] == ['us-east-1a', 'us-east-1b']
+
+    io2 = inputs['std-eks-sc-io2-db']
+    assert io2['parameters']['iops'] == '16000' and io2['reclaimPolicy'] == 'Retain'
+    assert 'allowedTopologies' not in io2
+
+    ## Only one default: the in-tree gp2 class gives it up
+    gp2 = inputs['kubernetes:storage.k8s.io/v1:StorageClassPatch::std-eks-sc-gp2-not-default']
+    assert gp2['metadata']['name'] == 'gp2'
+    assert gp2['metadata']['annotations']['storageclass.kubernetes.io/is-default-class'] == 'false'
+
+    inputs = stack_inputs('std-eks', {'eks': {'storage_classes': [{'name': 'io2-db', 'type': 'io2', 'iops': 16000}]}})
+    assert not any('sc-gp2-not-default' in k for k in inputs)
@@ -0,0 +1,62 @@
+import json, os, sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+from mocks import stack_inputs
+
+def _run(autoscaler: dict) -> dict:
+    return stack_inputs('std-eks', {'eks': {'autoscaler': autoscaler}})
+
+def test_cluster_autoscaler():
+    inputs = _run({'enabled': True, 'cluster_autoscaler': {'expander': 'priority', 'scale_down_unneeded_time': '5m'}})
+    values = inputs['std-eks-cluster-autoscaler']['values']
+
+    assert values['autoDiscovery']['clusterName'] == 'std-eks'
+    assert values['image']['tag'] == 'v1.31.0'
+    assert values['extraArgs']['expander'] == 'priority'
+    assert values['extraArgs']['scale-down-unneeded-time'] == '5m'
+    assert values['rbac']['serviceAccount']['annotations']['eks.amazonaws.com/role-arn'].endswith('std-eks-cluster-autoscaler')
+    assert 'std-eks-karpenter-nodepool' not in inputs
+
+def test_karpenter():
+    inputs = _run({'enabled': True, 'type': 'karpenter', 'karpenter': {'capacity_types': ['spot', 'on-demand']}})
+
+    assert inputs['std-eks-karpenter']['chart'].startswith('oci://')
+    node_pool = inputs['std-eks-karpenter-nodepool']['spec']
+    requirements = {(r['key'], r['operator']): r['values'] for r in node_pool['template']['spec']['requirements']}
+    assert requirements[('node.kubernetes.io/instance-type', 'In')] == ['m6a.xlarge', 'm6a.2xlarge', 't3a.xlarge']
+    assert requirements[('karpenter.k8s.aws/instance-memory', 'Gt')] == ['8191']
+    assert requirements[('karpenter.sh/capacity-type', 'In')] == ['spot', 'on-demand']
+    ## 2 node groups of at most 10 nodes with 8 vCPUs
+    assert node_pool['limits']['cpu'] == 160
+
+    node_class = inputs['std-eks-karpenter-nodeclass']['spec']
+    assert node_class['role'] == 'std-eks-nodegroup'
+    assert node_class['subnetSelectorTerms'] == [{'id': 'subnet-prv00000'}, {'id': 'subnet-prv00001'}]
+
+def test_karpenter_policy_scoped_to_cluster():
+    inputs = _run({'enabled': True, 'type': 'karpenter'})
+    policy = json.loads(inputs['aws:iam/policy:Policy::std-eks-karpenter']['policy'])
+    statements = {s['Sid']: s for s in policy['Statement']}
+
+    ## Nothing that creates, tags or deletes is open to every resource
+    for statement in policy['Statement']:
+        actions = statement['Action'] if isinstance(statement['Action'], list) else [statement['Action']]
+        if statement['Resource'] == '*':
+            assert all(a.split(':')[1].startswith(('Describe', 'Get')) for a in actions), statement['Sid']
+
+    assert statements['AllowPassingInstanceRole']['Resource'] == 'arn:aws:iam::123456789012:std-eks-nodegroup'
+    assert statements['AllowScopedDeletion']['Condition']['StringEquals'] == {'aws:ResourceTag/kubernetes.io/cluster/std-eks': 'owned'}
+    creation = statements['AllowScopedEC2InstanceActionsWithTags']['Condition']['StringEquals']
+    assert creation['aws:RequestTag/kubernetes.io/cluster/std-eks'] == 'owned'
+    assert statements['AllowScopedResourceCreationTagging']['Condition']['StringEquals']['ec2:CreateAction'] == ['RunInstances', 'CreateFleet', 'CreateLaunchTemplate']
+    assert 'aws:ResourceTag/kubernetes.io/cluster/std-eks' in statements['AllowScopedInstanceProfileActions']['Condition']['StringEquals']
+
+def test_karpenter_instance_families():
+    inputs = stack_inputs('std-eks', {'eks': {
+        'autoscaler': {'enabled': True, 'type': 'karpenter'},
+        'node_groups': {'instance_types': ['m6a.*', 't3a.*']},
+    }})
+    requirements = {r['key']: r['values'] for r in inputs['std-eks-karpenter-nodepool']['spec']['template']['spec']['requirements']}
+    assert requirements['karpenter.k8s.aws/instance-family'] == ['m6a', 't3a']
+    assert 'node.kubernetes.io/instance-type' not in requirements
@@ -0,0 +1,87 @@
+import os, sys, json, time
+from types import SimpleNamespace
+import pulumi
+import pytest
+from mocks import Ec2Mocks
+
+pulumi.runtime.set_mocks(Ec2Mocks(), preview=False)
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+import modules.foundation as foundation
+from config import FoundationSnapshotConfig
+
+CANNED = os.path.join(os.path.dirname(__file__), 'snapshots', 'foundation.json')
+OUTPUTS = {'vpc_data': {'value': {'vpc_id': 'vpc-1'}, 'secret': False}, 'token': {'value': 's3cret', 'secret': True}}
+
+@pytest.fixture
+def stack_configs(tmp_path, monkeypatch):
+    monkeypatch.setattr(foundation.CONST, 'PATH_STACK_CONFIGS', str(tmp_path))
+    (tmp_path / 'sc-foundation.yaml').write_text('aws: {}\n')
+    return tmp_path
+
+def _config(path: str, **settings) -> SimpleNamespace:
+    return SimpleNamespace(foundation_snapshot=FoundationSnapshotConfig(enabled=True, file=path, **settings))
+
+def test_snapshot_round_trip(tmp_path, stack_configs):
+    path = str(tmp_path / 'snapshots' / 'foundation.json')
+    foundation.write_snapshot(path, 'aws-foundation', OUTPUTS, {'version': 7, 'end_time': None})
+
+    snapshot = foundation.load_snapshot(path)
+    assert snapshot['outputs'] == OUTPUTS
+    assert foundation.stale_reason(snapshot, 'aws-foundation', max_age=60, update={'version': 7}) is None
+
+def test_stale_snapshots(tmp_path, stack_configs):
+    path = str(tmp_path / 'foundation.json')
+    snapshot = foundation.write_snapshot(path, 'aws-foundation', OUTPUTS, {'version': 7, 'end_time': None})
+
+    assert 'project' in foundation.stale_reason(snapshot, 'other-project')
+    assert 'updated since' in foundation.stale_reason(snapshot, update={'version': 8})
+    snapshot['taken_at'] = time.time() - 120
+    assert 'older than' in foundation.stale_reason(snapshot, max_age=60)
+    (stack_configs / 'sc-foundation.yaml').write_text('aws: {vpc: {cidr: 10.0.0.0/16}}\n')
+    assert 'changed' in foundation.stale_reason(snapshot)
+
+def test_snapshot_version_checked(tmp_path):
+    path = tmp_path / 'foundation.json'
+    path.write_text(json.dumps({'version': 0}))
+    with pytest.raises(ValueError, match='version'):
+        foundation.load_snapshot(str(path))
+
+def test_reference_uses_fresh_snapshot():
+    ref = foundation.reference(_config(CANNED, max_age=0), 'org', 'aws-foundation')
+    assert isinstance(ref, foundation.FoundationSnapshot)
+
+def test_reference_falls_back_to_stack_reference(tmp_path):
+    ref = foundation.reference(_config(str(tmp_path / 'missing.json')), 'org', 'aws-foundation')
+    assert isinstance(ref, pulumi.StackReference)
+    ## The canned snapshot is years old
+    ref = foundation.reference(_config(CANNED, max_age=60), 'org', 'aws-foundation')
+    assert isinstance(ref, pulumi.StackReference)
+
+@pulumi.runtime.test
+def test_snapshot_outputs():
+    ref = foundation.FoundationSnapshot({'outputs': OUTPUTS})
+
+    def check(args):
+        vpc_id, token_is_secret = args
+        assert vpc_id == 'vpc-1'
+        assert token_is_secret, "secret outputs stay secret"
+
+    return pulumi.Output.all(
+        ref.get_output('vpc_data')['vpc_id'],
+        pulumi.Output.from_input(ref.get_output('token').is_secret())
+    ).apply(check)
+
+def test_check_without_update_fails(tmp_path, monkeypatch, capsys):
+    import tools.foundation_snapshot as foundation_snapshot
+
+    path = str(tmp_path / 'foundation.json')
+    foundation.write_snapshot(path, 'aws-foundation', OUTPUTS, {'version': 7, 'end_time': None})
+    monkeypatch.setattr(foundation, 'latest_update', lambda **kwargs: None)
+    monkeypatch.setattr(sys, 'argv', ['foundation_snapshot.py', 'check', '--file', path])
+
+    ## Without a last update nothing was verified, it isn't reported as up to date
+    with pytest.raises(SystemExit) as e:
+        foundation_snapshot.main()
+    assert e.value.code == 1
+    assert "can't be checked" in capsys.readouterr().out
@@ -0,0 +1,35 @@
+import os, sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import tools.image_snapshot as image_snapshot
+
+ECR = '123456789012.dkr.ecr.us-east-1.amazonaws.com'
+
+def test_pull_commands():
+    images = ['public.ecr.aws/eks/aws-load-balancer-controller:v2.11.0', f'{ECR}/ci/agent:1.4']
+    commands = image_snapshot.pull_commands('AL2023', images)
+
+    assert commands[0] == 'systemctl start containerd'
+    ## The builder gets the token, it's never in the command text
+    assert commands[1] == 'ECR_0=$(aws ecr get-login-password --region us-east-1)'
+    assert commands[2] == 'ctr -n k8s.io images pull --label io.cri-containerd.image=managed public.ecr.aws/eks/aws-load-balancer-controller:v2.11.0'
+    assert commands[3] == f'ctr -n k8s.io images pull --label io.cri-containerd.image=managed --user AWS:$ECR_0 {ECR}/ci/agent:1.4'
+    assert commands[-1] == 'sync'
+
+def test_pull_commands_bottlerocket():
+    ctr = 'apiclient exec admin sheltie ctr -a /run/containerd/containerd.sock'
+    commands = image_snapshot.pull_commands('BOTTLEROCKET', ['busybox:1.36'])
+    assert commands == [
+        f'{ctr} -n k8s.io images pull --label io.cri-containerd.image=managed docker.io/library/busybox:1.36',
+        'sync',
+    ]
+
+    ## No aws CLI on Bottlerocket, the token comes from the aws-cli image
+    commands = image_snapshot.pull_commands('BOTTLEROCKET', [f'{ECR}/ci/agent:1.4'])
+    assert commands[1] == f'ECR_0=$({ctr} -n default run --rm --net-host public.ecr.aws/aws-cli/aws-cli:latest aws-cli aws ecr get-login-password --region us-east-1)'
+
+def test_qualified():
+    assert image_snapshot.qualified('busybox:1.36') == 'docker.io/library/busybox:1.36'
+    assert image_snapshot.qualified('grafana/agent:v0.40') == 'docker.io/grafana/agent:v0.40'
+    assert image_snapshot.qualified(f'{ECR}/ci/agent:1.4') == f'{ECR}/ci/agent:1.4'
@@ -0,0 +1,38 @@
+import os, sys, json, subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import modules.loader as loader
+
+def _load(*names) -> dict:
+    ## Run in a fresh interpreter so other tests' imports don't leak into sys.modules
+    code = (
+        'import sys, json, modules.loader as loader\n'
+        f'for n in {names!r}: loader.load(n)\n'
+        'print(json.dumps({"packages": sorted(m for m in sys.modules if "." not in m), "report": loader.import_report()}))'
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+def _loaded_packages(*names) -> set:
+    return set(_load(*names)['packages'])
+
+def test_non_eks_modules_skip_kubernetes():
+    packages = _loaded_packages('ec2', 'efs', 'load_balancing', 'rds_instance')
+    assert 'pulumi_aws' in packages
+    assert 'pulumi_eks' not in packages, "pulumi_eks should not be imported for non-EKS modules"
+    assert 'pulumi_kubernetes' not in packages, "pulumi_kubernetes should not be imported for non-EKS modules"
+
+def test_eks_modules_load_kubernetes():
+    packages = _loaded_packages('eks')
+    assert {'pulumi_eks', 'pulumi_kubernetes'} <= packages
+
+def test_import_report():
+    report = _load('ec2', 'eks', 'ec2')['report']
+    assert list(report.keys()) == ['ec2', 'eks']
+    assert 'pulumi_aws' in report['ec2']['packages']
+    assert report['eks']['packages'] == ['pulumi_eks', 'pulumi_kubernetes']
+    assert report['eks']['ms'] > 0
+
+def test_load_is_idempotent():
+    assert loader.load('common') is loader.load('common')
@@ -0,0 +1,99 @@
+import os, sys, json
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+from mocks import stack_config, stack_inputs
+
+def _inputs(rds: dict) -> dict:
+    return stack_inputs('std-eks', {'rds': {'enabled': True, **rds}})
+
+def test_instance():
+    inputs = _inputs({})
+
+    assert inputs['aws:rds/subnetGroup:SubnetGroup::std-eks']['subnetIds'] == ['subnet-prv00000', 'subnet-prv00001']
+    security_group = inputs['aws:ec2/securityGroup:SecurityGroup::std-eks-rds']
+    assert security_group['ingress'][0]['cidrBlocks'] == [stack_config('std-eks')['aws']['vpc']['cidr']]
+    assert not any('replica' in k for k in inputs)
+
+def test_read_replicas_and_proxy():
+    inputs = _inputs({
+        'read_replicas': {'count': 2, 'instance_class': 'db.r6g.large', 'availability_zones': ['us-east-1b', 'us-east-1c']},
+        'proxy': {'enabled': True, 'max_connections_percent': 80},
+    })
+
+    replicas = [inputs[f'std-eks-replica-{i}'] for i in range(2)]
+    assert [r['availabilityZone'] for r in replicas] == ['us-east-1b', 'us-east-1c']
+    assert replicas[0]['replicateSourceDb'] == 'std-eks' and replicas[0]['instanceClass'] == 'db.r6g.large'
+
+    proxy = inputs['aws:rds/proxy:Proxy::std-eks']
+    assert proxy['engineFamily'] == 'MYSQL'
+    assert proxy['auths'][0]['secretArn'] == 'arn:aws:secretsmanager:us-east-1:123456789012:secret:rds!std-eks'
+    assert inputs['aws:rds/proxyDefaultTargetGroup:ProxyDefaultTargetGroup::std-eks']['connectionPoolConfig']['maxConnectionsPercent'] == 80
+    assert inputs['aws:rds/proxyTarget:ProxyTarget::std-eks']['dbInstanceIdentifier'] == 'std-eks'
+    policy = json.loads(inputs['std-eks-rds-proxy-secret']['policy'])
+    assert policy['Statement'][0]['Resource'] == proxy['auths'][0]['secretArn']
+
+    ## The writer name goes to the proxy, the reader name to the replicas
+    assert inputs['std-eks-rds-writer']['records'] == ['std-eks.proxy-abcdefghijkl.us-east-1.rds.amazonaws.com']
+    assert inputs['std-eks-rds-writer']['name'] == 'db.std-eks.internal.com'
+    readers = [inputs[f'std-eks-rds-reader-{i}'] for i in range(2)]
+    assert {r['name'] for r in readers} == {'db-ro.std-eks.internal.com'}
+    assert readers[1]['records'] == ['std-eks-replica-1.abcdefghijkl.us-east-1.rds.amazonaws.com']
+
+def test_proxy_without_replicas():
+    inputs = _inputs({'proxy': {'enabled': True}})
+
+    ## The writer name still goes to the proxy, there are no reader names
+    assert inputs['aws:route53/zone:Zone::std-eks-rds']['name'] == 'std-eks.internal.com'
+    assert inputs['std-eks-rds-writer']['records'] == ['std-eks.proxy-abcdefghijkl.us-east-1.rds.amazonaws.com']
+    assert not any('rds-reader' in k for k in inputs)
+
+def test_aurora_serverless_with_reader_autoscaling():
+    inputs = _inputs({
+        'aws_rds_type': 'aurora', 'engine': 'aurora-mysql', 'engine_version': '8.0.mysql_aurora.3.08.0',
+        'family': 'aurora-mysql8.0', 'storage_type': 'aurora',
+        'aurora': {'min_capacity': 1, 'max_capacity': 16, 'readers': 2,
+                   'autoscaling': {'enabled': True, 'metric': 'connections', 'target': 500, 'max_readers': 5}},
+    })
+
+    cluster = inputs['aws:rds/cluster:Cluster::std-eks']
+    assert cluster['serverlessv2ScalingConfiguration'] == {'minCapacity': 1, 'maxCapacity': 16}
+    assert 'dbClusterInstanceClass' not in cluster and 'storageType' not in cluster
+
+    instances = [inputs['std-eks-writer']] + [inputs[f'std-eks-reader-{i}'] for i in range(2)]
+    assert {i['instanceClass'] for i in instances} == {'db.serverless'}
+    assert [i['promotionTier'] for i in instances] == [0, 1, 2]
+
+    target = inputs['aws:appautoscaling/target:Target::std-eks-rds-readers']
+    assert target['resourceId'] == 'cluster:std-eks_id'
+    assert (target['minCapacity'], target['maxCapacity']) == (1, 5)
+    policy = inputs['aws:appautoscaling/policy:Policy::std-eks-rds-readers']['targetTrackingScalingPolicyConfiguration']
+    assert policy['predefinedMetricSpecification']['predefinedMetricType'] == 'RDSReaderAverageDatabaseConnections'
+    assert policy['targetValue'] == 500
+
+def test_tuned_parameters():
+    inputs = _inputs({'tuning': {'enabled': True}, 'parameters': {'max_connections': 500}})
+
+    ## db.m5d.xlarge: 16 GiB and 4 vCPUs, gp3 under 400 GiB: 3000 IOPS
+    parameters = {p['name']: p for p in inputs['std-eks-pgroup']['parameters']}
+    assert parameters['innodb_buffer_pool_size']['value'] == str(89 * 128 * 1024 ** 2)
+    assert (parameters['innodb_io_capacity']['value'], parameters['innodb_io_capacity_max']['value']) == ('1500', '3000')
+    assert parameters['innodb_redo_log_capacity']['value'] == str(89 * 32 * 1024 ** 2)
+    ## rds.parameters win
+    assert float(parameters['max_connections']['value']) == 500
+    assert parameters['innodb_buffer_pool_size']['applyMethod'] == 'immediate'
+    assert parameters['character_set_server']['value'] == 'utf8'
+
+def test_postgres_parameters():
+    from modules import rds_tuning
+
+    parameters = rds_tuning.postgres_parameters('oltp', 16384, 4, 3000)
+    assert parameters['shared_buffers'] == 4 * 1024 ** 3 // 8192
+    assert parameters['max_connections'] == 1802
+    assert parameters['max_parallel_workers_per_gather'] == 2
+    assert rds_tuning.apply_method('postgres', 'shared_buffers') == 'pending-reboot'
+    assert rds_tuning.apply_method('postgres', 'work_mem') is None
+
+    analytics = rds_tuning.postgres_parameters('analytics', 16384, 4, None)
+    assert analytics['max_connections'] == 450 and analytics['work_mem'] > parameters['work_mem']
+    assert 'random_page_cost' not in analytics
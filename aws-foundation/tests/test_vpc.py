@@ -1,14 +1,16 @@
 import pulumi
-import os, sys
+import copy, os, sys
+import pytest
 from mocks import Ec2Mocks
 
 pulumi.runtime.set_mocks(Ec2Mocks(), preview=False)
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from config import AWSPulumiConfig
+from config import AWSPulumiConfig, VpcEndpointsConfig
 stack = 'foundation'
 
 import modules.vpc as vpc
+import modules.subnets as subnets
 config = AWSPulumiConfig(stack)
 
 new_vpc = vpc.define_vpc(config)
@@ -29,3 +31,108 @@ def test_subnet():
         assert len(privsubs) > 0, f"We must have private subnets"
 
     return pulumi.Output.all(new_vpc['public_subnets'], new_vpc['private_subnets']).apply(check_subnets)
+
+def test_availability_zones_exposed():
+    assert new_vpc['availability_zone_ids'] == ["use1-az1", "use1-az2", "use1-az3", "use1-az4"]
+    assert len(new_vpc['availability_zones']) == len(new_vpc['availability_zone_ids'])
+
+def test_availability_zones_memoized(monkeypatch):
+    calls = []
+    _invoke = vpc.paws.get_availability_zones
+    monkeypatch.setattr(vpc.paws, 'get_availability_zones', lambda **kw: calls.append(kw) or _invoke(**kw))
+    monkeypatch.setattr(vpc.common, '_invoke_cache', {})
+
+    assert vpc.get_availability_zones() == vpc.get_availability_zones()
+    assert len(calls) == 1
+
+def _vpc_with(prefix: str, **settings) -> dict:
+    _config = copy.deepcopy(config)
+    _config.resource_prefix = prefix
+    for k, v in settings.items():
+        setattr(_config.vpc, k, v)
+    return vpc.define_vpc(_config)
+
+single_nat = _vpc_with('single', nat_mode='single', num_private_subnets=2, num_public_subnets=2)
+per_az_nat = _vpc_with('per-az', nat_mode='per_az', num_private_subnets=2, num_public_subnets=2,
+    endpoints=VpcEndpointsConfig(gateway=['s3'], interface=['ecr.api', 'ecr.dkr', 'sts']))
+
+@pulumi.runtime.test
+def test_nat_mode():
+    def check(args):
+        single, per_az = args
+        assert len(single) == 1, "one private route table for all private subnets"
+        assert len(per_az) == 2, "a private route table per AZ"
+
+    return pulumi.Output.all(single_nat['private_route_tables'], per_az_nat['private_route_tables']).apply(check)
+
+def test_no_endpoints_by_default():
+    assert single_nat['vpc_endpoints'] == {}
+    assert single_nat['endpoint_security_group'] is None
+
+@pulumi.runtime.test
+def test_endpoints():
+    def check(args):
+        endpoints, security_group = args
+        assert sorted(endpoints) == ['ecr.api', 'ecr.dkr', 's3', 'sts']
+        assert security_group is not None
+
+    return pulumi.Output.all(per_az_nat['vpc_endpoints'], per_az_nat['endpoint_security_group']).apply(check)
+
+def test_subnet_plan_stable():
+    ## With one subnet size the plan is the VPC sliced in order, the CIDRs subnets had before the planner
+    azs = vpc.get_availability_zones()
+    plan = vpc.plan_subnets(config, azs)
+    assert [s['cidr'] for s in plan] == ['192.168.0.0/24', '192.168.1.0/24', '192.168.2.0/24', '192.168.3.0/24']
+    assert [s['name'] for s in plan] == ['foundation-privnet-0', 'foundation-privnet-1', 'foundation-pubnet-2', 'foundation-pubnet-3']
+    assert vpc.plan_subnets(config, azs) == plan
+
+def test_subnet_plan_sizes_and_azs():
+    _config = copy.deepcopy(config)
+    for k, v in dict(cidr='10.0.0.0/16', subnet_size=24, private_subnet_size=19, public_subnet_size=26,
+                     num_private_subnets=6, num_public_subnets=2, secondary_cidrs=['100.64.0.0/10'],
+                     num_pod_subnets=3, pod_subnet_size=16).items():
+        setattr(_config.vpc, k, v)
+    plan = vpc.plan_subnets(_config, vpc.get_availability_zones())
+
+    private = [s for s in plan if s['tier'] == 'private']
+    assert [s['cidr'] for s in private[:2]] == ['10.0.0.0/19', '10.0.32.0/19']
+    assert [s['az_index'] for s in private] == [0, 1, 2, 3, 0, 1], "round-robin over the 4 AZs"
+    assert [s['cidr'] for s in plan if s['tier'] == 'public'] == ['10.0.192.0/26', '10.0.192.64/26']
+    assert [s['cidr'] for s in plan if s['tier'] == 'pod'] == ['100.64.0.0/16', '100.65.0.0/16', '100.66.0.0/16']
+    table = subnets.format_table(plan).splitlines()
+    assert table[0].split() == ['tier', 'name', 'cidr', 'addresses', 'az'] and len(table) == len(plan) + 1
+
+def test_subnet_allocator_is_lazy():
+    allocator = subnets.SubnetAllocator(['10.0.0.0/8'])
+    assert [allocator.allocate(28) for _ in range(2)] == ['10.0.0.0/28', '10.0.0.16/28']
+    assert allocator.allocate(9) == '10.128.0.0/9'
+    with pytest.raises(ValueError):
+        allocator.allocate(9)
+
+pod_vpc = _vpc_with('pods', num_private_subnets=6, secondary_cidrs=['100.64.0.0/16'], num_pod_subnets=2, pod_subnet_size=18)
+
+@pulumi.runtime.test
+def test_pod_subnets():
+    def check(args):
+        private, pods = args
+        assert len(private) == 6
+        assert len(pods) == 2
+
+    return pulumi.Output.all(pod_vpc['private_subnets'], pod_vpc['pod_subnets']).apply(check)
+
+def test_ipv6_subnets():
+    assert subnets.ipv6_subnet('2600:1f18:abcd:ef00::/56', 0) == '2600:1f18:abcd:ef00::/64'
+    assert subnets.ipv6_subnet('2600:1f18:abcd:ef00::/56', 255) == '2600:1f18:abcd:efff::/64'
+    with pytest.raises(ValueError):
+        subnets.ipv6_subnet('2600:1f18:abcd:ef00::/56', 256)
+
+dual_stack = _vpc_with('dual', ipv6=True, nat_mode='per_az')
+
+@pulumi.runtime.test
+def test_dual_stack():
+    def check(args):
+        ipv6_cidr, single_ipv6_cidr = args
+        assert ipv6_cidr == '2600:1f18:abcd:ef00::/56'
+        assert single_ipv6_cidr is None, "IPv4 only unless vpc.ipv6"
+
+    return pulumi.Output.all(dual_stack['vpc_ipv6_cidr'], single_nat['vpc_ipv6_cidr']).apply(check)
@@ -0,0 +1,247 @@
+"""Resource dependency analysis: the DAG of a stack, from a run of the program under Pulumi mocks.
+
+    python tools/dag_analyzer.py --stack std-eks [--mode full minimal] [--durations std-eks.trace.json]
+                                 [--chrome dag.json] [--top 10]
+
+For each dependency mode (the dependency_mode stack setting) it reports:
+  * the estimated time of an `up` from scratch, when every resource starts as soon as its dependencies are
+    done, and the critical path of that schedule
+  * redundant explicit dependencies: depends_on entries that are an input already, or that another
+    dependency implies
+  * the explicit dependencies that delay a resource the most, compared to its inputs alone
+
+Create times are estimates per resource type (DURATIONS), or the slowest step per type in a trace
+recorded with tools/deploy_trace.py (--durations).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'tests'))
+import tools.deploy_trace as deploy_trace
+
+## Typical create times in seconds, anything else is DEFAULT_DURATION
+DURATIONS = {
+    'eks:index:Cluster': 600,
+    'eks:index:ManagedNodeGroup': 240,
+    'aws:eks/addon:Addon': 60,
+    'kubernetes:helm.sh/v3:Release': 90,
+    'aws:ec2/natGateway:NatGateway': 100,
+    'aws:ec2/vpcEndpoint:VpcEndpoint': 90,
+    'aws:ec2/instance:Instance': 30,
+    'aws:lb/loadBalancer:LoadBalancer': 180,
+    'aws:efs/fileSystem:FileSystem': 10,
+    'aws:efs/mountTarget:MountTarget': 90,
+    'aws:rds/instance:Instance': 600,
+    'aws:rds/cluster:Cluster': 300,
+    'aws:rds/clusterInstance:ClusterInstance': 480,
+}
+DEFAULT_DURATION = 2
+
+## Resources that aren't created by a provider
+_SKIP_TYPES = ('pulumi:pulumi:Stack', 'pulumi:pulumi:StackReference')
+
+
+def capture(stack: str, mode: str) -> dict:
+    ## {urn: {'type', 'name', 'dependencies', 'implicit', 'explicit'}} of a run of the program under mocks.
+    ## Meant to be called in a fresh interpreter (see run_capture).
+    import pulumi
+    import pulumi.runtime.resource as runtime_resource
+    from pulumi.runtime.sync_await import _sync_await
+    from mocks import ProgramMocks, run_program
+
+    config = stack_config(stack)
+    config['dependency_mode'] = mode
+
+    ## The engine only gets all dependencies and the ones from inputs; depends_on is recorded on the way
+    explicit = []
+    _resolve_depends_on_urns = runtime_resource._resolve_depends_on_urns
+
+    async def _record_depends_on(options, from_resource):
+        urns = await _resolve_depends_on_urns(options, from_resource)
+        explicit.append((from_resource, urns))
+        return urns
+
+    runtime_resource._resolve_depends_on_urns = _record_depends_on
+
+    nodes = {}
+
+    def _watch_registrations():
+        ## Runs once the mocks are set: record every registration the mock monitor gets
+        monitor = pulumi.runtime.settings.get_monitor()
+        _register_resource = monitor.RegisterResource
+
+        def _register(request):
+            implicit = set()
+            for deps in request.propertyDependencies.values():
+                implicit.update(deps.urns)
+            nodes[monitor.make_urn(request.parent, request.type, request.name)] = {
+                'type': request.type,
+                'name': request.name,
+                'dependencies': sorted(request.dependencies),
+                'implicit': sorted(implicit),
+                'explicit': [],
+            }
+            return _register_resource(request)
+
+        monitor.RegisterResource = _register
+
+    run_program(stack, config, ProgramMocks(), before_run=_watch_registrations)
+
+    for res, urns in explicit:
+        urn = _sync_await(res.urn.future())
+        if urn in nodes:
+            nodes[urn]['explicit'] = sorted(urns)
+    return {urn: n for urn, n in nodes.items() if n['type'] not in _SKIP_TYPES}
+
+
+def stack_config(stack: str) -> dict:
+    import yaml
+    from constants import Constants as CONST
+
+    config_file = os.path.join(CONST.PATH_STACK_CONFIGS, f'sc-{stack}.yaml')
+    if not os.path.isfile(config_file):
+        config_file = os.path.join(CONST.PATH_STACK_CONFIGS, f'sc-{stack}.example.yaml')
+    with open(config_file, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def run_capture(stack: str, mode: str) -> dict:
+    out = subprocess.run(
+        [sys.executable, __file__, '--capture', json.dumps({'stack': stack, 'mode': mode})],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f'{stack} ({mode}) failed:\n{out.stderr}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def durations_from_trace(trace_file: str) -> dict:
+    ## {type: seconds}, the slowest step of each resource type in a recorded trace
+    records, _ = deploy_trace.load_trace(trace_file)
+    durations = {}
+    for s in deploy_trace.build_steps(records).values():
+        durations[s['type']] = max(durations.get(s['type'], 0), s['duration'])
+    return durations
+
+
+def _dependencies(nodes: dict, urn: str, implicit_only: bool = False) -> list:
+    n = nodes[urn]
+    deps = n['implicit'] if implicit_only else n['dependencies']
+    return [d for d in deps if d in nodes and d != urn]
+
+
+def schedule(nodes: dict, durations: dict) -> dict:
+    ## deploy_trace steps for an `up` from scratch where everything starts as soon as its dependencies are done
+    steps = {}
+
+    def _step(urn: str) -> dict:
+        if urn not in steps:
+            n = nodes[urn]
+            start = max((_step(d)['end'] for d in _dependencies(nodes, urn)), default=0)
+            duration = durations.get(n['type'], DEFAULT_DURATION)
+            steps[urn] = {'urn': urn, 'name': n['name'], 'type': n['type'], 'op': 'create', 'parent': '',
+                          'start': start, 'end': start + duration, 'duration': duration, 'status': 'planned'}
+        return steps[urn]
+
+    for urn in nodes:
+        _step(urn)
+    return steps
+
+
+def _reachable(nodes: dict, start: list, skip: str) -> set:
+    seen = set()
+    todo = [d for d in start if d != skip]
+    while todo:
+        urn = todo.pop()
+        if urn in seen:
+            continue
+        seen.add(urn)
+        todo.extend(_dependencies(nodes, urn))
+    return seen
+
+
+def redundant_dependencies(nodes: dict) -> list:
+    ## [(urn, dependency, reason)] for depends_on entries that don't change the order of anything
+    redundant = []
+    for urn, n in nodes.items():
+        deps = _dependencies(nodes, urn)
+        for d in n['explicit']:
+            if d not in nodes:
+                continue
+            if d in n['implicit']:
+                redundant.append((urn, d, 'already an input'))
+            elif d in _reachable(nodes, deps, d):
+                redundant.append((urn, d, 'implied by another dependency'))
+    return redundant
+
+
+def explicit_delays(nodes: dict, steps: dict) -> list:
+    ## [(seconds, urn)] how much later a resource starts because of its explicit dependencies, compared
+    ## to when its inputs are done
+    delays = []
+    for urn, n in nodes.items():
+        if not n['explicit']:
+            continue
+        inputs_done = max((steps[d]['end'] for d in _dependencies(nodes, urn, implicit_only=True)), default=0)
+        delay = steps[urn]['start'] - inputs_done
+        if delay > 0:
+            delays.append((delay, urn))
+    return sorted(delays, reverse=True)
+
+
+def report(nodes: dict, durations: dict, top: int = 10) -> tuple:
+    steps = schedule(nodes, durations)
+    dependencies = {urn: _dependencies(nodes, urn) for urn in nodes}
+    lines = [deploy_trace.summary(steps, dependencies, top).replace('steps,', 'resources, estimated', 1)]
+
+    redundant = redundant_dependencies(nodes)
+    lines += ['', f'Redundant explicit dependencies ({len(redundant)}):']
+    lines += [f'  {nodes[urn]["name"]} -> {nodes[d]["name"]}: {reason}' for urn, d, reason in redundant]
+
+    delays = explicit_delays(nodes, steps)
+    lines += ['', f'Explicit dependencies delaying a resource (top {top}):']
+    lines += [f'  {delay:8.1f}s  {nodes[urn]["type"]}  {nodes[urn]["name"]}' for delay, urn in delays[:top]]
+    return '\n'.join(lines), steps, dependencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stack', default='std-eks')
+    parser.add_argument('--mode', nargs='+', default=['full', 'minimal'], choices=['full', 'minimal'])
+    parser.add_argument('--durations', help='take the create times from a trace recorded with tools/deploy_trace.py')
+    parser.add_argument('--chrome', help='write the estimated schedule of the first mode as a Chrome trace')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--capture', help=argparse.SUPPRESS)
+    opts = parser.parse_args()
+
+    if opts.capture:
+        args = json.loads(opts.capture)
+        print(json.dumps(capture(args['stack'], args['mode'])))
+        return
+
+    durations = dict(DURATIONS)
+    if opts.durations:
+        durations.update(durations_from_trace(opts.durations))
+
+    totals = {}
+    for i, mode in enumerate(opts.mode):
+        nodes = run_capture(opts.stack, mode)
+        text, steps, dependencies = report(nodes, durations, opts.top)
+        totals[mode] = max((s['end'] for s in steps.values()), default=0)
+        print(f'== {opts.stack}, dependency_mode: {mode}\n{text}\n')
+
+        if opts.chrome and i == 0:
+            with open(opts.chrome, 'w') as f:
+                json.dump(deploy_trace.chrome_trace(steps, dependencies), f)
+
+    if len(totals) > 1:
+        print('Estimated time: ' + ', '.join(f'{mode} {total:.0f}s' for mode, total in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Deployment traces: per-resource step timings of a `pulumi up`, from the engine event stream.
+
+Record an update through the Automation API (the event log and the resource dependencies are saved,
+so the trace can be looked at again later without AWS):
+
+    python tools/deploy_trace.py record --stack std-eks --log std-eks.trace.json [--preview]
+
+Replay a saved trace, or the event log of a CLI run (`pulumi up --event-log events.jsonl`, with the
+dependencies from `pulumi stack export --file state.json`):
+
+    python tools/deploy_trace.py replay std-eks.trace.json [--chrome trace.json] [--top 10]
+    python tools/deploy_trace.py replay events.jsonl --state state.json --chrome trace.json
+
+The --chrome file opens in chrome://tracing or https://ui.perfetto.dev. The summary printed is the
+critical path: the chain of steps, each gated by its dependency that finished last, that ends with the
+last step to finish.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+## Version of the saved trace format
+TRACE_VERSION = 1
+
+## Engine events that start, finish and fail a resource step (keys as in the CLI's event log)
+_STEP_EVENTS = {
+    'resourcePreEvent': 'start',
+    'resOutputsEvent': 'end',
+    'resOpFailedEvent': 'failed',
+}
+
+## Steps that don't call the provider, so take no time worth showing
+_NOOP_OPS = ('same', 'read-discard', 'discard-replaced')
+
+
+def _metadata_record(kind: str, metadata: dict, sequence: int, timestamp: float) -> dict:
+    new = metadata.get('new') or {}
+    old = metadata.get('old') or {}
+    return {
+        'kind': kind,
+        'sequence': sequence,
+        'timestamp': timestamp,
+        'urn': metadata.get('urn', ''),
+        'type': metadata.get('type', ''),
+        'op': metadata.get('op', ''),
+        'parent': new.get('parent') or old.get('parent') or '',
+    }
+
+
+def record_from_json(data: dict) -> dict:
+    ## A record for an engine event as written to the CLI's --event-log; None when it isn't a step event
+    for key, kind in _STEP_EVENTS.items():
+        if data.get(key):
+            return _metadata_record(kind, data[key].get('metadata') or {}, data.get('sequence', 0), data.get('timestamp', 0))
+    return None
+
+
+def record_from_event(event, received: float = None) -> dict:
+    ## A record for an Automation API EngineEvent. The engine timestamps have a resolution of a second,
+    ## so the time the event was received is used when it's known.
+    for attr, kind in (('resource_pre_event', 'start'), ('res_outputs_event', 'end'), ('res_op_failed_event', 'failed')):
+        step = getattr(event, attr, None)
+        if step:
+            m = step.metadata
+            state = m.new or m.old
+            return {
+                'kind': kind,
+                'sequence': event.sequence,
+                'timestamp': received if received is not None else event.timestamp,
+                'urn': m.urn,
+                'type': m.type,
+                'op': m.op.value if hasattr(m.op, 'value') else m.op,
+                'parent': state.parent if state else '',
+            }
+    return None
+
+
+def dependencies_from_deployment(deployment: dict) -> dict:
+    ## {urn: [urns it depends on]} from a stack export (`pulumi stack export` or Stack.export_stack())
+    deployment = deployment.get('deployment', deployment)
+    return {r['urn']: list(r.get('dependencies') or []) for r in deployment.get('resources') or []}
+
+
+def build_steps(records: list) -> dict:
+    ## {urn: step} with the start/end (seconds since the first step started), op, type and status of each step
+    steps = {}
+    for r in sorted(records, key=lambda r: r['sequence']):
+        step = steps.setdefault(r['urn'], {
+            'urn': r['urn'], 'name': r['urn'].split('::')[-1], 'type': r['type'], 'op': r['op'],
+            'parent': r['parent'], 'start': None, 'end': None, 'status': 'running',
+        })
+        if r['kind'] == 'start':
+            step['start'] = r['timestamp']
+            step['op'] = r['op']
+        else:
+            step['end'] = r['timestamp']
+            step['status'] = 'done' if r['kind'] == 'end' else 'failed'
+
+    steps = {urn: s for urn, s in steps.items() if s['start'] is not None and s['op'] not in _NOOP_OPS}
+    if not steps:
+        return steps
+
+    origin = min(s['start'] for s in steps.values())
+    last = max(s['end'] if s['end'] is not None else s['start'] for s in steps.values())
+    for s in steps.values():
+        ## A step without an end was still running when the log stops
+        s['start'] = s['start'] - origin
+        s['end'] = (s['end'] if s['end'] is not None else last) - origin
+        s['duration'] = s['end'] - s['start']
+    return steps
+
+
+def critical_path(steps: dict, dependencies: dict) -> list:
+    ## Walks back from the step that finished last, each time to the dependency that finished last
+    ## (the one it was waiting for). Dependencies without a step (unchanged resources) are skipped
+    ## over to their own dependencies.
+    if not steps:
+        return []
+
+    def _gating(urn: str, seen: set) -> list:
+        found = []
+        for dep in dependencies.get(urn, []):
+            if dep in seen:
+                continue
+            seen.add(dep)
+            if dep in steps:
+                found.append(steps[dep])
+            else:
+                found.extend(_gating(dep, seen))
+        return found
+
+    path = [max(steps.values(), key=lambda s: (s['end'], s['duration']))]
+    while True:
+        candidates = _gating(path[-1]['urn'], set())
+        if not candidates:
+            break
+        path.append(max(candidates, key=lambda s: s['end']))
+    return list(reversed(path))
+
+
+def chrome_trace(steps: dict, dependencies: dict = None) -> dict:
+    ## Chrome trace event format (complete events). Steps are put on rows ("threads") so that the steps
+    ## of a row don't overlap, which is what the trace viewers expect.
+    dependencies = dependencies or {}
+    rows = []
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'pulumi up'}}]
+    for s in sorted(steps.values(), key=lambda s: (s['start'], -s['duration'])):
+        row = next((i for i, end in enumerate(rows) if end <= s['start']), len(rows))
+        if row == len(rows):
+            rows.append(0)
+        rows[row] = s['end']
+        events.append({
+            'name': s['name'],
+            'cat': s['op'],
+            'ph': 'X',
+            'pid': 1,
+            'tid': row + 1,
+            'ts': round(s['start'] * 1e6),
+            'dur': round(s['duration'] * 1e6),
+            'args': {'urn': s['urn'], 'type': s['type'], 'op': s['op'], 'status': s['status'],
+                     'dependencies': [d for d in dependencies.get(s['urn'], []) if d in steps]},
+        })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def summary(steps: dict, dependencies: dict, top: int = 10) -> str:
+    if not steps:
+        return 'No resource steps in the event log'
+
+    total = max(s['end'] for s in steps.values())
+    lines = [f'{len(steps)} steps, {total:.1f}s', '', 'Critical path:']
+    for s in critical_path(steps, dependencies):
+        lines.append(f'  {s["start"]:8.1f}s  {s["duration"]:8.1f}s  {s["op"]:8}  {s["type"]}  {s["name"]}'
+                     + ('  (failed)' if s['status'] == 'failed' else ''))
+
+    by_type = {}
+    for s in steps.values():
+        by_type.setdefault(s['type'], []).append(s['duration'])
+    lines += ['', f'Slowest resource types (top {top}):']
+    for typ, durations in sorted(by_type.items(), key=lambda t: -max(t[1]))[:top]:
+        lines.append(f'  {max(durations):8.1f}s max  {sum(durations):8.1f}s total  {len(durations):3}x  {typ}')
+    return '\n'.join(lines)
+
+
+def save_trace(path: str, records: list, dependencies: dict, stack: str = None):
+    with open(path, 'w') as f:
+        json.dump({'version': TRACE_VERSION, 'stack': stack, 'records': records, 'dependencies': dependencies}, f, indent=1)
+
+
+def load_trace(path: str, state_file: str = None) -> tuple:
+    ## (records, dependencies) from a saved trace, or from the JSON lines event log of the CLI
+    with open(path, 'r') as f:
+        content = f.read()
+
+    try:
+        trace = json.loads(content)
+    except json.JSONDecodeError:
+        trace = None
+
+    if isinstance(trace, dict) and 'records' in trace:
+        records, dependencies = trace['records'], trace.get('dependencies') or {}
+    else:
+        events = [json.loads(line) for line in content.splitlines() if line.strip()]
+        records = [r for r in map(record_from_json, events) if r]
+        dependencies = {}
+
+    if state_file:
+        with open(state_file, 'r') as f:
+            dependencies = dependencies_from_deployment(json.load(f))
+    return records, dependencies
+
+
+def record(stack_name: str, work_dir: str = ROOT, preview: bool = False) -> tuple:
+    ## Run `up` (or `preview`) for the stack through the Automation API and capture its step events.
+    ## Returns (records, dependencies, error); a failed update is often the one worth looking at, so
+    ## what was captured is returned either way.
+    from pulumi import automation
+
+    records = []
+    error = None
+
+    def on_event(event):
+        r = record_from_event(event, time.time())
+        if r:
+            records.append(r)
+
+    stack = automation.select_stack(stack_name=stack_name, work_dir=work_dir)
+    try:
+        if preview:
+            stack.preview(on_event=on_event)
+        else:
+            stack.up(on_event=on_event)
+    except automation.errors.CommandError as e:
+        error = str(e)
+
+    dependencies = dependencies_from_deployment(stack.export_stack().deployment)
+    return records, dependencies, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    rec = sub.add_parser('record', help='run pulumi up through the Automation API and save the trace')
+    rec.add_argument('--stack', required=True)
+    rec.add_argument('--log', required=True, help='where to save the trace')
+    rec.add_argument('--work-dir', default=ROOT)
+    rec.add_argument('--preview', action='store_true', help='run a preview instead of an update')
+
+    rep = sub.add_parser('replay', help='analyze a saved trace or a CLI --event-log file')
+    rep.add_argument('log')
+    rep.add_argument('--state', help='stack export with the resource dependencies (for CLI event logs)')
+
+    for p in (rec, rep):
+        p.add_argument('--chrome', help='write a Chrome trace / Perfetto JSON file')
+        p.add_argument('--top', type=int, default=10)
+    opts = parser.parse_args()
+
+    if opts.command == 'record':
+        records, dependencies, error = record(opts.stack, opts.work_dir, opts.preview)
+        save_trace(opts.log, records, dependencies, opts.stack)
+    else:
+        records, dependencies = load_trace(opts.log, opts.state)
+        error = None
+
+    steps = build_steps(records)
+    if opts.chrome:
+        with open(opts.chrome, 'w') as f:
+            json.dump(chrome_trace(steps, dependencies), f)
+    print(summary(steps, dependencies, opts.top))
+
+    if error:
+        print(f'\nThe update failed:\n{error}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Snapshots of the foundation stack's outputs, for stacks with foundation_snapshot.enabled.
+
+    python tools/foundation_snapshot.py save [--up] [--include-secrets] [--file path]
+    python tools/foundation_snapshot.py check [--refresh] [--file path]
+
+save reads the outputs of the foundation stack (after running `up` first with --up) and writes the
+snapshot, together with the version of the foundation stack's last update. check compares a snapshot
+with the last update and exits with 1 when it's stale (or rewrites it with --refresh), or when the last
+update can't be determined.
+
+Secret outputs are left out of the snapshot unless --include-secrets is given, the file isn't encrypted.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import modules.foundation as foundation
+
+
+def save(path: str, up: bool = False, include_secrets: bool = False) -> dict:
+    from pulumi import automation
+
+    stack = automation.select_stack(stack_name=foundation.FOUNDATION_STACK, work_dir=ROOT)
+    if up:
+        stack.up(on_output=print)
+
+    outputs = {
+        name: {'value': output.value, 'secret': output.secret}
+        for name, output in stack.outputs().items()
+        if include_secrets or not output.secret
+    }
+    project = stack.workspace.project_settings().name
+    return foundation.write_snapshot(path, project, outputs, foundation.latest_update(work_dir=ROOT))
+
+
+def _update_version(snapshot: dict) -> str:
+    ## 'unknown' when the stack had no succeeded update yet, or its history couldn't be read
+    return (snapshot['update'] or {}).get('version', 'unknown')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    _save = sub.add_parser('save', help='write a snapshot of the foundation outputs')
+    _save.add_argument('--up', action='store_true', help='run `pulumi up` on the foundation stack first')
+    _save.add_argument('--include-secrets', action='store_true')
+    _check = sub.add_parser('check', help='check that the snapshot is from the last foundation update')
+    _check.add_argument('--refresh', action='store_true', help='take a new snapshot when it is stale')
+    for p in (_save, _check):
+        p.add_argument('--file', default=foundation.snapshot_file())
+    opts = parser.parse_args()
+
+    if opts.command == 'save':
+        snapshot = save(opts.file, opts.up, opts.include_secrets)
+        print(f'Saved {len(snapshot["outputs"])} outputs of update {_update_version(snapshot)} to {opts.file}')
+        return
+
+    update = foundation.latest_update(work_dir=ROOT)
+    if not update:
+        ## Nothing to compare the snapshot's version with, so it can't be called up to date
+        print(f"{opts.file} can't be checked: the {foundation.FOUNDATION_STACK} stack has no succeeded update, or its history can't be read")
+        sys.exit(1)
+
+    try:
+        reason = foundation.stale_reason(foundation.load_snapshot(opts.file), update=update)
+    except (OSError, ValueError) as e:
+        reason = str(e)
+
+    if not reason:
+        print(f'{opts.file} is up to date')
+    elif opts.refresh:
+        snapshot = save(opts.file)
+        print(f'{opts.file} was stale ({reason}), saved update {_update_version(snapshot)}')
+    else:
+        print(f'{opts.file} is stale: {reason}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
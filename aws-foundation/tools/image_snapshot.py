@@ -0,0 +1,205 @@
+"""Builds a node data volume snapshot with container images pulled already, for storage.data_volume.snapshot_id.
+
+    python tools/image_snapshot.py --subnet subnet-0123 --instance-profile ssm-profile
+                                   [--stack std-eks] [--pool ci] [--instance-type m6a.large]
+                                   [--fast-restore us-east-1a us-east-1b]
+
+Launches a builder instance from the pool's EKS-optimized AMI (AL2023 or Bottlerocket, with the pool's
+architecture) and data volume, pulls storage.data_volume.images into its containerd through SSM, stops it
+and snapshots the data volume. Nodes launched with the snapshot start with those images, only what
+changed since is pulled.
+
+Needs the aws CLI, a subnet with a route to the registries, and an instance profile with
+AmazonSSMManagedInstanceCore, and AmazonEC2ContainerRegistryReadOnly for ECR images: the builder gets
+their tokens itself, so no credential ends up in the SSM command history. A volume
+created from a snapshot reads its blocks from S3 on first access, --fast-restore enables Fast Snapshot
+Restore in the given AZs so new nodes get the full speed right away (billed per AZ and hour).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+## SSM command states that aren't final
+_PENDING = ('Pending', 'InProgress', 'Delayed')
+## Gets the ECR tokens on Bottlerocket builders
+_AWS_CLI_IMAGE = 'public.ecr.aws/aws-cli/aws-cli:latest'
+
+
+def aws(*args) -> object:
+    out = subprocess.run(['aws', *args, '--output', 'json'], capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f'aws {" ".join(args[:2])} failed:\n{out.stderr}')
+    return json.loads(out.stdout) if out.stdout.strip() else None
+
+
+def qualified(image: str) -> str:
+    ## ctr doesn't expand short names like docker does: busybox:1.36 is docker.io/library/busybox:1.36
+    first = image.split('/')[0]
+    if '/' in image and ('.' in first or ':' in first or first == 'localhost'):
+        return image
+    return f'docker.io/{image}' if '/' in image else f'docker.io/library/{image}'
+
+
+def ecr_registries(images: list) -> list:
+    ## The ECR registries of the images, in order
+    registries = []
+    for image in images:
+        registry = image.split('/')[0]
+        if '.dkr.ecr.' in registry and registry not in registries:
+            registries.append(registry)
+    return registries
+
+
+def pull_commands(ami_family: str, images: list) -> list:
+    ## Shell commands that pull the images into the k8s.io namespace, where kubelet looks for them
+    if ami_family == 'BOTTLEROCKET':
+        ## Runs in the control container, containerd is reached through the admin container
+        ctr = 'apiclient exec admin sheltie ctr -a /run/containerd/containerd.sock'
+        commands = []
+    else:
+        ctr = 'ctr'
+        commands = ['systemctl start containerd']
+
+    ## ECR tokens come from the builder's instance profile, into shell variables: a token in the command
+    ## text would stay readable in the SSM command history. Bottlerocket has no aws CLI, it runs from an image.
+    registries = ecr_registries(list(map(qualified, images)))
+    aws = 'aws'
+    if registries and ami_family == 'BOTTLEROCKET':
+        aws = f'{ctr} -n default run --rm --net-host {_AWS_CLI_IMAGE} aws-cli aws'
+        commands.append(f'{ctr} -n default images pull {_AWS_CLI_IMAGE}')
+    for i, registry in enumerate(registries):
+        commands.append(f'ECR_{i}=$({aws} ecr get-login-password --region {registry.split(".")[3]})')
+
+    for image in map(qualified, images):
+        registry = image.split('/')[0]
+        user = f' --user AWS:$ECR_{registries.index(registry)}' if registry in registries else ''
+        commands.append(f'{ctr} -n k8s.io images pull --label io.cri-containerd.image=managed{user} {image}')
+
+    if registries and ami_family == 'BOTTLEROCKET':
+        commands.append(f'{ctr} -n default images rm {_AWS_CLI_IMAGE}')
+    return commands + ['sync']
+
+
+def _block_device(device: str, volume: object) -> dict:
+    ebs = {'VolumeSize': volume.size, 'VolumeType': volume.type, 'Encrypted': volume.encrypted, 'DeleteOnTermination': True}
+    if volume.iops:
+        ebs['Iops'] = volume.iops
+    if volume.throughput:
+        ebs['Throughput'] = volume.throughput
+    return {'DeviceName': device, 'Ebs': {k: v for k, v in ebs.items() if v is not None}}
+
+
+def _wait_ssm_online(instance_id: str, timeout: int = 600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        info = aws('ssm', 'describe-instance-information', '--filters', f'Key=InstanceIds,Values={instance_id}')
+        if any(i['PingStatus'] == 'Online' for i in info['InstanceInformationList']):
+            return
+        time.sleep(10)
+    raise RuntimeError(f'{instance_id} did not register with SSM, does the instance profile have AmazonSSMManagedInstanceCore?')
+
+
+def _run_commands(instance_id: str, commands: list, timeout: int = 3600):
+    command_id = aws('ssm', 'send-command', '--instance-ids', instance_id, '--document-name', 'AWS-RunShellScript',
+                     '--timeout-seconds', str(timeout), '--parameters', json.dumps({'commands': commands}))['Command']['CommandId']
+    while True:
+        time.sleep(10)
+        try:
+            result = aws('ssm', 'get-command-invocation', '--command-id', command_id, '--instance-id', instance_id)
+        except RuntimeError:
+            ## Not known yet right after sending
+            continue
+        if result['Status'] not in _PENDING:
+            break
+    if result['Status'] != 'Success':
+        raise RuntimeError(f'Pulling the images failed ({result["Status"]}):\n{result["StandardErrorContent"]}')
+
+
+def build(config, pool_name: str, subnet: str, instance_profile: str, instance_type: str = None, fast_restore: list = None) -> str:
+    import modules.common as common
+    from constants import Constants as CONST
+
+    pool = next((p for p in config.node_pools() if p.name == pool_name), None)
+    if not pool:
+        raise ValueError(f'No node pool {pool_name}, the stack has {", ".join(p.name for p in config.node_pools())}')
+    node_groups = pool.node_groups(config.eks.node_groups)
+    volume = node_groups.storage.data_volume
+    if not volume or not volume.images:
+        raise ValueError(f'Node pool {pool_name} has no storage.data_volume.images to pull')
+
+    ami_family = node_groups.ami_family or 'AL2023'
+    parameter = CONST.EKS_AMI_SSM_PARAMETERS[ami_family].format(version=config.eks.version, architecture=node_groups.architecture or 'x86_64')
+    ami = aws('ssm', 'get-parameter', '--name', parameter)['Parameter']['Value']
+    instance_type = instance_type or next(t for t in node_groups.instance_types if '*' not in t)
+
+    ## The AL2023 builder mounts the data volume on /var/lib/containerd like the nodes do, Bottlerocket
+    ## has it there already and needs the admin container to reach containerd
+    if ami_family == 'BOTTLEROCKET':
+        user_data = '[settings.host-containers.admin]\nenabled = true\n'
+    else:
+        user_data = common.get_datafile(CONST.FILE_NODE_DATA_VOLUME)
+
+    name = f'{config.resource_prefix}-{pool_name}-image-snapshot'
+    tags = [{'Key': 'Name', 'Value': name}] + [{'Key': k, 'Value': v} for k, v in config.tags.items()]
+    instance_id = aws('ec2', 'run-instances', '--image-id', ami, '--instance-type', instance_type, '--subnet-id', subnet,
+                      '--iam-instance-profile', f'Name={instance_profile}', '--user-data', user_data,
+                      '--block-device-mappings', json.dumps([_block_device(CONST.NODE_DATA_DEVICE, volume)]),
+                      '--tag-specifications', json.dumps([{'ResourceType': 'instance', 'Tags': tags}])
+                      )['Instances'][0]['InstanceId']
+    print(f'Builder {instance_id} ({ami}, {instance_type})')
+
+    try:
+        _wait_ssm_online(instance_id)
+        _run_commands(instance_id, pull_commands(ami_family, volume.images))
+
+        ## Stopped, so the snapshot is consistent
+        aws('ec2', 'stop-instances', '--instance-ids', instance_id)
+        aws('ec2', 'wait', 'instance-stopped', '--instance-ids', instance_id)
+        mappings = aws('ec2', 'describe-instances', '--instance-ids', instance_id)['Reservations'][0]['Instances'][0]['BlockDeviceMappings']
+        volume_id = next(m['Ebs']['VolumeId'] for m in mappings if m['DeviceName'] == CONST.NODE_DATA_DEVICE)
+
+        snapshot_id = aws('ec2', 'create-snapshot', '--volume-id', volume_id, '--description', f'{name}: {len(volume.images)} images',
+                          '--tag-specifications', json.dumps([{'ResourceType': 'snapshot', 'Tags': tags}]))['SnapshotId']
+        print(f'Snapshot {snapshot_id} of {volume_id}')
+        while True:
+            try:
+                aws('ec2', 'wait', 'snapshot-completed', '--snapshot-ids', snapshot_id)
+                break
+            except RuntimeError as e:
+                ## The waiter gives up after 10 minutes, big volumes take longer
+                if 'Max attempts exceeded' not in str(e):
+                    raise
+
+        if fast_restore:
+            aws('ec2', 'enable-fast-snapshot-restores', '--availability-zones', *fast_restore, '--source-snapshot-ids', snapshot_id)
+    finally:
+        aws('ec2', 'terminate-instances', '--instance-ids', instance_id)
+
+    return snapshot_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stack', default='std-eks')
+    parser.add_argument('--pool', default='default', help='node pool name, default for eks.node_groups')
+    parser.add_argument('--subnet', required=True, help='subnet for the builder instance')
+    parser.add_argument('--instance-profile', required=True, help='instance profile with AmazonSSMManagedInstanceCore (and ECR read access for ECR images)')
+    parser.add_argument('--instance-type', help='builder instance type, the first of the pool\'s instance_types by default')
+    parser.add_argument('--fast-restore', nargs='+', metavar='AZ', help='enable Fast Snapshot Restore in these AZs')
+    opts = parser.parse_args()
+
+    from config import AWSPulumiConfig
+
+    config = AWSPulumiConfig(opts.stack)
+    snapshot_id = build(config, opts.pool, opts.subnet, opts.instance_profile, opts.instance_type, opts.fast_restore)
+    print(f'Set storage.data_volume.snapshot_id: {snapshot_id} for the {opts.pool} node pool')
+
+
+if __name__ == '__main__':
+    main()
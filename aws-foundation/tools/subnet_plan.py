@@ -0,0 +1,37 @@
+"""The subnet allocation table of a stack's VPC, without AWS.
+
+    python tools/subnet_plan.py [--stack foundation] [--azs us-east-1a us-east-1b us-east-1c]
+
+Prints the subnets define_vpc would create from the stack config: tier, name, CIDR, size and AZ. The
+AZs default to placeholders (az-0, az-1, ...), pass the names (or ids, with vpc.az_placement: id) of
+the region's AZs to see the real placement. Run it before changing vpc settings: with the same
+settings the table doesn't change, and a subnet whose CIDR changes is replaced.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+import modules.subnets as subnets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stack', default='foundation')
+    parser.add_argument('--azs', nargs='+', help='AZ names or ids, in the order the region lists them')
+    parser.add_argument('--num-azs', type=int, default=3, help='number of placeholder AZs when --azs is not given')
+    opts = parser.parse_args()
+
+    from config import AWSPulumiConfig
+    import modules.vpc as vpc
+
+    config = AWSPulumiConfig(opts.stack)
+    names = opts.azs or [f'az-{i}' for i in range(opts.num_azs)]
+    plan = vpc.plan_subnets(config, {'names': names, 'zone_ids': names})
+
+    print(subnets.format_table(plan))
+
+
+if __name__ == '__main__':
+    main()